@@ -1,28 +1,489 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, Blueprint, request, jsonify, Response, send_file
 from flask_cors import CORS
 import json
+import random
 import time
-import uuid
-import zipfile
-import io
 import os
-from threading import Thread
+import sys
+import base64
+import codecs
+import itertools
+import functools
+import bisect
+import hashlib
+import mimetypes
+import mmap
+import shutil
+import signal
+import tempfile
+import subprocess
+from urllib.parse import urlparse
+from threading import Thread, Lock, RLock, Condition, Event
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import deque, OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 import queue
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
 import logging
 
-# Flask应用初始化
-app = Flask(__name__)
-CORS(app)  # 允许跨域请求
+import cpu_jobs
+from task_channel import TaskStateView, TaskChannel, ChannelSubscription
+from search import SearchIndex, file_search_text, activity_search_text
+from checkpoints import CheckpointStore
+from attachments import UploadError, UploadSession, MultipartUpload, AttachmentStore
+from result_cache import ResultCache, link_or_copy
+from tracing import TaskTrace, traced, SamplingProfiler
+
+# API路由蓝图，由 create_app() 注册到应用上
+api = Blueprint('api', __name__)
 
 # 日志配置
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')  # 任务结束状态
+
+
+class TaskCancelled(Exception):
+    """任务被取消（例如客户端断开且断开策略为cancel）"""
+
+
+# ==================== ID 生成 ====================
+
+class TaskIdGenerator:
+    """
+    时间有序的任务ID生成器（UUIDv7格式）
+    48位毫秒时间戳 + 12位同毫秒单调计数 + 62位随机数，字符串的字典序即创建顺序。
+    随机数从批量读取的 os.urandom 缓冲区中取出，避免每个ID一次系统调用
+    """
+
+    RANDOM_BATCH = 4096  # 每次从 os.urandom 读取的字节数（可生成512个ID）
+
+    def __init__(self):
+        self._lock = Lock()
+        self._last_ms = 0
+        self._counter = 0
+        self._random = b''
+        self._offset = 0
+
+    def _random_bits(self) -> int:
+        if self._offset >= len(self._random):
+            self._random = os.urandom(self.RANDOM_BATCH)
+            self._offset = 0
+        value = int.from_bytes(self._random[self._offset:self._offset + 8], 'big')
+        self._offset += 8
+        return value & ((1 << 62) - 1)
+
+    def new_id(self) -> str:
+        with self._lock:
+            ms = time.time_ns() // 1_000_000
+            if ms <= self._last_ms:
+                # 同一毫秒（或时钟回拨）内递增计数，计数溢出时借用下一毫秒
+                ms = self._last_ms
+                self._counter += 1
+                if self._counter > 0xFFF:
+                    ms += 1
+                    self._counter = 0
+            else:
+                self._counter = 0
+            self._last_ms = ms
+            counter = self._counter
+            rand_b = self._random_bits()
+
+        value = (ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand_b
+        h = value.to_bytes(16, 'big').hex()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+    @staticmethod
+    def lower_bound(timestamp: float) -> str:
+        """给定Unix时间戳对应的最小任务ID，用于按创建时间范围扫描"""
+        h = f"{int(timestamp * 1000) << 80:032x}"
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+task_id_generator = TaskIdGenerator()
+
+
+class TaskIndex:
+    """
+    任务索引
+    以task_id为主键存储任务记录，同时维护状态二级索引；任务ID按创建时间有序，
+    有序的ID列表即创建时间索引。支持按状态/时间范围/提示词前缀过滤的游标分页查询
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Dict[str, Any]] = {}  # 主存储: task_id -> 任务记录
+        self._by_status: Dict[str, set] = {}  # 状态索引: status -> {task_id}
+        self._by_created: List[str] = []  # 有序的task_id列表（即按创建时间排序）
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.tasks
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return self.tasks.get(task_id)
+
+    def add(self, record: Dict[str, Any]):
+        """添加任务记录并写入二级索引"""
+        task_id = record['id']
+        with self._lock:
+            if task_id in self.tasks:
+                self.remove(task_id)
+            self.tasks[task_id] = record
+            self._by_status.setdefault(record['status'], set()).add(task_id)
+            # 新ID通常最大，直接追加
+            if not self._by_created or self._by_created[-1] < task_id:
+                self._by_created.append(task_id)
+            else:
+                bisect.insort(self._by_created, task_id)
+
+    def remove(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """移除任务记录及其索引项"""
+        with self._lock:
+            record = self.tasks.pop(task_id, None)
+            if record is None:
+                return None
+            self._discard_status(record['status'], task_id)
+            pos = bisect.bisect_left(self._by_created, task_id)
+            if pos < len(self._by_created) and self._by_created[pos] == task_id:
+                del self._by_created[pos]
+            return record
+
+    def update_status(self, task_id: str, status: str) -> bool:
+        """
+        更新任务状态并同步状态索引
+
+        Returns:
+            状态是否发生变化
+        """
+        with self._lock:
+            record = self.tasks.get(task_id)
+            if record is None or record['status'] == status:
+                return False
+            self._discard_status(record['status'], task_id)
+            record['status'] = status
+            record['updated_at'] = time.time()
+            if status in FINAL_STATUSES:
+                record['finished_at'] = record['updated_at']
+            self._by_status.setdefault(status, set()).add(task_id)
+            return True
+
+    def _discard_status(self, status: str, task_id: str):
+        ids = self._by_status.get(status)
+        if ids is not None:
+            ids.discard(task_id)
+            if not ids:
+                del self._by_status[status]
+
+    def all(self) -> List[Dict[str, Any]]:
+        """按创建时间排序的全部任务记录"""
+        with self._lock:
+            return [self.tasks[task_id] for task_id in self._by_created]
+
+    def ids_with_status(self, status: str) -> List[str]:
+        with self._lock:
+            return list(self._by_status.get(status, ()))
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items()}
+
+    @staticmethod
+    def encode_cursor(task_id: str) -> str:
+        return base64.urlsafe_b64encode(task_id.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> str:
+        """解析游标，格式错误时抛出ValueError"""
+        try:
+            return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        except Exception as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    def _candidates(self, statuses: Optional[List[str]], created_after: Optional[float],
+                    created_before: Optional[float], cursor: Optional[str], descending: bool):
+        """
+        按创建时间顺序产出可能满足条件的任务ID（持有锁时调用），结果仍需经 _matches 精确过滤
+        """
+        ordered = self._by_created
+        lo = 0
+        hi = len(ordered)
+        # ID时间戳与created_at可能相差一毫秒左右，范围两端放宽后再按created_at精确过滤
+        if created_after is not None:
+            lo = bisect.bisect_left(ordered, TaskIdGenerator.lower_bound(created_after - 0.002))
+        if created_before is not None:
+            hi = bisect.bisect_left(ordered, TaskIdGenerator.lower_bound(created_before + 0.002))
+        if cursor:
+            last_id = self.decode_cursor(cursor)
+            if descending:
+                hi = min(hi, bisect.bisect_left(ordered, last_id))
+            else:
+                lo = max(lo, bisect.bisect_right(ordered, last_id))
+
+        # 状态过滤的候选集比时间范围小时，直接对候选集排序，避免线性扫描
+        if statuses is not None:
+            candidate_ids = set()
+            for status in statuses:
+                candidate_ids |= self._by_status.get(status, set())
+            if len(candidate_ids) < hi - lo:
+                low_id = ordered[lo] if lo < len(ordered) else None
+                high_id = ordered[hi] if hi < len(ordered) else None
+                keys = sorted(
+                    i for i in candidate_ids
+                    if (low_id is None or i >= low_id) and (high_id is None or i < high_id)
+                )
+                if descending:
+                    keys.reverse()
+                return keys
+        return (ordered[i] for i in (range(hi - 1, lo - 1, -1) if descending else range(lo, hi)))
+
+    @staticmethod
+    def _matches(record: Dict[str, Any], status_set: Optional[set], created_after: Optional[float],
+                 created_before: Optional[float], prompt_prefix: Optional[str]) -> bool:
+        if status_set is not None and record['status'] not in status_set:
+            return False
+        if created_after is not None and record['created_at'] < created_after:
+            return False
+        if created_before is not None and record['created_at'] >= created_before:
+            return False
+        if prompt_prefix and not record['prompt'].startswith(prompt_prefix):
+            return False
+        return True
+
+    def query(self, statuses: Optional[List[str]] = None,
+              created_after: Optional[float] = None,
+              created_before: Optional[float] = None,
+              prompt_prefix: Optional[str] = None,
+              cursor: Optional[str] = None,
+              limit: int = 50,
+              descending: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按条件分页查询任务
+
+        Args:
+            statuses: 状态过滤列表
+            created_after: 创建时间下界（包含）
+            created_before: 创建时间上界（不包含）
+            prompt_prefix: 提示词前缀
+            cursor: 上一页返回的游标
+            limit: 每页数量
+            descending: 是否按创建时间倒序
+
+        Returns:
+            (任务记录列表, 下一页游标；没有更多数据时为None)
+        """
+        with self._lock:
+            keys = self._candidates(statuses, created_after, created_before, cursor, descending)
+            status_set = set(statuses) if statuses is not None else None
+            results = []
+            last_key = None
+            has_more = False
+            for key in keys:
+                record = self.tasks[key]
+                if not self._matches(record, status_set, created_after, created_before, prompt_prefix):
+                    continue
+                if len(results) == limit:
+                    has_more = True
+                    break
+                results.append(record)
+                last_key = key
+
+            next_cursor = self.encode_cursor(last_key) if has_more and last_key else None
+            return results, next_cursor
+
+    def count(self, statuses: Optional[List[str]] = None,
+              created_after: Optional[float] = None,
+              created_before: Optional[float] = None,
+              prompt_prefix: Optional[str] = None) -> int:
+        """满足条件的任务总数（与游标无关）；只按状态过滤时直接由状态索引得出"""
+        with self._lock:
+            if created_after is None and created_before is None and not prompt_prefix:
+                if statuses is None:
+                    return len(self.tasks)
+                return sum(len(self._by_status.get(status, ())) for status in set(statuses))
+            status_set = set(statuses) if statuses is not None else None
+            return sum(1 for key in self._candidates(statuses, created_after, created_before, None, False)
+                       if self._matches(self.tasks[key], status_set, created_after, created_before, prompt_prefix))
+
+
+class TaskEventSubscription:
+    """
+    任务事件订阅
+    每个订阅者持有一个有界缓冲区，缓冲区满时丢弃最旧的事件，避免慢订阅者拖慢发布方
+    """
+
+    def __init__(self, events: Optional[set] = None, task_ids: Optional[set] = None,
+                 max_pending: int = 1000):
+        self.events = events  # 事件类型过滤，None表示全部
+        self.task_ids = task_ids  # 任务ID过滤，None表示全部
+        self.dropped = 0  # 因缓冲区溢出丢弃的事件数
+        self._pending = deque(maxlen=max_pending)
+        self._cond = Condition()
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.events is not None and event['event'] not in self.events:
+            return False
+        if self.task_ids is not None and event['task_id'] not in self.task_ids:
+            return False
+        return True
+
+    def push(self, event: Dict[str, Any]):
+        with self._cond:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(event)
+            self._cond.notify()
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待下一个事件，超时返回None"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            return self._pending.popleft() if self._pending else None
+
+
+class TaskEventBus:
+    """
+    任务生命周期事件总线
+    向所有订阅者广播 created/started/paused/resumed/completed/failed/cancelled/evicted 事件
+    """
+
+    EVENT_TYPES = {'created', 'started', 'paused', 'resumed', 'completed', 'failed', 'cancelled', 'evicted'}
+
+    def __init__(self):
+        self._subscribers: set = set()
+        self._lock = RLock()
+        self.sequence = 0  # 全局事件序号
+
+    def subscribe(self, events: Optional[set] = None,
+                  task_ids: Optional[set] = None) -> TaskEventSubscription:
+        subscription = TaskEventSubscription(events, task_ids)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TaskEventSubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, task_id: str, **data):
+        """
+        发布任务事件
+
+        Args:
+            event: 事件类型
+            task_id: 任务ID
+            **data: 事件附加数据（status、error等）
+        """
+        with self._lock:
+            message = {
+                'type': 'task_event',
+                'event': event,
+                'task_id': task_id,
+                'timestamp': time.time(),
+                'sequence': self.sequence,
+                **data
+            }
+            self.sequence += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.matches(message):
+                subscription.push(message)
+
+
+class TaskScheduler:
+    """
+    任务调度器
+    在有界线程池中运行任务执行器，限制同时执行的任务数；重复提交同一任务不会重复执行
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None  # 第一次提交时创建
+        self._scheduled: set = set()
+        self._running = 0
+        self._lock = RLock()
+
+    def submit(self, executor: 'TaskExecutor') -> bool:
+        """
+        提交执行器，每个执行器只会被执行一次
+
+        Returns:
+            是否为首次提交
+        """
+        with self._lock:
+            if executor.scheduled:
+                return False
+            executor.scheduled = True
+            self._scheduled.add(executor.task_id)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='task-worker')
+            pool = self._pool
+        pool.submit(self._run, executor)
+        return True
+
+    def _run(self, executor: 'TaskExecutor'):
+        with self._lock:
+            self._running += 1
+        try:
+            executor.execute_task()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._scheduled.discard(executor.task_id)
+            executor.mark_exited()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'running': self._running,
+                'queued': len(self._scheduled) - self._running
+            }
+
+
+# 调度与队列配置
+TASK_QUEUE_MAXSIZE = int(os.environ.get('TASK_QUEUE_MAXSIZE', '1000'))  # 订阅者允许落后的最大消息数
+TASK_QUEUE_POLICY = os.environ.get('TASK_QUEUE_POLICY', 'coalesce')  # 积压处理策略: block / coalesce / drop
+TASK_HISTORY_LIMIT = int(os.environ.get('TASK_HISTORY_LIMIT', '5000'))  # 每个任务保留的最大历史消息数
+TASK_RETENTION_SECONDS = float(os.environ.get('TASK_RETENTION_SECONDS', '3600'))  # 后台任务结束后的保留时间
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '10'))  # 流空闲多久后发送心跳（秒）
+DISCONNECT_POLICY = os.environ.get('DISCONNECT_POLICY', 'cancel')  # 客户端断开时前台任务的处理: cancel / pause / detach
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '20'))  # 停机时等待在途流自然结束的最长时间
+MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', '32'))  # 同时执行的最大任务数
+MAX_BATCH_SIZE = 1000  # 单次批量创建的最大任务数
+STREAM_BATCH_PER_TASK = 16  # 多路复用流中每个任务每轮最多发送的消息数
+STREAM_PRIORITY_LANES = os.environ.get('STREAM_PRIORITY_LANES', '1') == '1'  # 积压时控制消息是否先于文件等批量消息发送
+STREAM_CHUNK_CHARS = int(os.environ.get('STREAM_CHUNK_CHARS', '0'))  # 大于0时按该字符数把大的 file_update 拆成 file_chunk
+STREAM_STATE_SNAPSHOT = os.environ.get('STREAM_STATE_SNAPSHOT', '0') == '1'  # 连接时默认是否先发送状态快照而不是重放历史
+STATE_SNAPSHOT_TERMINAL_LINES = int(os.environ.get('STATE_SNAPSHOT_TERMINAL_LINES', '100'))  # 状态快照中的终端输出行数
+
+
+def create_task_channel(policy: str = TASK_QUEUE_POLICY, base: int = 0) -> TaskChannel:
+    """按队列配置创建任务消息通道"""
+    view = TaskStateView(STATE_SNAPSHOT_TERMINAL_LINES, TERMINAL_LINE_MAX_CHARS)
+    return TaskChannel(TASK_QUEUE_MAXSIZE, policy, TASK_HISTORY_LIMIT, base=base, view=view)
+
+
 # 全局状态管理
-active_tasks: Dict[str, Dict[str, Any]] = {}  # 活跃任务存储
-task_queues: Dict[str, queue.Queue] = {}  # 任务消息队列
+task_index = TaskIndex()  # 任务索引
+task_events = TaskEventBus()  # 任务事件总线
+task_scheduler = TaskScheduler(MAX_CONCURRENT_TASKS)  # 任务调度器
+active_tasks: Dict[str, Dict[str, Any]] = task_index.tasks  # 活跃任务存储
+task_queues: Dict[str, TaskChannel] = {}  # 任务消息队列
 task_executors: Dict[str, 'TaskExecutor'] = {}  # 任务执行器实例
+server_draining = Event()  # 停机中：不再接受新任务，断开的流不再清理任务
 
 # 示例多媒体内容 - 使用真实URL
 SAMPLE_MEDIA = {
@@ -38,178 +499,1217 @@ SAMPLE_MEDIA = {
     },
     'demo_chart.svg': {
         'type': 'image',
-        'content': '''<svg width="400" height="300" xmlns="http://www.w3.org/2000/svg">
-  <rect width="100%" height="100%" fill="#f8fafc"/>
-  <rect x="50" y="50" width="60" height="150" fill="#3b82f6"/>
-  <rect x="130" y="80" width="60" height="120" fill="#06d6a0"/>
-  <rect x="210" y="100" width="60" height="100" fill="#f72585"/>
-  <rect x="290" y="70" width="60" height="130" fill="#ffd60a"/>
-  <text x="200" y="30" text-anchor="middle" font-family="Arial" font-size="16" fill="#1e293b">Sample Chart Data</text>
-  <text x="80" y="230" text-anchor="middle" font-size="12" fill="#64748b">Q1</text>
-  <text x="160" y="230" text-anchor="middle" font-size="12" fill="#64748b">Q2</text>
-  <text x="240" y="230" text-anchor="middle" font-size="12" fill="#64748b">Q3</text>
-  <text x="320" y="230" text-anchor="middle" font-size="12" fill="#64748b">Q4</text>
-</svg>''',
+        'file': 'demo_chart.svg',
         'description': 'A sample chart for data visualization demo'
     },
     'demo_page.html': {
         'type': 'html',
-        'content': '''<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>演示页面 - Resear Pro</title>
-    <style>
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 2rem;
-            line-height: 1.6;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            min-height: 100vh;
-        }
-        .container {
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            border-radius: 20px;
-            padding: 2rem;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-        }
-        h1 { 
-            color: #fff; 
-            text-align: center; 
-            font-size: 2.5rem;
-            margin-bottom: 1rem;
-        }
-        .feature-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 1.5rem;
-            margin: 2rem 0;
-        }
-        .feature-card {
-            background: rgba(255, 255, 255, 0.2);
-            padding: 1.5rem;
-            border-radius: 15px;
-            text-align: center;
-            transition: transform 0.3s ease;
-        }
-        .feature-card:hover {
-            transform: translateY(-5px);
-        }
-        .emoji { font-size: 3rem; margin-bottom: 1rem; }
-        button {
-            background: linear-gradient(45deg, #ff6b6b, #ee5a24);
-            color: white;
-            border: none;
-            padding: 12px 24px;
-            border-radius: 25px;
-            font-size: 1rem;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            margin: 10px;
-        }
-        button:hover {
-            transform: scale(1.05);
-            box-shadow: 0 5px 15px rgba(0,0,0,0.3);
+        'file': 'demo_page.html',
+        'description': 'Interactive HTML demonstration page with modern styling'
+    }
+}
+
+# 内嵌示例媒体（SVG/HTML）存放在该目录，首次使用时读取
+SAMPLE_MEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_media')
+
+
+@functools.lru_cache(maxsize=None)
+def load_sample_media(filename: str) -> str:
+    """读取示例媒体文件内容，只在第一个任务用到时加载一次，之后所有任务共享同一字符串"""
+    with open(os.path.join(SAMPLE_MEDIA_DIR, filename), 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def record_task_event(task_id: str, event: str, status: Optional[str] = None, **data):
+    """
+    记录任务生命周期变化：同步任务索引中的状态并广播事件
+
+    Args:
+        task_id: 任务ID
+        event: 事件类型
+        status: 新的任务状态，None表示不修改
+        **data: 事件附加数据
+    """
+    if status is not None:
+        task_index.update_status(task_id, status)
+    record = task_index.get(task_id)
+    task_events.publish(event, task_id, status=record['status'] if record else status, **data)
+
+
+# ==================== 媒体缓存 ====================
+
+class UrlMediaFetcher:
+    """通过HTTP(S)下载媒体文件"""
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+
+    def fetch(self, url: str, dest) -> Optional[str]:
+        """
+        下载URL内容写入dest文件对象
+
+        Returns:
+            响应的Content-Type
+        """
+        import urllib.request  # 只有真正下载时才需要，避免拖慢启动
+
+        req = urllib.request.Request(url, headers={'User-Agent': 'ResearPro-MediaCache/1.0'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            while True:
+                chunk = resp.read(64 * 1024)
+                if not chunk:
+                    break
+                dest.write(chunk)
+            return resp.headers.get('Content-Type')
+
+
+class DirectoryMediaFetcher:
+    """
+    从本地目录读取媒体文件（测试和离线环境使用）
+    依次查找 <root>/<sha256(url)> 和 <root>/<URL路径的文件名>
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def fetch(self, url: str, dest) -> Optional[str]:
+        candidates = [
+            hashlib.sha256(url.encode('utf-8')).hexdigest(),
+            os.path.basename(urlparse(url).path)
+        ]
+        for name in candidates:
+            path = os.path.join(self.root, name)
+            if name and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    while True:
+                        chunk = f.read(64 * 1024)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                return None
+        raise FileNotFoundError(f"No fixture for {url} in {self.root}")
+
+
+class MediaCache:
+    """
+    媒体文件本地缓存
+    URL对应的内容只下载一次，按内容SHA-256存放在磁盘上，总大小超过上限时按LRU淘汰。
+    磁盘上已有的条目在第一次使用时加载，预取线程池在第一次预取时创建，导入模块时不访问磁盘
+    """
+
+    def __init__(self, root: str, max_bytes: int, fetcher):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()  # hash -> 元数据，按访问顺序
+        self._by_url: Dict[str, str] = {}  # url -> hash
+        self._inflight: Dict[str, Event] = {}  # 正在下载的URL
+        self._failed: Dict[str, float] = {}  # 下载失败的URL -> 失败时间，冷却期内不重试
+        self._lock = RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+        self._prefetch_pool: Optional[ThreadPoolExecutor] = None
+
+    def _load(self):
+        """加载磁盘上已有的缓存条目（按最近访问时间排序），只在第一次调用时执行；调用方持有锁"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                blob = os.path.join(self.root, meta['hash'])
+                entries.append((os.stat(blob).st_atime, meta))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, meta in sorted(entries, key=lambda e: e[0]):
+            self._add_entry(meta)
+
+    def _add_entry(self, meta: Dict[str, Any]):
+        if meta['hash'] not in self._entries:
+            self.total_bytes += meta['size']
+        self._entries[meta['hash']] = meta
+        self._entries.move_to_end(meta['hash'])
+        for url in meta.get('urls', []):
+            self._by_url[url] = meta['hash']
+
+    def _evict(self):
+        """淘汰最久未使用的条目直到总大小不超过上限（至少保留最新的一个）"""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            digest, meta = self._entries.popitem(last=False)
+            self.total_bytes -= meta['size']
+            for url in meta.get('urls', []):
+                self._by_url.pop(url, None)
+            for path in (os.path.join(self.root, digest), os.path.join(self.root, f"{digest}.json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            logger.info(f"Media cache evicted {digest} ({meta['size']} bytes)")
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """按内容哈希获取条目并刷新LRU顺序"""
+        with self._lock:
+            self._load()
+            meta = self._entries.get(digest)
+            if meta is not None:
+                self._entries.move_to_end(digest)
+            return meta
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest)
+
+    def read_bytes(self, digest: str) -> Optional[bytes]:
+        if self.get(digest) is None:
+            return None
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def fetch(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        获取URL对应的缓存条目，未缓存时下载（同一URL的并发请求只下载一次）
+
+        Returns:
+            条目元数据 {hash, size, content_type, urls}；下载失败返回None
+        """
+        while True:
+            with self._lock:
+                self._load()
+                digest = self._by_url.get(url)
+                if digest is not None:
+                    self.hits += 1
+                    return self.get(digest)
+                if time.time() - self._failed.get(url, 0.0) < MEDIA_RETRY_COOLDOWN:
+                    return None
+                inflight = self._inflight.get(url)
+                if inflight is None:
+                    self.misses += 1
+                    inflight = self._inflight[url] = Event()
+                    break
+            inflight.wait()
+            with self._lock:
+                if url not in self._by_url:
+                    return None
+
+        try:
+            return self._download(url)
+        except Exception as e:
+            logger.warning(f"Media fetch failed for {url}: {e}")
+            with self._lock:
+                self._failed[url] = time.time()
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(url).set()
+
+    def _download(self, url: str) -> Dict[str, Any]:
+        hasher = hashlib.sha256()
+        size = 0
+
+        class _HashingWriter:
+            def __init__(self, f):
+                self.f = f
+
+            def write(self, chunk):
+                nonlocal size
+                hasher.update(chunk)
+                size += len(chunk)
+                self.f.write(chunk)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                content_type = self.fetcher.fetch(url, _HashingWriter(f))
+            digest = hasher.hexdigest()
+            os.replace(tmp_path, self.path(digest))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            meta = self._entries.get(digest) or {
+                'hash': digest,
+                'size': size,
+                'content_type': content_type or guess_media_type(url),
+                'urls': []
+            }
+            if url not in meta['urls']:
+                meta['urls'].append(url)
+            with open(os.path.join(self.root, f"{digest}.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            self._add_entry(meta)
+            self._evict()
+        logger.info(f"Media cached {url} -> {digest} ({size} bytes)")
+        return meta
+
+    def prefetch(self, urls: List[str]):
+        """在后台线程中预取一组URL"""
+        with self._lock:
+            if self._prefetch_pool is None:
+                self._prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='media-prefetch')
+            pool = self._prefetch_pool
+        for url in urls:
+            pool.submit(self.fetch, url)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._prefetch_pool = self._prefetch_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._load()
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def guess_media_type(url: str) -> str:
+    """根据URL推断媒体类型"""
+    path = urlparse(url).path
+    mime_type, _ = mimetypes.guess_type(path)
+    if mime_type is None and 'pdf' in url.lower():
+        return 'application/pdf'
+    return mime_type or 'application/octet-stream'
+
+
+def create_media_fetcher():
+    """根据配置创建媒体获取器：设置 MEDIA_FIXTURE_DIR 时从本地目录读取"""
+    fixture_dir = os.environ.get('MEDIA_FIXTURE_DIR')
+    if fixture_dir:
+        return DirectoryMediaFetcher(fixture_dir)
+    return UrlMediaFetcher(timeout=float(os.environ.get('MEDIA_FETCH_TIMEOUT', '30')))
+
+
+# 媒体缓存配置
+MEDIA_CACHE_DIR = os.environ.get(
+    'MEDIA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.media_cache'))
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+MEDIA_RETRY_COOLDOWN = 300.0  # 下载失败后的重试冷却时间（秒）
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, create_media_fetcher())
+
+
+# ==================== 任务文件存储 ====================
+
+class VersionClock:
+    """任务内容版本号：文件和执行日志的每次修改递增，增量导出以此为起点"""
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self.value = 0  # 当前版本
+
+    def tick(self) -> int:
+        self.value = next(self._counter)
+        return self.value
+
+
+class FileTree:
+    """
+    按目录索引的文件树
+
+    每个目录节点保存直接子文件的大小和子目录，并维护整棵子树的文件数和总字节数；
+    增删文件只更新路径上的祖先节点，按路径取任意一层也不需要遍历整棵树。
+    路径以 '/' 分隔，根目录的路径为空字符串。只剩空目录时自动删除，create_folder 显式创建的目录除外
+    """
+
+    class Node:
+        __slots__ = ('name', 'path', 'files', 'dirs', 'file_count', 'size', 'explicit')
+
+        def __init__(self, name: str, path: str):
+            self.name = name
+            self.path = path
+            self.files: Dict[str, int] = {}  # 直接子文件名 -> 字节大小（同时决定顺序）
+            self.dirs: Dict[str, 'FileTree.Node'] = {}  # 子目录名 -> 节点
+            self.file_count = 0  # 子树中的文件数
+            self.size = 0  # 子树中文件的总字节数
+            self.explicit = False  # 显式创建的目录，清空后保留
+
+    def __init__(self):
+        self._lock = Lock()
+        self.root = FileTree.Node('/', '')
+        self.version = 0  # 结构或文件大小变化时递增
+        self._structure: Optional[Tuple[int, Dict[str, Any]]] = None  # (版本, to_structure() 的结果)
+
+    @staticmethod
+    def _split(path: str) -> List[str]:
+        return [part for part in path.split('/') if part]
+
+    def _chain(self, parts: List[str], create: bool) -> Optional[List['FileTree.Node']]:
+        """从根目录到 parts 指定目录的节点链，目录不存在且 create 为False时返回None"""
+        chain = [self.root]
+        for part in parts:
+            node = chain[-1].dirs.get(part)
+            if node is None:
+                if not create:
+                    return None
+                parent = chain[-1]
+                node = FileTree.Node(part, f"{parent.path}/{part}" if parent.path else part)
+                parent.dirs[part] = node
+            chain.append(node)
+        return chain
+
+    def add_file(self, path: str, size: int):
+        """添加或更新文件；更新的文件移到所在目录的末尾（与写入顺序一致）"""
+        parts = self._split(path)
+        with self._lock:
+            chain = self._chain(parts[:-1], create=True)
+            old = chain[-1].files.pop(parts[-1], None)
+            chain[-1].files[parts[-1]] = size
+            for node in chain:
+                node.size += size - (old or 0)
+                if old is None:
+                    node.file_count += 1
+            self.version += 1
+
+    def remove_file(self, path: str) -> Optional[int]:
+        """删除文件并清理变空的目录，返回文件大小；文件不存在时返回None"""
+        parts = self._split(path)
+        with self._lock:
+            chain = self._chain(parts[:-1], create=False)
+            if chain is None or parts[-1] not in chain[-1].files:
+                return None
+            size = chain[-1].files.pop(parts[-1])
+            for node in chain:
+                node.size -= size
+                node.file_count -= 1
+            for parent, node in zip(reversed(chain[:-1]), reversed(chain[1:])):
+                if node.files or node.dirs or node.explicit:
+                    break
+                del parent.dirs[node.name]
+            self.version += 1
+            return size
+
+    def move_file(self, old_path: str, new_path: str):
+        size = self.remove_file(old_path)
+        if size is not None:
+            self.add_file(new_path, size)
+
+    def add_directory(self, path: str):
+        """显式创建目录（包括不存在的上级目录）"""
+        with self._lock:
+            self._chain(self._split(path), create=True)[-1].explicit = True
+            self.version += 1
+
+    def explicit_directories(self) -> List[str]:
+        """显式创建的目录路径，写入检查点以便恢复空目录"""
+        with self._lock:
+            result = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node.explicit:
+                    result.append(node.path)
+                stack.extend(node.dirs.values())
+            return result
+
+    def clear(self):
+        with self._lock:
+            self.root = FileTree.Node('/', '')
+            self.version += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """根目录摘要，lazy 模式下代替完整文件树发送"""
+        with self._lock:
+            return {
+                'lazy': True,
+                'version': self.version,
+                'file_count': self.root.file_count,
+                'size': self.root.size,
+                'child_count': len(self.root.files) + len(self.root.dirs)
+            }
+
+    def subtree(self, path: str = '', depth: int = 1, offset: int = 0, limit: int = 500) -> Optional[Dict[str, Any]]:
+        """
+        取文件树的一部分
+
+        Args:
+            path: 目录或文件路径
+            depth: 展开的目录层数，0只返回节点本身（目录带子树文件数、总大小和直接子节点数）
+            offset / limit: 所请求目录的子节点范围（先文件后目录）；更深层的目录最多展开前 limit 个子节点
+
+        Returns:
+            节点字典，路径不存在时返回None
+        """
+        parts = self._split(path)
+        with self._lock:
+            chain = self._chain(parts, create=False)
+            if chain is not None:
+                return self._describe(chain[-1], depth, offset, limit)
+            parent = self._chain(parts[:-1], create=False) if parts else None
+            if parent is not None and parts[-1] in parent[-1].files:
+                return {'name': parts[-1], 'path': '/'.join(parts), 'type': 'file',
+                        'size': parent[-1].files[parts[-1]]}
+            return None
+
+    def _describe(self, node: 'FileTree.Node', depth: int, offset: int, limit: int) -> Dict[str, Any]:
+        result = {
+            'name': node.name,
+            'path': node.path,
+            'type': 'directory',
+            'file_count': node.file_count,
+            'size': node.size,
+            'child_count': len(node.files) + len(node.dirs)
         }
-        .demo-section {
-            background: rgba(255, 255, 255, 0.1);
-            padding: 1.5rem;
-            border-radius: 15px;
-            margin: 1.5rem 0;
+        if depth > 0:
+            children = []
+            prefix = f"{node.path}/" if node.path else ''
+            entries = itertools.chain(node.files.items(), node.dirs.values())
+            for entry in itertools.islice(entries, offset, offset + limit):
+                if isinstance(entry, FileTree.Node):
+                    children.append(self._describe(entry, depth - 1, 0, limit))
+                else:
+                    children.append({'name': entry[0], 'path': prefix + entry[0], 'type': 'file', 'size': entry[1]})
+            result['children'] = children
+        return result
+
+    def to_structure(self) -> Dict[str, Any]:
+        """完整文件树（file_structure_update 消息的格式），结构不变时复用上次的结果"""
+        with self._lock:
+            cached = self._structure
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+
+            def build(node: 'FileTree.Node') -> Dict[str, Any]:
+                children = [{'name': name, 'type': 'file', 'size': size} for name, size in node.files.items()]
+                children.extend(build(child) for child in node.dirs.values())
+                return {'name': node.name, 'type': 'directory', 'children': children}
+
+            structure = build(self.root)
+            self._structure = (self.version, structure)
+            return structure
+
+
+class TaskFileStore(MutableMapping):
+    """
+    任务文件存储
+    以文件名为键的字典接口；小文件以字符串保存在内存中，
+    UTF-8编码后超过 spill_threshold 字节的文件写入任务目录，读取时通过内存映射完成。
+    每个文件的字节大小记录在元数据中，无需读取内容即可获得。
+
+    每次写入记录文件的内容版本，删除和重命名按版本记入变更列表，用于增量导出；
+    重命名保留原内容版本（内容没有变化）。
+    文件的增删改同步到按目录索引的文件树（tree），文件结构不需要从文件列表重建
+    """
+
+    def __init__(self, task_id: str, root: str, spill_threshold: int, clock: Optional[VersionClock] = None):
+        self.task_id = task_id
+        self.root = os.path.join(root, task_id, 'files')
+        self.spill_threshold = spill_threshold
+        self.clock = clock or VersionClock()
+        self._inline: Dict[str, str] = {}  # 内存中的小文件
+        self._spilled: Dict[str, str] = {}  # 文件名 -> 磁盘路径
+        self._sizes: Dict[str, int] = {}  # 文件名 -> 字节大小（同时决定迭代顺序）
+        self._versions: Dict[str, int] = {}  # 文件名 -> 最后写入时的内容版本
+        self._changes: List[Tuple[int, str, str, Optional[str]]] = []  # (版本, delete/rename, 文件名, 新文件名)
+        self.tree = FileTree()  # 按目录索引的文件树
+
+    def _disk_path(self, filename: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(filename.encode('utf-8')).hexdigest())
+
+    def __setitem__(self, filename: str, content):
+        # 字符数*4不超过阈值时UTF-8编码后也不会超过，避免为小文件编码
+        if isinstance(content, str) and len(content) * 4 <= self.spill_threshold:
+            data = None
+            size = len(content.encode('utf-8')) if not content.isascii() else len(content)
+        else:
+            data = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+            size = len(data)
+
+        if data is None or size <= self.spill_threshold:
+            self._remove_spilled(filename)
+            self._inline[filename] = content if isinstance(content, str) else data.decode('utf-8', errors='replace')
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            path = self._disk_path(filename)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._inline.pop(filename, None)
+            self._spilled[filename] = path
+        self._sizes.pop(filename, None)
+        self._sizes[filename] = size
+        self._versions[filename] = self.clock.tick()
+        self.tree.add_file(filename, size)
+
+    def add_path(self, filename: str, path: str, size: int, link: bool = False):
+        """
+        把已写入磁盘的文件登记到存储中（不读取内容）
+
+        Args:
+            link: 为True时以硬链接引用原文件（多个任务共享同一份内容），否则移动到任务目录
+        """
+        os.makedirs(self.root, exist_ok=True)
+        dest = self._disk_path(filename)
+        if link:
+            link_or_copy(path, dest)
+        else:
+            shutil.move(path, dest)
+        self._inline.pop(filename, None)
+        self._spilled[filename] = dest
+        self._sizes.pop(filename, None)
+        self._sizes[filename] = size
+        self._versions[filename] = self.clock.tick()
+        self.tree.add_file(filename, size)
+
+    def __getitem__(self, filename: str) -> str:
+        if filename in self._inline:
+            return self._inline[filename]
+        if filename in self._spilled:
+            return self.read_bytes(filename).decode('utf-8', errors='replace')
+        raise KeyError(filename)
+
+    def __delitem__(self, filename: str):
+        if filename not in self._sizes:
+            raise KeyError(filename)
+        self._inline.pop(filename, None)
+        self._remove_spilled(filename)
+        del self._sizes[filename]
+        self._versions.pop(filename, None)
+        self._changes.append((self.clock.tick(), 'delete', filename, None))
+        self.tree.remove_file(filename)
+
+    def __iter__(self):
+        return iter(list(self._sizes))
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def __contains__(self, filename) -> bool:
+        return filename in self._sizes
+
+    def _remove_spilled(self, filename: str):
+        path = self._spilled.pop(filename, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def size(self, filename: str) -> int:
+        """文件的字节大小（来自元数据）"""
+        return self._sizes[filename]
+
+    def is_spilled(self, filename: str) -> bool:
+        return filename in self._spilled
+
+    def spilled_path(self, filename: str) -> Optional[str]:
+        """文件在磁盘上的路径，内存中的文件返回None"""
+        return self._spilled.get(filename)
+
+    def read_bytes(self, filename: str) -> bytes:
+        """读取文件字节内容，磁盘文件通过内存映射读取"""
+        if filename in self._inline:
+            return self._inline[filename].encode('utf-8')
+        with open(self._spilled[filename], 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def read_text(self, filename: str, max_chars: int) -> str:
+        """读取文件开头最多 max_chars 个字符，磁盘文件只读取所需的字节，不把整个文件读入内存"""
+        if filename in self._inline:
+            return self._inline[filename][:max_chars]
+        with open(self._spilled[filename], 'rb') as f:
+            data = f.read(max_chars * 4)
+        # 增量解码：截断处不完整的UTF-8字符留在解码器中，不产生替换字符
+        return codecs.getincrementaldecoder('utf-8')(errors='replace').decode(data)[:max_chars]
+
+    def rename(self, old_name: str, new_name: str):
+        """重命名文件，磁盘文件直接移动而不读取内容"""
+        if old_name in self._inline:
+            content = self._inline.pop(old_name)
+            size = self._sizes.pop(old_name)
+            self._inline[new_name] = content
+            self._sizes[new_name] = size
+        elif old_name in self._spilled:
+            dest = self._disk_path(new_name)
+            os.replace(self._spilled.pop(old_name), dest)
+            self._spilled[new_name] = dest
+            self._sizes[new_name] = self._sizes.pop(old_name)
+        else:
+            raise KeyError(old_name)
+        self._versions[new_name] = self._versions.pop(old_name, 0)
+        self._changes.append((self.clock.tick(), 'rename', old_name, new_name))
+        self.tree.move_file(old_name, new_name)
+
+    def changes_since(self, version: int, until: Optional[int] = None) -> Tuple[List[str], List[Dict[str, str]]]:
+        """
+        自某个内容版本以来的变更
+
+        Args:
+            version: 客户端已有的内容版本
+            until: 只返回该版本及之前的删除和重命名（与导出时的版本快照对齐，避免下次重复）
+
+        Returns:
+            (内容有变化的文件名, 按发生顺序排列的删除/重命名操作)；
+            客户端先按顺序应用操作（不存在的文件忽略），再写入变化的文件
+        """
+        modified = [name for name, file_version in list(self._versions.items()) if file_version > version]
+        operations = []
+        for change_version, op, name, new_name in list(self._changes):
+            if change_version <= version or (until is not None and change_version > until):
+                continue
+            if op == 'rename':
+                operations.append({'op': 'rename', 'from': name, 'to': new_name})
+            else:
+                operations.append({'op': 'delete', 'path': name})
+        return modified, operations
+
+    def to_state(self) -> Dict[str, Any]:
+        """可序列化的存储状态：小文件内容，磁盘文件相对于任务目录的路径，以及显式创建的目录"""
+        return {
+            'inline': dict(self._inline),
+            'spilled': {name: os.path.relpath(path, self.root) for name, path in self._spilled.items()},
+            'folders': self.tree.explicit_directories()
         }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>🚀 Resear Pro 演示页面</h1>
-        
-        <div class="demo-section">
-            <h2>🎯 多媒体支持展示</h2>
-            <p>这是一个现代化的HTML演示页面，展示了Resear Pro的多媒体文件支持能力。</p>
-        </div>
-
-        <div class="feature-grid">
-            <div class="feature-card">
-                <div class="emoji">📄</div>
-                <h3>PDF 查看器</h3>
-                <p>支持直接在界面中查看PDF文档，无需外部软件。</p>
-            </div>
-            
-            <div class="feature-card">
-                <div class="emoji">🖼️</div>
-                <h3>图像显示</h3>
-                <p>支持多种图像格式的实时预览和显示。</p>
-            </div>
-            
-            <div class="feature-card">
-                <div class="emoji">🌐</div>
-                <h3>HTML 预览</h3>
-                <p>即时HTML页面渲染，支持代码和预览双模式。</p>
-            </div>
-            
-            <div class="feature-card">
-                <div class="emoji">📊</div>
-                <h3>数据可视化</h3>
-                <p>SVG图表和交互式数据展示功能。</p>
-            </div>
-        </div>
-
-        <div class="demo-section">
-            <h2>⚡ 交互功能测试</h2>
-            <button onclick="showAlert()">点击测试JavaScript</button>
-            <button onclick="changeColor()">改变背景色</button>
-            <button onclick="addTimestamp()">添加时间戳</button>
-            
-            <div id="output" style="margin-top: 1rem; padding: 1rem; background: rgba(0,0,0,0.2); border-radius: 10px;">
-                <p>交互输出区域：等待用户操作...</p>
-            </div>
-        </div>
-
-        <div class="demo-section">
-            <h2>📝 实时编辑测试</h2>
-            <p>您可以在代码模式下编辑此HTML文件，然后切换到预览模式查看效果。</p>
-            <p><strong>创建时间：</strong> <span id="timestamp"></span></p>
-        </div>
-    </div>
-
-    <script>
-        // 设置创建时间
-        document.getElementById('timestamp').textContent = new Date().toLocaleString();
-        
-        function showAlert() {
-            document.getElementById('output').innerHTML = 
-                '<p style="color: #4CAF50;">✅ JavaScript 功能正常运行！</p>';
+
+    def load_state(self, state: Dict[str, Any]):
+        """从 to_state() 的结果恢复，磁盘上已不存在的文件跳过"""
+        for filename, content in state['inline'].items():
+            self._inline[filename] = content
+            self._sizes[filename] = len(content.encode('utf-8'))
+            self._versions[filename] = self.clock.tick()
+            self.tree.add_file(filename, self._sizes[filename])
+        for filename, relpath in state['spilled'].items():
+            path = os.path.join(self.root, relpath)
+            if os.path.isfile(path):
+                self._spilled[filename] = path
+                self._sizes[filename] = os.path.getsize(path)
+                self._versions[filename] = self.clock.tick()
+                self.tree.add_file(filename, self._sizes[filename])
+            else:
+                logger.warning(f"Spilled file {filename} of task {self.task_id} is missing")
+        for folder in state.get('folders', []):
+            self.tree.add_directory(folder)
+
+    def destroy(self):
+        """删除任务的所有磁盘文件"""
+        self._inline.clear()
+        self._spilled.clear()
+        self._sizes.clear()
+        self._versions.clear()
+        self._changes.clear()
+        self.tree.clear()
+        shutil.rmtree(os.path.dirname(self.root), ignore_errors=True)
+
+
+# ==================== 执行日志 ====================
+
+class ActivityRecord:
+    """
+    紧凑的活动记录
+    使用 __slots__ 存储，文本字段驻留（intern），按类型出现的可选字段为None时不序列化
+    """
+
+    __slots__ = ('id', 'text', 'type', 'status', 'timestamp', 'command', 'filename', 'path', 'output')
+
+    OPTIONAL_FIELDS = ('command', 'filename', 'path', 'output')
+
+    def __init__(self, activity_id: int, text: str, activity_type: str, status: str, timestamp: float,
+                 command: Optional[str] = None, filename: Optional[str] = None,
+                 path: Optional[str] = None, output: Optional[str] = None):
+        self.id = activity_id
+        self.text = sys.intern(text)
+        self.type = sys.intern(activity_type)
+        self.status = sys.intern(status)
+        self.timestamp = timestamp
+        self.command = command
+        self.filename = sys.intern(filename) if filename is not None else None
+        self.path = path
+        self.output = output
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为前端和导出使用的字典格式"""
+        data = {
+            "id": self.id,
+            "text": self.text,
+            "type": self.type,
+            "status": self.status,
+            "timestamp": self.timestamp
         }
-        
-        function changeColor() {
-            const colors = [
-                'linear-gradient(135deg, #667eea 0%, #764ba2 100%)',
-                'linear-gradient(135deg, #f093fb 0%, #f5576c 100%)',
-                'linear-gradient(135deg, #4facfe 0%, #00f2fe 100%)',
-                'linear-gradient(135deg, #43e97b 0%, #38f9d7 100%)'
-            ];
-            const randomColor = colors[Math.floor(Math.random() * colors.length)];
-            document.body.style.background = randomColor;
-            document.getElementById('output').innerHTML = 
-                '<p style="color: #FF9800;">🎨 背景颜色已更改！</p>';
+        for field in self.OPTIONAL_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
+
+
+class ActivityLog:
+    """
+    执行日志
+    按顺序保存活动记录，并按活动ID建立索引以便原地更新状态；导出时才序列化为字典。
+    与任务文件共用内容版本号，记录每条活动最后一次变化的版本
+    """
+
+    def __init__(self, clock: Optional['VersionClock'] = None):
+        self._records: List[ActivityRecord] = []
+        self._index: Dict[int, int] = {}  # 活动ID -> 在记录列表中的下标
+        self.clock = clock or VersionClock()
+        self._versions = array('Q')  # 与记录列表按下标对应：最后变化时的内容版本（每条8字节）
+
+    def append(self, record: ActivityRecord):
+        self._index[record.id] = len(self._records)
+        self._records.append(record)
+        self._versions.append(self.clock.tick())
+
+    def get(self, activity_id: int) -> Optional[ActivityRecord]:
+        pos = self._index.get(activity_id)
+        return self._records[pos] if pos is not None else None
+
+    def update(self, activity_id: int, status: str, **kwargs) -> Optional[ActivityRecord]:
+        """
+        原地更新活动状态及可选字段
+
+        Returns:
+            更新后的记录，活动不存在时返回None
+        """
+        pos = self._index.get(activity_id)
+        if pos is None:
+            return None
+        record = self._records[pos]
+        record.status = sys.intern(status)
+        for field in ActivityRecord.OPTIONAL_FIELDS:
+            if field in kwargs:
+                setattr(record, field, kwargs[field])
+        self._versions[pos] = self.clock.tick()
+        return record
+
+    def changed_since(self, version: int) -> List[ActivityRecord]:
+        """某个内容版本之后新增或更新的活动（按日志顺序）"""
+        return [record for record, record_version in zip(list(self._records), self._versions)
+                if record_version > version]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [record.to_dict() for record in self._records]
+
+
+# ==================== 终端输出 ====================
+
+TERMINAL_SCROLLBACK_LINES = int(os.environ.get('TERMINAL_SCROLLBACK_LINES', '2000'))  # 每个任务保留的终端输出行数
+TERMINAL_LINE_MAX_CHARS = int(os.environ.get('TERMINAL_LINE_MAX_CHARS', '4096'))  # 回滚缓冲区中单行的最大字符数，超出截断
+TERMINAL_BATCH_INTERVAL = float(os.environ.get('TERMINAL_BATCH_INTERVAL', '0.1'))  # 命令输出攒批发送的最长间隔（秒）
+TERMINAL_BATCH_LINES = int(os.environ.get('TERMINAL_BATCH_LINES', '200'))  # 攒够该行数立即发送一条 terminal_chunk
+TERMINAL_COMMAND_TIMEOUT = float(os.environ.get('TERMINAL_COMMAND_TIMEOUT', '300'))  # 命令超时（秒），超时后终止进程
+TERMINAL_SUMMARY_LINES = 20  # 命令结束时的 terminal 消息附带的输出末尾行数
+TERMINAL_EXECUTE_COMMANDS = os.environ.get('TERMINAL_EXECUTE_COMMANDS', '0') == '1'  # 完整版执行器是否真实执行工作目录命令
+
+
+class TerminalScrollback:
+    """
+    任务终端输出的回滚缓冲区
+
+    按行保存最近 max_lines 行（超长的行截断），中途加入的客户端通过 /api/tasks/<id>/terminal?tail=N 获取；
+    还没有换行的输出保存在各命令的未完成行中，tail 时一并返回。每条命令的起止时间和退出码另外记录
+    """
+
+    MAX_COMMANDS = 100  # 保留的命令记录数
+
+    def __init__(self, max_lines: int = TERMINAL_SCROLLBACK_LINES, max_line_chars: int = TERMINAL_LINE_MAX_CHARS):
+        self._lock = Lock()
+        self.max_line_chars = max_line_chars
+        self._lines: deque = deque(maxlen=max_lines)  # (命令ID, stdout/stderr, 文本)
+        self._partial: Dict[Tuple[int, str], str] = {}  # (命令ID, stream) -> 未换行的输出
+        self._commands: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+        self._ids = itertools.count(1)
+        self.total_lines = 0  # 累计写入的行数（包括已被挤出缓冲区的）
+
+    def begin(self, command: str) -> int:
+        """登记一条开始执行的命令，返回命令ID"""
+        with self._lock:
+            command_id = next(self._ids)
+            self._commands[command_id] = {'id': command_id, 'command': command, 'status': 'running',
+                                          'exit_code': None, 'started_at': time.time(), 'ended_at': None}
+            while len(self._commands) > self.MAX_COMMANDS:
+                self._commands.popitem(last=False)
+            return command_id
+
+    def write(self, command_id: int, stream: str, text: str):
+        """追加一段输出，按换行切分为行，最后不完整的一行留待下次拼接"""
+        if not text:
+            return
+        with self._lock:
+            key = (command_id, stream)
+            lines = (self._partial.pop(key, '') + text).split('\n')
+            if lines[-1]:
+                self._partial[key] = lines[-1][:self.max_line_chars]
+            for line in lines[:-1]:
+                self._lines.append((command_id, stream, line[:self.max_line_chars]))
+            self.total_lines += len(lines) - 1
+
+    def end(self, command_id: int, status: str, exit_code: Optional[int] = None):
+        """命令结束：未完成的行作为完整行写入，记录状态和退出码"""
+        with self._lock:
+            for stream in ('stdout', 'stderr'):
+                line = self._partial.pop((command_id, stream), None)
+                if line is not None:
+                    self._lines.append((command_id, stream, line))
+                    self.total_lines += 1
+            record = self._commands.get(command_id)
+            if record is not None:
+                record.update(status=status, exit_code=exit_code, ended_at=time.time())
+
+    def tail(self, count: int) -> List[Dict[str, Any]]:
+        """最近 count 行输出（正在执行的命令未换行的部分排在最后）"""
+        with self._lock:
+            lines = list(self._lines)[-count:] if count > 0 else []
+            lines.extend((command_id, stream, text) for (command_id, stream), text in self._partial.items())
+        return [{'command_id': command_id, 'stream': stream, 'text': text}
+                for command_id, stream, text in lines[-count:]]
+
+    def commands(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(record) for record in self._commands.values()]
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+
+# ==================== 追踪与性能分析 ====================
+
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '0') == '1'  # 新任务默认是否记录追踪
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '4096'))  # 每个任务保留的最近span数
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', '0.01'))  # 采样分析器默认采样间隔（秒）
+
+
+# 全局采样分析器（默认关闭，通过 /api/profiler 开关）
+sampling_profiler = SamplingProfiler(PROFILER_INTERVAL)
+
+
+# ==================== 进程池通道 ====================
+
+PROCESS_POOL_WORKERS = int(os.environ.get('PROCESS_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))  # 工作进程数
+PROCESS_LANE_MIN_BYTES = int(os.environ.get('PROCESS_LANE_MIN_BYTES', str(1024 * 1024)))  # auto 时导出文件总量达到该值才使用进程池
+SHARED_MEMORY_MIN_BYTES = 16 * 1024  # 文本成员超过该字节数时经共享内存传递，较小的直接随任务参数序列化
+# 未指定lane时的导出压缩位置：thread / process / auto（多核且文件总量达到 PROCESS_LANE_MIN_BYTES 时用进程池）。
+# 进程池的收益取决于核数和负载，默认不启用；启用前用 bench/process_lane.py 在目标机器上测量
+EXPORT_LANE = os.environ.get('EXPORT_LANE', 'thread')
+EXPORT_LANES = ('thread', 'process', 'auto')
+
+
+class ProcessLane:
+    """
+    CPU密集型工作的进程池通道
+
+    压缩、大型计算等任务在独立进程中执行，不会因为GIL拖慢其他任务的流式响应。
+    进程池在第一次使用时才以spawn方式创建（多线程进程中fork不安全），任务函数来自只依赖标准库的 cpu_jobs 模块
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = Lock()
+        self.submitted = 0
+        self.shared_bytes = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Started process lane with {self.max_workers} workers")
+            return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        """提交到进程池，返回 concurrent.futures.Future"""
+        self.submitted += 1
+        return self._get_pool().submit(fn, *args, **kwargs)
+
+    @contextmanager
+    def share(self, members: List[cpu_jobs.ZipMember]):
+        """
+        把较大的文本成员打包进一个共享内存块，产出 (共享内存名, 改写后的成员列表)；
+        退出时释放共享内存
+        """
+        blobs = []
+        shared = []
+        offset = 0
+        for arcname, kind, value in members:
+            if kind == 'data':
+                data = value.encode('utf-8') if isinstance(value, str) else value
+                if len(data) >= SHARED_MEMORY_MIN_BYTES:
+                    blobs.append((offset, data))
+                    shared.append((arcname, 'shm', (offset, len(data))))
+                    offset += len(data)
+                    continue
+            shared.append((arcname, kind, value))
+
+        if not blobs:
+            yield None, shared
+            return
+
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=offset)
+        try:
+            for start, data in blobs:
+                shm.buf[start:start + len(data)] = data
+            blobs.clear()
+            self.shared_bytes += offset
+            yield shm.name, shared
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.max_workers,
+            'started': self._pool is not None,
+            'submitted': self.submitted,
+            'shared_bytes': self.shared_bytes
         }
-        
-        function addTimestamp() {
-            const now = new Date().toLocaleTimeString();
-            document.getElementById('output').innerHTML = 
-                `<p style="color: #2196F3;">⏰ 当前时间：${now}</p>`;
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局进程池通道
+process_lane = ProcessLane(PROCESS_POOL_WORKERS)
+
+
+# 任务文件存储配置
+TASK_STORE_DIR = os.environ.get(
+    'TASK_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.task_store'))
+FILE_SPILL_THRESHOLD = int(os.environ.get('FILE_SPILL_THRESHOLD', str(256 * 1024)))  # 超过该字节数的文件写入磁盘
+FILE_TREE_MODE = os.environ.get('FILE_TREE_MODE', 'full')  # file_structure_update 的内容: full 完整文件树 / lazy 根目录摘要
+FILE_TREE_MODES = ('full', 'lazy')
+FILE_TREE_PAGE_SIZE = int(os.environ.get('FILE_TREE_PAGE_SIZE', '500'))  # /tree 每个目录默认返回的子节点数
+FILE_TREE_MAX_DEPTH = int(os.environ.get('FILE_TREE_MAX_DEPTH', '8'))  # /tree 一次最多展开的层数
+
+
+# ==================== 任务检查点 ====================
+
+CHECKPOINT_ENABLED = os.environ.get('CHECKPOINT_ENABLED', '1') == '1'  # 是否在步骤边界写入检查点并在重启后恢复任务
+
+
+# 全局检查点存储
+checkpoint_store = CheckpointStore(TASK_STORE_DIR, task_index, CHECKPOINT_ENABLED)
+
+
+# ==================== 附件上传 ====================
+
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(100 * 1024 * 1024)))  # 单个附件上限
+TASK_ATTACHMENT_QUOTA = int(os.environ.get('TASK_ATTACHMENT_QUOTA', str(500 * 1024 * 1024)))  # 每个任务的附件总量上限
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))  # 建议客户端每次续传的字节数
+UPLOAD_SESSION_TTL = float(os.environ.get('UPLOAD_SESSION_TTL', '3600'))  # 未完成的上传保留时间（秒）
+
+
+# 全局附件存储
+attachment_store = AttachmentStore(os.path.join(TASK_STORE_DIR, '_attachments'), task_id_generator.new_id,
+                                   UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_TTL)
+
+
+# ==================== 结果缓存 ====================
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '0') == '1'  # 未指定cache时是否使用结果缓存
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # 缓存总大小上限
+RESULT_CACHE_VERSION = os.environ.get('RESULT_CACHE_VERSION', '1')  # 执行器输出变化时递增，使旧缓存失效
+RESULT_CACHE_REPLAY_SPEED = float(os.environ.get('RESULT_CACHE_REPLAY_SPEED', '0'))  # 回放速度，0为立即发送，1为原始节奏
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(TASK_STORE_DIR, '_result_cache'))  # 缓存的磁盘文件目录
+CACHE_MODES = ('use', 'bypass')
+
+
+# 全局结果缓存
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_VERSION)
+
+
+# ==================== 消息流录制 ====================
+
+STREAM_RECORD_RATE = float(os.environ.get('STREAM_RECORD_RATE', '0'))  # 未指定record时录制的任务比例（0-1）
+STREAM_RECORDINGS_DIR = os.environ.get('STREAM_RECORDINGS_DIR', os.path.join(TASK_STORE_DIR, '_recordings'))
+REPLAY_MAX_COPIES = int(os.environ.get('REPLAY_MAX_COPIES', '200'))  # 一次回放请求最多创建的任务数
+RECORDING_FORMAT = 'resear-stream-trace'
+
+
+class StreamRecordingStore:
+    """
+    消息流录制
+
+    录制的任务保存执行器经 _send_message 发出的每条消息（类型、数据、发出时间），
+    以及 /connect 流把每条消息写出 generate_chunked_response 的时间和字节数。
+    任务结束和流关闭时写入 <目录>/<task_id>.ndjson.gz：
+        第一行为元数据 {"format", "version", "task_id", "prompt", "profile", "first_sequence", ...}
+        之后按时间排序，每行一个事件，t 为相对第一条消息的毫秒数
+            {"t", "seq", "type", "data"}          执行器发出消息
+            {"t", "seq", "stream", "bytes"}       流写出消息
+    录制文件可通过 POST /api/replays 在任意服务器上回放，不运行执行器
+    """
+
+    VERSION = 1
+
+    def __init__(self, root: str):
+        self.root = root
+        self.saved = 0
+
+    def path(self, task_id: str) -> str:
+        return os.path.join(self.root, f"{task_id}.ndjson.gz")
+
+    def save(self, executor: 'TaskExecutor') -> Optional[str]:
+        """
+        写入任务的录制（重复调用时覆盖，流关闭时再次写入以包含最后的写出事件）
+
+        Returns:
+            录制文件路径，任务未录制时返回None
+        """
+        import gzip
+
+        if executor.stream_writes is None or not executor.recording:
+            return None
+        sends = list(executor.recording)
+        writes = list(executor.stream_writes)
+        origin = sends[0][2]
+        first_sequence = executor.messages_sent - len(sends)
+        record = task_index.get(executor.task_id) or {}
+        events = [(at, 0, {'seq': first_sequence + i, 'type': msg_type, 'data': data})
+                  for i, (msg_type, data, at) in enumerate(sends)]
+        events.extend((at, 1, {'seq': seq, 'stream': stream, 'bytes': size}) for stream, seq, size, at in writes)
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(executor.task_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    'format': RECORDING_FORMAT,
+                    'version': self.VERSION,
+                    'task_id': executor.task_id,
+                    'prompt': executor.prompt,
+                    'profile': record.get('profile'),
+                    'status': executor.task_status,
+                    'first_sequence': first_sequence,
+                    'messages': len(sends),
+                    'writes': len(writes),
+                    'recorded_at': time.time()
+                }, ensure_ascii=False) + '\n')
+                for at, _, event in events:
+                    if 'data' in event:
+                        event = {**event, 'data': self.resolve(event['data'])}  # 大文件内容逐条读取，写出后即释放
+                    f.write(json.dumps({'t': round((at - origin) * 1000, 3), **event}, ensure_ascii=False) + '\n')
+        except OSError as e:
+            # 任务已被清理时按路径引用的文件内容可能已删除
+            logger.error(f"Failed to save recording of task {executor.task_id}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        os.replace(tmp_path, path)
+        self.saved += 1
+        return path
+
+    @staticmethod
+    def resolve(data: Dict[str, Any]) -> Dict[str, Any]:
+        """把录制中按路径引用的文件内容（见 TaskExecutor._record）读回消息数据"""
+        if 'content_path' not in data:
+            return data
+        with open(data['content_path'], 'r', encoding='utf-8') as f:
+            content = f.read()
+        return {**{k: v for k, v in data.items() if k != 'content_path'}, 'content': content}
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        recordings = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith('.ndjson.gz'):
+                path = os.path.join(self.root, name)
+                recordings.append({'task_id': name[:-len('.ndjson.gz')], 'bytes': os.path.getsize(path),
+                                   'recorded_at': os.path.getmtime(path)})
+        return recordings
+
+    @staticmethod
+    def load(data: bytes) -> Dict[str, Any]:
+        """
+        解析录制文件（gzip压缩或未压缩的NDJSON）
+
+        Returns:
+            {'meta', 'messages': [(类型, 数据, 秒)], 'writes': [(流编号, 序号, 字节数, 秒)]}
+
+        Raises:
+            ValueError: 格式错误
+        """
+        import gzip
+
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        lines = data.decode('utf-8').splitlines()
+        if not lines:
+            raise ValueError('Recording is empty')
+        meta = json.loads(lines[0])
+        if meta.get('format') != RECORDING_FORMAT:
+            raise ValueError(f"Not a {RECORDING_FORMAT} file")
+        messages = []
+        writes = []
+        for line in lines[1:]:
+            event = json.loads(line)
+            if 'type' in event:
+                messages.append((event['type'], event['data'], event['t'] / 1000))
+            else:
+                writes.append((event['stream'], event['seq'], event['bytes'], event['t'] / 1000))
+        return {'meta': meta, 'messages': messages, 'writes': writes}
+
+    @staticmethod
+    def replay_entry(recording: Dict[str, Any]) -> Dict[str, Any]:
+        """把录制转换为 CachedResultExecutor 的回放条目（最终文件由消息还原，不再对齐）"""
+        return {
+            'source_task_id': recording['meta']['task_id'],
+            'messages': recording['messages'],
+            'files': None,
+            'media_refs': {}
         }
-    </script>
-</body>
-</html>''',
-        'description': 'Interactive HTML demonstration page with modern styling'
-    }
-}
+
+    def stats(self) -> Dict[str, Any]:
+        return {'saved': self.saved, 'record_rate': STREAM_RECORD_RATE}
+
+
+# 全局录制存储
+stream_recordings = StreamRecordingStore(STREAM_RECORDINGS_DIR)
+_stream_ids = itertools.count(1)  # /connect 流编号，录制中区分同一任务的多个流
+
+
+# ==================== 全文搜索 ====================
+
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', '1') == '1'  # 是否为任务文件和执行日志建立索引
+SEARCH_BATCH_INTERVAL = float(os.environ.get('SEARCH_BATCH_INTERVAL', '0.5'))  # 后台批量建索引的间隔（秒）
+SEARCH_MAX_DOC_CHARS = int(os.environ.get('SEARCH_MAX_DOC_CHARS', str(1024 * 1024)))  # 每个文档只索引前N个字符
+SEARCH_KINDS = ('file', 'activity')
+
+
+# 全局搜索索引
+search_index = SearchIndex(task_index, task_executors, SEARCH_BATCH_INTERVAL, SEARCH_MAX_DOC_CHARS,
+                           SEARCH_INDEX_ENABLED)
+
+
+# ==================== 任务执行器 ====================
 
 
 class TaskExecutor:
@@ -229,20 +1729,38 @@ class TaskExecutor:
         self.task_id = task_id
         self.prompt = prompt
         self.current_file = "todo.md"
-        self.file_content = ""
         self.is_paused = False
-        self.all_files = {}  # 存储所有创建的文件
-        self.execution_log = []  # 执行日志
-        self.file_structure = {
-            "name": "/",  # 改为根目录
-            "type": "directory", 
-            "children": []
-        }
+        self.content_version = VersionClock()  # 文件和执行日志共用的内容版本号
+        self.all_files = TaskFileStore(task_id, TASK_STORE_DIR, FILE_SPILL_THRESHOLD, self.content_version)  # 存储所有创建的文件
+        self.execution_log = ActivityLog(self.content_version)  # 执行日志
+        self.file_tree_mode = FILE_TREE_MODE  # full 时 file_structure_update 带完整文件树，lazy 时只带摘要
         self.task_status = "created"  # 添加任务状态追踪
         self.step_interval = 3.0  # 每步间隔3秒
         self.messages_sent = 0  # 消息序号计数器
         self.is_running = False  # 运行状态标志
+        self.scheduled = False  # 是否已提交给调度器
+        self.exited = False  # 执行线程是否已退出 execute_task
+        self._exit_callbacks: List = []  # 执行线程退出后调用
+        self._exit_lock = Lock()
+        self.is_cancelled = False  # 取消标志
+        self._cancel_event = Event()  # 取消时唤醒等待中的执行线程，立即释放调度器槽位
+        self.paused_by_disconnect = False  # 因客户端断开而暂停，重新连接时自动恢复
+        self._activity_ids = itertools.count(1)  # 活动ID计数器
+        self.media_refs: Dict[str, str] = {}  # 文件名 -> 媒体缓存中的内容哈希
+        self.trace: Optional[TaskTrace] = None  # 开启追踪时的span缓冲区
+        self.cache_key: Optional[str] = None  # 完成后写入结果缓存时使用的键
+        self.recording: Optional[List[Tuple[str, Dict[str, Any], float]]] = None  # (类型, 数据, 相对时间)
+        self.stream_writes: Optional[List[Tuple[int, int, int, float]]] = None  # 录制时: (流编号, 序号, 字节数, 时间)
+        self.completed_steps = 0  # 已完成的步骤数，写入检查点，恢复时跳过这些步骤
+        self.checkpoints = True  # 是否在步骤边界写入检查点
+        self.terminal = TerminalScrollback()  # 终端输出回滚缓冲区
 
+    @property
+    def file_content(self) -> str:
+        """当前活动文件的内容（从文件存储读取，不单独保存副本）"""
+        return self.all_files.get(self.current_file, "")
+
+    @traced()
     def emit_activity(self, activity_type: str, text: str, **kwargs) -> int:
         """
         发送活动更新到前端
@@ -255,35 +1773,32 @@ class TaskExecutor:
         Returns:
             活动ID，用于后续状态更新
         """
-        activity_id = int(time.time() * 1000000)  # 使用微秒确保唯一性
-        activity = {
-            "id": activity_id,
-            "text": text,
-            "type": activity_type,
-            "status": kwargs.get("status", "in-progress"),
-            "timestamp": time.time()
-        }
-        
-        # 根据活动类型添加特定数据
+        activity_id = next(self._activity_ids)  # 任务内单调递增，并发步骤也不会重复
+        # 根据活动类型记录特定数据
+        optional = {}
         if activity_type == "command":
-            activity["command"] = kwargs.get("command", "")
+            optional["command"] = kwargs.get("command", "")
         elif activity_type in ["file", "edit"]:
-            activity["filename"] = kwargs.get("filename", "")
+            optional["filename"] = kwargs.get("filename", "")
         elif activity_type == "browse":
-            activity["path"] = kwargs.get("path", "")
+            optional["path"] = kwargs.get("path", "")
         elif activity_type == "terminal":
-            activity["output"] = kwargs.get("output", "")
-            activity["command"] = kwargs.get("command", "")
-        
-        logger.info(f"Task {self.task_id} - Activity: {activity}")
+            optional["output"] = kwargs.get("output", "")
+            optional["command"] = kwargs.get("command", "")
+
+        record = ActivityRecord(activity_id, text, activity_type,
+                                kwargs.get("status", "in-progress"), time.time(), **optional)
+        logger.info("Task %s - Activity %s [%s]: %s", self.task_id, activity_id, activity_type, text)
         # 记录到执行日志
-        self.execution_log.append(activity)
+        self.execution_log.append(record)
+        search_index.submit('put', self.task_id, 'activity', activity_id, activity_search_text(record))
 
         # 发送到前端
-        self._send_message("activity", activity)
+        self._send_message("activity", record.to_dict())
 
         return activity_id
 
+    @traced()
     def update_activity_status(self, activity_id: int, status: str, **kwargs):
         """
         更新活动状态
@@ -293,6 +1808,7 @@ class TaskExecutor:
             status: 新状态 (completed, failed, in-progress)
             **kwargs: 其他更新参数
         """
+        self.execution_log.update(activity_id, status, **kwargs)
         update_data = {
             "id": activity_id,
             "status": status,
@@ -300,6 +1816,7 @@ class TaskExecutor:
         }
         self._send_message("activity_update", update_data)
 
+    @traced()
     def _send_message(self, msg_type: str, data: dict):
         """
         发送消息到队列的统一方法
@@ -308,86 +1825,78 @@ class TaskExecutor:
             msg_type: 消息类型
             data: 消息数据
         """
-        if self.task_id in task_queues:
+        channel = task_queues.get(self.task_id)
+        if channel is not None:
             message = {
                 "type": msg_type,
                 "data": data,
                 "sequence": self.messages_sent
             }
-            task_queues[self.task_id].put(message)
+            # 订阅者落后过多时阻塞等待（背压），任务被清理后放弃发送
+            if not channel.publish(message):
+                return
             self.messages_sent += 1
+            if self.recording is not None:
+                self._record(msg_type, data)
             logger.info(f"消息已发送: {msg_type}, 序号: {self.messages_sent}, 任务: {self.task_id}")
 
+    def _record(self, msg_type: str, data: Dict[str, Any]):
+        """
+        录制已发送的消息
+        超过 FILE_SPILL_THRESHOLD 的文件内容写入 <任务目录>/recording/<序号>，录制中只保留路径（content_path），
+        与 TaskFileStore 一样不在内存中长期保存大文件；读取见 StreamRecordingStore.resolve
+        """
+        content = data.get('content') if msg_type == 'file_update' else None
+        if isinstance(content, str) and len(content) * 4 > FILE_SPILL_THRESHOLD:
+            encoded = content.encode('utf-8')
+            if len(encoded) > FILE_SPILL_THRESHOLD:
+                path = os.path.join(TASK_STORE_DIR, self.task_id, 'recording', str(self.messages_sent))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(encoded)
+                os.replace(f"{path}.tmp", path)
+                data = {**{k: v for k, v in data.items() if k != 'content'}, 'content_path': path}
+        self.recording.append((msg_type, data, time.monotonic()))
+
+    @traced()
     def emit_file_update(self, filename: str, content: str):
         """
         发送文件内容更新 - 使用扁平化目录结构
         """
         # 保存文件到内存 - 直接使用文件名，不添加目录前缀
         self.all_files[filename] = content
+        search_index.submit('index_file', self.task_id, filename)
         
-        # 先更新文件结构
-        self.update_file_structure()
-
-        # 1. 先发送文件结构更新
-        self._send_message("file_structure_update", self.file_structure)
+        # 1. 先发送文件结构更新（文件树已随写入更新）
+        self.emit_file_structure_update()
         
         # 2. 然后发送文件内容更新 - 直接使用文件名
         file_data = {
             "filename": filename,  # 不添加目录前缀
             "content": content
         }
+        if filename in self.media_refs:
+            file_data["media_url"] = f"/api/media/{self.media_refs[filename]}"
         self._send_message("file_update", file_data)
         
         # 3. 设置当前活动文件
         self.current_file = filename
-        self.file_content = content
-
-
-    def update_file_structure(self):
-        """更新文件结构 - 扁平化根目录结构"""
-        structure = {
-            "name": "/",  # 根目录
-            "type": "directory",
-            "children": []
-        }
 
-        # 按文件夹组织文件
-        folders = {}
-        for filename in self.all_files.keys():
-            parts = filename.split('/')
-            if len(parts) > 1:
-                # 有子目录的文件
-                folder = parts[0]
-                if folder not in folders:
-                    folders[folder] = []
-                folders[folder].append('/'.join(parts[1:]))
-            else:
-                # 直接在根目录的文件
-                structure["children"].append({
-                    "name": filename,
-                    "type": "file",
-                    "size": len(self.all_files[filename])
-                })
 
-        # 添加文件夹
-        for folder, files in folders.items():
-            folder_node = {
-                "name": folder,
-                "type": "directory",
-                "children": [
-                    {
-                        "name": file,
-                        "type": "file",
-                        "size": len(self.all_files[f"{folder}/{file}"])
-                    }
-                    for file in files
-                ]
-            }
-            structure["children"].append(folder_node)
+    @property
+    def file_structure(self) -> Dict[str, Any]:
+        """完整文件树"""
+        return self.all_files.tree.to_structure()
 
-        self.file_structure = structure
+    @traced()
+    def emit_file_structure_update(self):
+        """发送文件结构更新：full 模式为完整文件树，lazy 模式为根目录摘要（客户端按需通过 /tree 获取展开的目录）"""
+        tree = self.all_files.tree
+        self._send_message("file_structure_update",
+                           tree.summary() if self.file_tree_mode == 'lazy' else tree.to_structure())
 
-    def emit_terminal_output(self, command: str, output: str, status: str = "completed"):
+    @traced()
+    def emit_terminal_output(self, command: str, output: str, status: str = "completed", **kwargs):
         """
         发送终端输出
 
@@ -395,58 +1904,315 @@ class TaskExecutor:
             command: 执行的命令
             output: 命令输出结果
             status: 执行状态
+            **kwargs: 附加字段；run_command 结束时带 command_id、exit_code 和 streamed（输出已经分块发送过）
         """
+        if 'command_id' not in kwargs:
+            # 整段发送的输出也写入回滚缓冲区
+            command_id = self.terminal.begin(command)
+            self.terminal.write(command_id, 'stdout', output)
+            self.terminal.end(command_id, status)
         terminal_data = {
             "command": command,
             "output": output,
             "status": status,
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            **kwargs
         }
         self._send_message("terminal", terminal_data)
 
+    @traced()
+    def run_command(self, command: str, timeout: float = TERMINAL_COMMAND_TIMEOUT) -> Optional[int]:
+        """
+        在任务工作目录中执行shell命令，输出边产生边以 terminal_chunk 消息发送并写入回滚缓冲区
+
+        stdout 和 stderr 各由一个线程按块读取；执行线程攒够 TERMINAL_BATCH_LINES 行
+        或一批的第一块等待超过 TERMINAL_BATCH_INTERVAL 秒时发送（同一批内按输出流分条）。
+        命令结束后发送一条 terminal 消息，带退出码和输出的最后几行，只处理 terminal 消息的前端也能显示结果。
+        超时时终止进程（状态 timeout）；任务取消时终止进程并抛出 TaskCancelled
+
+        Returns:
+            退出码，超时为None
+        """
+        workspace = os.path.join(TASK_STORE_DIR, self.task_id, 'workspace')
+        os.makedirs(workspace, exist_ok=True)
+        command_id = self.terminal.begin(command)
+        # 新会话中运行，终止时连同命令启动的子进程一起结束（否则子进程持有管道，读取线程无法结束）
+        process = subprocess.Popen(command, shell=True, cwd=workspace, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        chunks: queue.Queue = queue.Queue()
+
+        def read(pipe, stream: str):
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            with pipe:
+                for block in iter(lambda: pipe.read1(65536), b''):
+                    chunks.put((stream, decoder.decode(block)))
+            chunks.put((stream, decoder.decode(b'', final=True)))
+            chunks.put((stream, None))  # 流结束
+
+        for pipe, stream in ((process.stdout, 'stdout'), (process.stderr, 'stderr')):
+            Thread(target=read, args=(pipe, stream), daemon=True, name=f'terminal-{stream}').start()
+
+        def kill():
+            try:
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except OSError:
+                pass
+
+        pending: List[Tuple[str, str]] = []  # 本批的 (stream, 输出)
+        pending_lines = 0
+        flush_at = 0.0
+        deadline = time.monotonic() + timeout
+        open_streams = 2
+        status = None
+
+        def flush():
+            # 相邻的同一输出流合并为一条消息
+            merged: List[List[str]] = []
+            for stream, text in pending:
+                if merged and merged[-1][0] == stream:
+                    merged[-1][1] += text
+                else:
+                    merged.append([stream, text])
+            for stream, text in merged:
+                self._send_message("terminal_chunk", {
+                    "command_id": command_id,
+                    "command": command,
+                    "stream": stream,
+                    "output": text,
+                    "timestamp": time.time()
+                })
+            pending.clear()
+
+        while open_streams:
+            now = time.monotonic()
+            wait = flush_at - now if pending else 0.5
+            try:
+                stream, text = chunks.get(timeout=max(min(wait, deadline - now), 0.01))
+                if text is None:
+                    open_streams -= 1
+                elif text:
+                    self.terminal.write(command_id, stream, text)
+                    if not pending:
+                        flush_at = time.monotonic() + TERMINAL_BATCH_INTERVAL
+                    pending.append((stream, text))
+                    pending_lines += text.count('\n')
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if pending and (pending_lines >= TERMINAL_BATCH_LINES or now >= flush_at or not open_streams):
+                flush()
+                pending_lines = 0
+            if status is None and self.is_cancelled:
+                status = 'cancelled'
+                kill()
+            elif status is None and now >= deadline:
+                status = 'timeout'
+                kill()
+
+        exit_code = process.wait()
+        if status is None:
+            status = 'completed' if exit_code == 0 else 'failed'
+        self.terminal.end(command_id, status, exit_code)
+        summary = [line['text'] for line in self.terminal.tail(TERMINAL_SUMMARY_LINES)
+                   if line['command_id'] == command_id]
+        self.emit_terminal_output(command, '\n'.join(summary), status, command_id=command_id,
+                                  exit_code=None if status == 'timeout' else exit_code, streamed=True)
+        if status == 'cancelled':
+            raise TaskCancelled(self.task_id)
+        return None if status == 'timeout' else exit_code
+
+    @traced()
     def emit_task_update(self, status: str, **kwargs):
         """
         发送任务状态更新
 
         Args:
-            status: 任务状态 (started, completed, failed, paused)
+            status: 任务状态 (started, completed, failed, cancelled, paused)
             **kwargs: 其他状态信息
         """
-        # 更新内部状态
+        # 更新内部状态并同步到任务索引
         self.task_status = status
+        record_task_event(self.task_id, status, status=status, **kwargs)
+        if status in FINAL_STATUSES:
+            checkpoint_store.remove(self.task_id)
         
         task_data = {
             "status": status,
             **kwargs
         }
+        if status == "completed" and self.cache_key is not None:
+            # 先写入缓存再发送完成通知：客户端收到 completed 后立即提交相同请求时能够命中
+            result_cache.store(self.cache_key, self, final=("task_update", task_data))
         self._send_message("task_update", task_data)
 
+        if status in FINAL_STATUSES and self.stream_writes is not None:
+            stream_recordings.save(self)
+
+    def emit_task_started(self):
+        """发送任务开始；从检查点恢复的任务附带恢复时已完成的步骤数"""
+        if self.completed_steps:
+            self.emit_task_update("started", resumed_from_step=self.completed_steps)
+        else:
+            self.emit_task_update("started")
+
+    def begin_step(self, step_num: int) -> bool:
+        """
+        步骤边界：恢复前已完成的步骤直接跳过；需要执行时先记录之前的步骤已完成并写入检查点
+
+        Returns:
+            是否执行该步骤
+        """
+        if step_num <= self.completed_steps:
+            return False
+        self.completed_steps = step_num - 1
+        if self.checkpoints:
+            try:
+                checkpoint_store.save(self)
+            except (OSError, TypeError, ValueError) as e:
+                logger.error(f"Failed to checkpoint task {self.task_id} at step {step_num}: {e}")
+        return True
+
     def pause_task(self):
         """暂停任务执行"""
         self.is_paused = True
+        record_task_event(self.task_id, "paused", status="paused")
         logger.info(f"Task {self.task_id} paused")
 
     def resume_task(self):
         """恢复任务执行"""
         self.is_paused = False
+        record_task_event(self.task_id, "resumed", status=self.task_status)
         logger.info(f"Task {self.task_id} resumed")
 
+    def cancel(self):
+        """取消任务执行，正在等待的执行线程立即退出"""
+        self.is_cancelled = True
+        self.is_paused = False
+        self._cancel_event.set()
+        logger.info(f"Task {self.task_id} cancelled")
+
+    def after_exit(self, callback):
+        """
+        执行线程退出后调用callback（在执行线程中）；没有在执行（未提交或已退出）时立即调用。
+        用于在执行中的步骤（媒体下载、命令执行等）结束后再删除任务目录，避免步骤重新创建目录
+        """
+        with self._exit_lock:
+            if self.scheduled and not self.exited:
+                self._exit_callbacks.append(callback)
+                return
+        callback()
+
+    def mark_exited(self):
+        """调度器在 execute_task 返回后调用"""
+        with self._exit_lock:
+            self.exited = True
+            callbacks, self._exit_callbacks = self._exit_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @traced()
+    def offload(self, text: str, fn, *args, **kwargs):
+        """
+        在进程池中执行CPU密集型步骤，执行期间以进行中的活动展示，完成后更新状态并返回结果
+
+        Args:
+            text: 活动描述
+            fn: cpu_jobs 中可序列化的函数
+        """
+        from concurrent.futures import TimeoutError as FutureTimeout
+
+        activity_id = self.emit_activity("thinking", text, status="in-progress")
+        future = process_lane.submit(fn, *args, **kwargs)
+        try:
+            while True:
+                try:
+                    result = future.result(timeout=0.5)
+                    break
+                except FutureTimeout:
+                    if self.is_cancelled:
+                        future.cancel()
+                        raise TaskCancelled(self.task_id)
+        except Exception:
+            self.update_activity_status(activity_id, "error")
+            raise
+        self.update_activity_status(activity_id, "completed")
+        return result
+
+    def attach_file(self, filename: str, path: str, size: int):
+        """登记上传完成的附件（硬链接到任务目录，不读入内存）并通知前端文件结构变化"""
+        self.all_files.add_path(filename, path, size, link=True)
+        self.emit_file_structure_update()
+
+    def to_state(self) -> Dict[str, Any]:
+        """任务执行进度的可序列化快照"""
+        return {
+            'task_id': self.task_id,
+            'prompt': self.prompt,
+            'task_status': self.task_status,
+            'current_file': self.current_file,
+            'messages_sent': self.messages_sent,
+            'file_tree_mode': self.file_tree_mode,
+            'media_refs': self.media_refs,
+            'files': self.all_files.to_state(),
+            'execution_log': self.execution_log.to_list(),
+            'completed_steps': self.completed_steps
+        }
+
+    def restore_state(self, state: Dict[str, Any]):
+        """从 to_state() 的快照恢复执行进度，消息序号和活动ID从快照处继续"""
+        self.task_status = state['task_status']
+        self.current_file = state['current_file']
+        self.messages_sent = state['messages_sent']
+        self.file_tree_mode = state.get('file_tree_mode', FILE_TREE_MODE)
+        self.media_refs = dict(state['media_refs'])
+        self.completed_steps = state.get('completed_steps', 0)
+        self.all_files.load_state(state['files'])
+        for data in state['execution_log']:
+            self.execution_log.append(ActivityRecord(
+                data['id'], data['text'], data['type'], data['status'], data['timestamp'],
+                **{f: data[f] for f in ActivityRecord.OPTIONAL_FIELDS if f in data}))
+        self._activity_ids = itertools.count(max((r.id for r in self.execution_log), default=0) + 1)
+
+    def state_messages(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """按当前执行进度构造的 (消息类型, 数据) 列表，用于填充从检查点恢复的通道的状态视图"""
+        messages = [('task_update', {'status': self.task_status})]
+        messages.extend(('activity', data) for data in self.execution_log.to_list())
+        tree = self.all_files.tree
+        messages.append(('file_structure_update',
+                         tree.summary() if self.file_tree_mode == 'lazy' else tree.to_structure()))
+        if self.current_file in self.all_files:
+            file_data = {'filename': self.current_file, 'content': self.all_files[self.current_file]}
+            if self.current_file in self.media_refs:
+                file_data['media_url'] = f"/api/media/{self.media_refs[self.current_file]}"
+            messages.append(('file_update', file_data))
+        return messages
+
+    @traced()
     def wait_if_paused(self, duration: float = None):
         """
         检查暂停状态，如果暂停则等待
 
         Args:
             duration: 等待时长，默认使用step_interval
+
+        Raises:
+            TaskCancelled: 任务已被取消
         """
         if duration is None:
             duration = self.step_interval
             
         if self.is_paused:
             while self.is_paused:
-                time.sleep(0.5)  # 暂停期间每0.5秒检查一次
+                self._cancel_event.wait(0.5)  # 暂停期间每0.5秒检查一次
         else:
-            time.sleep(duration)
+            self._cancel_event.wait(duration)
+        if self.is_cancelled:
+            raise TaskCancelled(self.task_id)
 
+    @traced()
     def execute_step(self, step_num: int, activity_type: str, text: str, **kwargs):
         """
         执行单个步骤的通用方法
@@ -471,6 +2237,7 @@ class TaskExecutor:
         
         return activity_id
 
+    @traced()
     def execute_task(self):
         """
         重构后的任务执行流程 - 简化为10个主要步骤，每步3秒间隔
@@ -478,19 +2245,26 @@ class TaskExecutor:
         self.is_running = True
         try:
             # 任务开始
-            self.emit_task_update("started")
+            self.emit_task_started()
             
             # 步骤1：任务分析和初始化
-            self.execute_step(1, "thinking", "分析任务需求并初始化多媒体工作环境")
+            if self.begin_step(1):
+                self.execute_step(1, "thinking", "分析任务需求并初始化多媒体工作环境")
             
             # 步骤2：创建工作目录
-            command = "mkdir -p workspace/media && cd workspace"
-            activity_id = self.execute_step(2, "command", "创建多媒体工作空间", command=command)
-            self.emit_terminal_output(command, 
-                "✅ 工作目录创建成功\n📁 多媒体工作空间已初始化\n🎯 准备支持PDF、图片和交互内容")
+            if self.begin_step(2):
+                command = "mkdir -p workspace/media && cd workspace"
+                activity_id = self.execute_step(2, "command", "创建多媒体工作空间", command=command)
+                if TERMINAL_EXECUTE_COMMANDS:
+                    # 在任务工作目录中真实执行，输出以 terminal_chunk 实时发送
+                    self.run_command(command)
+                else:
+                    self.emit_terminal_output(command,
+                        "✅ 工作目录创建成功\n📁 多媒体工作空间已初始化\n🎯 准备支持PDF、图片和交互内容")
 
             # 步骤3：创建任务清单文件
-            todo_content = f"""# Task: {self.prompt}
+            if self.begin_step(3):
+                todo_content = f"""# Task: {self.prompt}
 
 ## 📋 任务进度
 - [x] 分析用户需求
@@ -515,55 +2289,62 @@ class TaskExecutor:
 开始时间: {time.strftime('%Y-%m-%d %H:%M:%S')}
 状态: 🟡 进行中
 """
-            self.execute_step(3, "file", "创建任务清单文件", filename="todo.md")
-            self.emit_file_update("todo.md", todo_content)
-            self.file_content = todo_content
+                self.execute_step(3, "file", "创建任务清单文件", filename="todo.md")
+                self.emit_file_update("todo.md", todo_content)
 
             # 步骤4：创建配置文件
-            config_content = json.dumps({
-                "project": {
-                    "name": "Resear Pro Task - 真实多媒体版",
-                    "version": "2.0.0",
-                    "description": "AI研究助手与真实多媒体支持",
-                    "created": time.strftime('%Y-%m-%d %H:%M:%S')
-                },
-                "multimedia": {
-                    "real_urls": True,
-                    "pdf_source": "https://openreview.net/pdf?id=bjcsVLoHYs",
-                    "image_source": "https://bianxieai.com/wp-content/uploads/2024/05/bianxieai.png",
-                    "preview_enabled": True
-                },
-                "task": {
-                    "description": self.prompt,
-                    "priority": "normal",
-                    "multimedia_demo": True
-                }
-            }, indent=2, ensure_ascii=False)
+            if self.begin_step(4):
+                config_content = json.dumps({
+                    "project": {
+                        "name": "Resear Pro Task - 真实多媒体版",
+                        "version": "2.0.0",
+                        "description": "AI研究助手与真实多媒体支持",
+                        "created": time.strftime('%Y-%m-%d %H:%M:%S')
+                    },
+                    "multimedia": {
+                        "real_urls": True,
+                        "pdf_source": "https://openreview.net/pdf?id=bjcsVLoHYs",
+                        "image_source": "https://bianxieai.com/wp-content/uploads/2024/05/bianxieai.png",
+                        "preview_enabled": True
+                    },
+                    "task": {
+                        "description": self.prompt,
+                        "priority": "normal",
+                        "multimedia_demo": True
+                    }
+                }, indent=2, ensure_ascii=False)
             
-            self.execute_step(4, "file", "创建项目配置文件", filename="config.json")
-            self.emit_file_update("config.json", config_content)
+                self.execute_step(4, "file", "创建项目配置文件", filename="config.json")
+                self.emit_file_update("config.json", config_content)
 
             # 步骤5：创建多媒体文件
-            self.execute_step(5, "thinking", "下载并准备真实多媒体文件")
+            if self.begin_step(5):
+                self.execute_step(5, "thinking", "下载并准备真实多媒体文件")
             
-            # 创建多媒体文件
-            for filename, media_info in SAMPLE_MEDIA.items():
-                if 'url' in media_info:
-                    content = media_info['url']
-                elif 'content' in media_info:
-                    content = media_info['content']
-                else:
-                    content = f'Content for {filename}'
-                self.emit_file_update(filename, content)
+                # 创建多媒体文件
+                for filename, media_info in SAMPLE_MEDIA.items():
+                    if 'url' in media_info:
+                        content = media_info['url']
+                        # 通过本地媒体缓存获取，前端和导出都使用缓存副本
+                        entry = media_cache.fetch(content)
+                        if entry is not None:
+                            self.media_refs[filename] = entry['hash']
+                    elif 'file' in media_info:
+                        content = load_sample_media(media_info['file'])
+                    else:
+                        content = f'Content for {filename}'
+                    self.emit_file_update(filename, content)
 
             # 步骤6：验证多媒体链接
-            command = "curl -I https://openreview.net/pdf?id=bjcsVLoHYs"
-            self.execute_step(6, "command", "验证PDF文档可访问性", command=command)
-            self.emit_terminal_output(command, 
-                "HTTP/2 200 OK\ncontent-type: application/pdf\n✅ PDF文档可访问且准备就绪\n📄 研究论文加载成功")
+            if self.begin_step(6):
+                command = "curl -I https://openreview.net/pdf?id=bjcsVLoHYs"
+                self.execute_step(6, "command", "验证PDF文档可访问性", command=command)
+                self.emit_terminal_output(command, 
+                    "HTTP/2 200 OK\ncontent-type: application/pdf\n✅ PDF文档可访问且准备就绪\n📄 研究论文加载成功")
 
             # 步骤7：创建演示报告
-            demo_content = f"""# 🎯 真实多媒体演示报告
+            if self.begin_step(7):
+                demo_content = f"""# 🎯 真实多媒体演示报告
 
 ## 任务概述
 **任务:** {self.prompt}  
@@ -593,14 +2374,15 @@ SVG实时图表渲染：
 ---
 *由Resear Pro AI助手生成 - 真实多媒体URL版* 🚀
 """
-            self.execute_step(7, "file", "创建多媒体演示报告", filename="demo_report.md")
-            self.emit_file_update("demo_report.md", demo_content)
+                self.execute_step(7, "file", "创建多媒体演示报告", filename="demo_report.md")
+                self.emit_file_update("demo_report.md", demo_content)
 
             # 步骤8：运行多媒体集成测试
-            command = "python test_multimedia.py"
-            self.execute_step(8, "command", "运行多媒体集成测试", command=command)
-            self.emit_terminal_output(command, 
-                """🧪 测试真实多媒体集成...
+            if self.begin_step(8):
+                command = "python test_multimedia.py"
+                self.execute_step(8, "command", "运行多媒体集成测试", command=command)
+                self.emit_terminal_output(command, 
+                    """🧪 测试真实多媒体集成...
 ✅ PDF查看器: 成功加载OpenReview论文
 ✅ 图像显示: 品牌logo正确渲染  
 ✅ SVG图表: 交互式图形正常工作
@@ -615,32 +2397,33 @@ URL验证: ✅ 通过
 🎉 所有真实多媒体功能完美运行！""")
 
             # 步骤9：更新任务进度
-            updated_todo = self.file_content.replace(
-                "- [ ] 创建实时多媒体演示", "- [x] 创建实时多媒体演示"
-            ).replace(
-                "- [ ] 生成PDF和图像内容", "- [x] 生成PDF和图像内容"
-            ).replace(
-                "- [ ] 创建交互示例", "- [x] 创建交互示例"
-            ).replace(
-                "- [ ] 测试多媒体支持", "- [x] 测试多媒体支持"
-            ).replace(
-                "- [ ] 完成任务", "- [x] 完成任务"
-            ).replace(
-                "状态: 🟡 进行中", 
-                f"状态: ✅ 已完成\n完成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
+            if self.begin_step(9):
+                updated_todo = self.file_content.replace(
+                    "- [ ] 创建实时多媒体演示", "- [x] 创建实时多媒体演示"
+                ).replace(
+                    "- [ ] 生成PDF和图像内容", "- [x] 生成PDF和图像内容"
+                ).replace(
+                    "- [ ] 创建交互示例", "- [x] 创建交互示例"
+                ).replace(
+                    "- [ ] 测试多媒体支持", "- [x] 测试多媒体支持"
+                ).replace(
+                    "- [ ] 完成任务", "- [x] 完成任务"
+                ).replace(
+                    "状态: 🟡 进行中", 
+                    f"状态: ✅ 已完成\n完成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}"
+                )
             
-            self.execute_step(9, "edit", "更新任务完成状态", filename="todo.md")
-            self.emit_file_update("todo.md", updated_todo)
-            self.file_content = updated_todo
+                self.execute_step(9, "edit", "更新任务完成状态", filename="todo.md")
+                self.emit_file_update("todo.md", updated_todo)
 
             # 步骤10：生成最终报告
-            self.execute_step(10, "thinking", "生成任务完成报告和总结")
+            if self.begin_step(10):
+                self.execute_step(10, "thinking", "生成任务完成报告和总结")
             
-            # 发送最终总结
-            self.emit_terminal_output(
-                "echo '真实多媒体任务执行完成'",
-                f"""
+                # 发送最终总结
+                self.emit_terminal_output(
+                    "echo '真实多媒体任务执行完成'",
+                    f"""
 🎊 === Resear Pro 真实多媒体任务执行报告 ===
 
 📋 任务信息
@@ -661,12 +2444,14 @@ URL验证: ✅ 通过
 ✅ 任务状态: 成功完成
 🎯 所有真实多媒体文件准备就绪，可在仪表板中查看！
 """
-            )
+                )
 
             # 任务完成
             self.emit_task_update("completed")
             logger.info(f"Task {self.task_id} completed successfully")
 
+        except TaskCancelled:
+            self.emit_task_update("cancelled")
         except Exception as e:
             logger.error(f"Task {self.task_id} failed: {str(e)}")
             self.emit_activity("thinking", f"任务执行错误: {str(e)}", status="error")
@@ -674,12 +2459,14 @@ URL验证: ✅ 通过
         finally:
             self.is_running = False
 
+    @traced()
     def emit_file_delete(self, filename: str):
         """发送文件删除事件"""
         if filename in self.all_files:
             del self.all_files[filename]
-        self.update_file_structure()
-        
+        self.media_refs.pop(filename, None)
+        search_index.submit('delete', self.task_id, 'file', filename)
+
         self._send_message("file_delete", {"filename": filename})
 
     def normalize_filename(self, filename: str) -> str:
@@ -698,21 +2485,22 @@ URL验证: ✅ 通过
         # 否则添加根目录前缀
         return f"resear-pro-task/{filename}"
 
+    @traced()
     def emit_file_rename(self, old_name: str, new_name: str):
         """发送文件重命名事件"""
         if old_name in self.all_files:
-            content = self.all_files[old_name]
-            del self.all_files[old_name]
-            self.all_files[new_name] = content
-        
-        self.update_file_structure()
-        
+            self.all_files.rename(old_name, new_name)
+        if old_name in self.media_refs:
+            self.media_refs[new_name] = self.media_refs.pop(old_name)
+        search_index.submit('rename', self.task_id, 'file', old_name, new_name)
+
         rename_data = {
             "old_name": old_name,
             "new_name": new_name
         }
         self._send_message("file_rename", rename_data)
 
+    @traced()
     def create_folder(self, folder_name: str, parent_path: str = '/'):
         """创建文件夹 - 支持在根目录或子目录创建"""
         if parent_path == '/' or parent_path == '':
@@ -728,203 +2516,1099 @@ URL验证: ✅ 通过
         }
         self._send_message("folder_create", folder_data)
 
+    @traced()
     def update_file_structure_for_folder(self, folder_path: str):
-        """为文件夹更新文件结构 - 扁平化处理"""
-        # 简化的文件夹处理逻辑
-        path_parts = [part for part in folder_path.split('/') if part != '']
-        
-        current = self.file_structure
-        if not current.get("children"):
-            current["children"] = []
-        
-        # 递归创建文件夹结构
-        for i, part in enumerate(path_parts):
-            existing = None
-            for child in current["children"]:
-                if child["name"] == part and child["type"] == "directory":
-                    existing = child
-                    break
-            
-            if not existing:
-                new_folder = {
-                    "name": part,
-                    "type": "directory",
-                    "children": []
-                }
-                current["children"].append(new_folder)
-                current = new_folder
-            else:
-                current = existing
-        
-        self._send_message("file_structure_update", self.file_structure)
+        """在文件树中创建文件夹（包括不存在的上级目录）并发送文件结构更新"""
+        self.all_files.tree.add_directory(folder_path)
+        self.emit_file_structure_update()
+
+
+class SimpleTaskExecutor(TaskExecutor):
+    """
+    简化的任务执行器
+    按预定顺序发送一组固定消息，用于测试和演示前端的消息处理；
+    与完整执行器共用消息发送、暂停、调度和存储逻辑
+    """
+
+    def __init__(self, task_id: str, prompt: str):
+        super().__init__(task_id, prompt)
+        self.step_interval = 2.0  # 每条消息间隔2秒
+
+    @traced()
+    def execute_task(self):
+        """执行简化的任务流程"""
+        self.is_running = True
+        try:
+            # 发送任务开始
+            self.emit_task_started()
+
+            # 步骤1：分析任务需求
+            if self.begin_step(1):
+                self.wait_if_paused()
+                activity_id = self.emit_activity("thinking", "步骤1：分析任务需求")
+                self.wait_if_paused()
+                self.update_activity_status(activity_id, "completed")
+
+            # 步骤2：创建工作文件
+            if self.begin_step(2):
+                self.wait_if_paused()
+                activity_id = self.emit_activity("file", "步骤2：创建工作文件", filename="example.md")
+                self.wait_if_paused()
+                self.emit_file_update(
+                    "example.md",
+                    f"# 任务: {self.prompt}\n\n这是一个示例文件。\n\n## 进度\n- [x] 分析需求\n- [x] 创建文件\n- [ ] 完成任务"
+                )
+                self.wait_if_paused()
+                self.update_activity_status(activity_id, "completed")
+                self.wait_if_paused()
+                self.emit_terminal_output("echo '任务进行中...'", "任务进行中...\n✅ 文件创建成功")
+
+            # 步骤3：完成任务
+            if self.begin_step(3):
+                self.wait_if_paused()
+                activity_id = self.emit_activity("thinking", "步骤3：完成任务")
+                self.wait_if_paused()
+                self.emit_file_update(
+                    "example.md",
+                    f"# 任务: {self.prompt}\n\n这是一个示例文件。\n\n## 进度\n- [x] 分析需求\n- [x] 创建文件\n- [x] 完成任务\n\n## 结果\n任务已成功完成！"
+                )
+                self.wait_if_paused()
+                self.update_activity_status(activity_id, "completed")
+                self.wait_if_paused()
+                self.emit_terminal_output("echo '任务完成'", "🎉 任务执行完成！\n📄 文件已更新\n✅ 状态：成功")
+
+            # 任务完成
+            self.wait_if_paused()
+            self.emit_task_update("completed")
+            logger.info(f"Task {self.task_id} completed successfully")
+
+        except TaskCancelled:
+            self.emit_task_update("cancelled")
+        except Exception as e:
+            logger.error(f"Task {self.task_id} failed: {str(e)}")
+            self.emit_task_update("failed", error=str(e))
+        finally:
+            self.is_running = False
+
+
+class CachedResultExecutor(TaskExecutor):
+    """
+    结果缓存回放执行器
+    按原任务的消息序列重新发送（活动时间戳更新为当前时间），同时还原文件、文件结构和执行日志；
+    speed 为0时立即发送，为1时按原始节奏，暂停和取消与普通任务一致。
+    也用于回放录制的消息流（见 StreamRecordingStore）
+    """
 
+    def __init__(self, task_id: str, prompt: str, entry: Dict[str, Any], speed: float = RESULT_CACHE_REPLAY_SPEED):
+        super().__init__(task_id, prompt)
+        self.entry = entry
+        self.speed = speed
+        self.media_refs = dict(entry['media_refs'])
+        self.checkpoints = False  # 重启后结果缓存为空，无法从中途继续回放
+
+    @traced()
+    def execute_task(self):
+        self.is_running = True
+        entry = self.entry
+        commands: Dict[int, int] = {}  # 录制中的命令ID -> 本任务回滚缓冲区中的命令ID
+        try:
+            previous = None
+            for msg_type, data, at in entry['messages']:
+                delay = (at - previous) / self.speed if self.speed > 0 and previous is not None else 0
+                previous = at
+                self.wait_if_paused(delay)
+
+                if msg_type == 'task_update':
+                    # 状态变化经由 emit_task_update 同步到任务索引和事件总线
+                    self.emit_task_update(data['status'], **{k: v for k, v in data.items() if k != 'status'})
+                    continue
+                if msg_type == 'activity':
+                    data = {**data, 'timestamp': time.time()}
+                    self.execution_log.append(ActivityRecord(
+                        data['id'], data['text'], data['type'], data['status'], data['timestamp'],
+                        **{f: data[f] for f in ActivityRecord.OPTIONAL_FIELDS if f in data}))
+                elif msg_type == 'activity_update':
+                    self.execution_log.update(data['id'], data['status'],
+                                              **{f: data[f] for f in ActivityRecord.OPTIONAL_FIELDS if f in data})
+                elif msg_type == 'file_update':
+                    if 'content_path' in data:
+                        # 录制中按路径引用的大文件：链接到本任务的存储，内容只在发送消息时读取
+                        path = data['content_path']
+                        self.all_files.add_path(data['filename'], path, os.path.getsize(path), link=True)
+                        data = StreamRecordingStore.resolve(data)
+                    else:
+                        self.all_files[data['filename']] = data['content']
+                    self.current_file = data['filename']
+                elif msg_type == 'file_delete' and data['filename'] in self.all_files:
+                    del self.all_files[data['filename']]
+                elif msg_type == 'file_rename' and data['old_name'] in self.all_files:
+                    self.all_files.rename(data['old_name'], data['new_name'])
+                elif msg_type == 'terminal_chunk':
+                    if data['command_id'] not in commands:
+                        commands[data['command_id']] = self.terminal.begin(data['command'])
+                    self.terminal.write(commands[data['command_id']], data['stream'], data['output'])
+                elif msg_type == 'terminal':
+                    command_id = commands.pop(data.get('command_id'), None) or self.terminal.begin(data['command'])
+                    if not data.get('streamed'):
+                        self.terminal.write(command_id, 'stdout', data['output'])
+                    self.terminal.end(command_id, data['status'], data.get('exit_code'))
+                elif msg_type == 'file_structure_update' and self.file_tree_mode == 'lazy' and 'lazy' not in data:
+                    data = self.all_files.tree.summary()  # 录制中的完整文件树换成本任务的摘要
+                self._send_message(msg_type, data)
+
+            # 与原任务的最终文件对齐（删除、重命名等）；录制回放没有最终文件，以消息还原的结果为准
+            files = entry['files']
+            if files is not None:
+                for filename in list(self.all_files):
+                    if filename not in files:
+                        del self.all_files[filename]
+                for filename, content in files.items():
+                    if filename in self.all_files:
+                        continue
+                    if isinstance(content, dict):
+                        self.all_files.add_path(filename, content['path'], content['size'], link=True)
+                    else:
+                        self.all_files[filename] = content
+            search_index.submit('reindex_task', self.task_id)
+            logger.info(f"Task {self.task_id} replayed from cached task {entry['source_task_id']}")
+
+        except TaskCancelled:
+            self.emit_task_update("cancelled")
+        except Exception as e:
+            logger.error(f"Task {self.task_id} failed: {str(e)}")
+            self.emit_task_update("failed", error=str(e))
+        finally:
+            self.is_running = False
+
+
+# 执行器配置：每个任务在创建时选择其一
+EXECUTOR_PROFILES: Dict[str, type] = {
+    'full': TaskExecutor,  # 完整的10步多媒体演示流程，每步3秒
+    'simple': SimpleTaskExecutor,  # 简化的固定消息序列，每条2秒
+}
+DEFAULT_EXECUTOR_PROFILE = os.environ.get('DEFAULT_EXECUTOR_PROFILE', 'full')
 
-def create_task_export_zip(task_executor: TaskExecutor) -> bytes:
-    """创建任务导出ZIP文件"""
-    zip_buffer = io.BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # 添加所有创建的文件
-        for filename, content in task_executor.all_files.items():
-            zip_file.writestr(f"files/{filename}", content)
+def export_members(task_executor: TaskExecutor, since: Optional[int] = None,
+                   version: Optional[int] = None) -> List[cpu_jobs.ZipMember]:
+    """
+    导出ZIP的成员列表：磁盘上的文件按路径引用（由压缩方流式读取），其余为内存中的文本
 
-        # 添加执行日志
-        log_content = json.dumps(task_executor.execution_log, indent=2, ensure_ascii=False)
-        zip_file.writestr("execution_log.json", log_content)
+    Args:
+        since: 增量导出的起始内容版本；只包含此后新增或修改的文件、此后变化的执行日志，
+               以及记录删除和重命名的 manifest.json。为None或大于当前版本（如任务从检查点恢复后版本号重新开始）时全量导出
+        version: 本次导出对应的内容版本（返回给客户端作为下次的since），默认取当前版本
+    """
+    files = task_executor.all_files
+    members: List[cpu_jobs.ZipMember] = []
+    if version is None:
+        version = task_executor.content_version.value
+    incremental = since is not None and since <= version
 
-        # 添加任务信息
-        task_info = {
+    if incremental:
+        modified, operations = files.changes_since(since, until=version)
+        names = [name for name in modified if name in files]
+        activities = task_executor.execution_log.changed_since(since)
+        manifest = {
             "task_id": task_executor.task_id,
-            "prompt": task_executor.prompt,
-            "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
-            "total_files": len(task_executor.all_files),
-            "total_activities": len(task_executor.execution_log),
-            "file_list": list(task_executor.all_files.keys()),
-            "file_structure": task_executor.file_structure,
-            "multimedia_support": True,
-            "real_urls": True
+            "since": since,
+            "version": version,
+            "modified": names,
+            "operations": operations,
+            "activities": len(activities)
         }
-        zip_file.writestr("task_info.json", json.dumps(task_info, indent=2, ensure_ascii=False))
+        members.append(("manifest.json", 'data', json.dumps(manifest, indent=2, ensure_ascii=False)))
+    else:
+        names = list(files)
+        activities = list(task_executor.execution_log)
+
+    # 添加所有创建的文件
+    for filename in names:
+        # URL形式的媒体文件导出缓存中的真实内容
+        digest = task_executor.media_refs.get(filename)
+        if digest is not None and media_cache.get(digest) is not None:
+            members.append((f"files/{filename}", 'path', media_cache.path(digest)))
+            continue
+        # 磁盘上的大文件直接从文件流式压缩
+        path = files.spilled_path(filename)
+        if path is not None:
+            members.append((f"files/{filename}", 'path', path))
+        else:
+            members.append((f"files/{filename}", 'data', files[filename]))
+
+    # 添加执行日志（增量导出时为变化的部分）
+    log_content = json.dumps([record.to_dict() for record in activities], indent=2, ensure_ascii=False)
+    members.append(("execution_log.json", 'data', log_content))
+    if incremental:
+        return members
+
+    # 添加任务信息
+    task_info = {
+        "task_id": task_executor.task_id,
+        "prompt": task_executor.prompt,
+        "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "content_version": version,
+        "total_files": len(task_executor.all_files),
+        "total_activities": len(task_executor.execution_log),
+        "file_list": list(task_executor.all_files.keys()),
+        "file_structure": task_executor.file_structure,
+        "multimedia_support": True,
+        "real_urls": True
+    }
+    members.append(("task_info.json", 'data', json.dumps(task_info, indent=2, ensure_ascii=False)))
 
-        # 添加README
-        readme_content = f"""# Resear Pro 真实多媒体任务导出
+    # 添加README
+    readme_content = f"""# Resear Pro 真实多媒体任务导出
 
 ## 任务信息
 - 任务ID: {task_executor.task_id}
 - 任务描述: {task_executor.prompt}
 - 导出时间: {time.strftime('%Y-%m-%d %H:%M:%S')}
 
-## 文件结构
-- `files/` - 任务执行期间创建的所有文件
-- `execution_log.json` - 详细执行日志
-- `task_info.json` - 任务信息和元数据
+## 文件结构
+- `files/` - 任务执行期间创建的所有文件
+- `execution_log.json` - 详细执行日志
+- `task_info.json` - 任务信息和元数据
+
+## 创建的文件
+{chr(10).join(f"- {filename}" for filename in task_executor.all_files.keys())}
+
+---
+由Resear Pro AI助手生成 - 真实多媒体版 🚀
+"""
+    members.append(("README.md", 'data', readme_content))
+    return members
+
+
+@traced(cat='export')
+def create_task_export_zip(task_executor: TaskExecutor, output=None, since: Optional[int] = None,
+                           version: Optional[int] = None) -> Optional[bytes]:
+    """
+    在当前线程中创建任务导出ZIP文件
+
+    Args:
+        task_executor: 任务执行器
+        output: 可写的文件对象；为None时在内存中生成并返回字节
+        since / version: 增量导出的起始内容版本和本次导出的版本，见 export_members
+
+    Returns:
+        未指定output时返回ZIP字节，否则返回None
+    """
+    # 导出是低频操作，缓冲区模块在第一次导出时才导入
+    import io
+
+    zip_buffer = output if output is not None else io.BytesIO()
+    cpu_jobs.write_zip(zip_buffer, export_members(task_executor, since, version))
+
+    if output is not None:
+        return None
+    return zip_buffer.getvalue()
+
+
+@traced(cat='export')
+def create_task_export_zip_in_process(task_executor: TaskExecutor, path: str, since: Optional[int] = None,
+                                      version: Optional[int] = None):
+    """
+    在进程池中创建任务导出ZIP文件并写入path，压缩期间不占用本进程的GIL
+
+    Args:
+        task_executor: 任务执行器
+        path: 输出文件路径
+        since / version: 增量导出的起始内容版本和本次导出的版本，见 export_members
+    """
+    with process_lane.share(export_members(task_executor, since, version)) as (shm_name, members):
+        process_lane.submit(cpu_jobs.write_zip, path, members, shm_name).result()
+
+
+# ==================== API 路由定义 ====================
+
+RUN_MODES = ('attached', 'background')
+
+# Connection/Transfer-Encoding 是逐跳头，由WSGI服务器决定（HTTP/1.1下无Content-Length时自动分块），
+# 应用自行设置会导致重复的分块头，gunicorn等服务器会直接拒绝
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Access-Control-Allow-Origin': '*',
+    'X-Accel-Buffering': 'no'  # 禁止nginx等反向代理缓冲流式响应
+}
+
+
+def register_task(prompt: str, attachments: list, run: str = 'attached',
+                  profile: str = DEFAULT_EXECUTOR_PROFILE,
+                  queue_policy: str = TASK_QUEUE_POLICY, trace: bool = TRACE_ENABLED,
+                  cache: Optional[str] = None, replay_speed: float = RESULT_CACHE_REPLAY_SPEED,
+                  record: Optional[bool] = None, replay: Optional[Dict[str, Any]] = None,
+                  file_tree: str = FILE_TREE_MODE) -> str:
+    """
+    注册新任务：创建消息队列、任务记录和执行器
+
+    Args:
+        prompt: 任务描述
+        attachments: 附件列表
+        run: 运行模式 (attached 由客户端连接时启动且随连接结束清理;
+             background 立即由调度器启动，结束后保留 TASK_RETENTION_SECONDS 秒)
+        profile: 执行器配置名，见 EXECUTOR_PROFILES
+        queue_policy: 消息积压处理策略，见 TaskChannel.POLICIES
+        trace: 是否记录执行追踪（/api/tasks/<id>/trace 下载）
+        cache: 结果缓存模式，use 命中时回放缓存结果、未命中时完成后写入缓存；bypass 不读不写。
+               默认由 RESULT_CACHE_ENABLED 决定
+        replay_speed: 命中缓存或回放录制时的速度，见 CachedResultExecutor
+        record: 是否录制消息流（见 StreamRecordingStore），默认按 STREAM_RECORD_RATE 抽样
+        replay: 回放条目（StreamRecordingStore.replay_entry），给定时不执行任务流程而回放录制的消息流
+        file_tree: file_structure_update 的内容，见 FILE_TREE_MODE；lazy 时客户端通过 /tree 按需获取目录
+
+    Returns:
+        新任务ID
+    """
+    if replay is not None:
+        cache = 'bypass'
+    elif cache is None:
+        cache = 'use' if RESULT_CACHE_ENABLED else 'bypass'
+    # 生成唯一任务ID
+    task_id = task_id_generator.new_id()
+
+    cache_key = result_cache.key(prompt, attachments, profile) if cache == 'use' else None
+    cached = None
+    if cache_key is not None:
+        cached = result_cache.get(cache_key, os.path.join(TASK_STORE_DIR, task_id, 'cached'))
+    if record is None:
+        record = STREAM_RECORD_RATE > 0 and random.random() < STREAM_RECORD_RATE
+
+    task_queues[task_id] = create_task_channel(queue_policy)
+
+    # 创建任务记录
+    task_index.add({
+        'id': task_id,
+        'prompt': prompt,
+        'attachments': attachments,
+        'status': 'created',
+        'run': run,
+        'profile': profile,
+        'cached': cached is not None,
+        'created_at': time.time(),
+        'multimedia_support': True,
+        'real_urls': True
+    })
+
+    # 创建任务执行器：回放录制或命中结果缓存时回放消息序列，否则执行完成后写入缓存
+    if replay is not None:
+        executor = CachedResultExecutor(task_id, prompt, replay, replay_speed)
+        task_index.get(task_id)['replay_of'] = replay['source_task_id']
+    elif cached is not None:
+        executor = CachedResultExecutor(task_id, prompt, cached, replay_speed)
+    else:
+        executor = EXECUTOR_PROFILES[profile](task_id, prompt)
+        if cache_key is not None:
+            executor.cache_key = cache_key
+            executor.recording = []
+    executor.file_tree_mode = file_tree
+    if trace:
+        executor.trace = TaskTrace(TRACE_BUFFER_SIZE)
+    if record:
+        if executor.recording is None:
+            executor.recording = []
+        executor.stream_writes = []
+    task_executors[task_id] = executor
+
+    record_task_event(task_id, 'created')
+    logger.info(f"Created task {task_id} ({run}, {profile}{', cached' if cached else ''}): {prompt[:50]}...")
+
+    if run == 'background':
+        ensure_reaper_started()
+        task_scheduler.submit(executor)
+    return task_id
+
+
+def cleanup_task(task_id: str):
+    """
+    释放任务的队列、执行器、磁盘文件和任务记录。
+    执行线程仍在步骤中时（应先调用 executor.cancel()），磁盘文件、检查点和搜索索引在它退出后才释放
+    """
+    logger.info(f"Cleaning up resources for task {task_id}")
+    channel = task_queues.pop(task_id, None)
+    if channel is not None:
+        channel.close()
+    executor = task_executors.pop(task_id, None)
+
+    def release_storage():
+        if executor is not None:
+            executor.all_files.destroy()
+        search_index.submit('drop_task', task_id)
+        checkpoint_store.remove(task_id)
+
+    if executor is not None:
+        executor.after_exit(release_storage)
+    else:
+        release_storage()
+    record = task_index.remove(task_id)
+    if record is not None:
+        task_events.publish('evicted', task_id, status=record['status'])
+
+
+DISCONNECT_POLICIES = ('cancel', 'pause', 'detach')
+
+
+def release_stream(task_id: str, finished: bool, on_disconnect: str = DISCONNECT_POLICY):
+    """
+    客户端流关闭时调用
+
+    Args:
+        task_id: 任务ID
+        finished: 流是否因任务结束而正常关闭
+        on_disconnect: 客户端提前断开时前台任务的处理策略
+            cancel - 取消执行并清理任务
+            pause  - 暂停执行并保留任务，重新连接时恢复
+            detach - 转为后台任务继续执行
+    """
+    record = task_index.get(task_id)
+    if record is None or server_draining.is_set():
+        return
+    if record.get('run') == 'background':
+        logger.info(f"Client detached from background task {task_id}")
+        return
+    executor = task_executors.get(task_id)
+    if finished or executor is None:
+        cleanup_task(task_id)
+        return
+
+    logger.info(f"Client disconnected from task {task_id} (policy: {on_disconnect})")
+    if on_disconnect == 'detach':
+        record['run'] = 'background'
+        ensure_reaper_started()
+    elif on_disconnect == 'pause':
+        if not executor.is_paused:
+            executor.pause_task()
+            executor.paused_by_disconnect = True
+        record['detached_at'] = time.time()
+        ensure_reaper_started()
+    else:
+        executor.cancel()
+        cleanup_task(task_id)
+
+
+def reattach_stream(task_id: str):
+    """客户端重新连接：恢复因断开而暂停的任务"""
+    executor = task_executors.get(task_id)
+    record = task_index.get(task_id)
+    if record is not None:
+        record.pop('detached_at', None)
+    if executor is not None and executor.paused_by_disconnect:
+        executor.paused_by_disconnect = False
+        executor.resume_task()
+
+
+_reaper_started = False
+
+
+def ensure_reaper_started():
+    """启动任务过期清理线程（仅启动一次）"""
+    global _reaper_started
+    if _reaper_started:
+        return
+    _reaper_started = True
+    Thread(target=_reap_expired_tasks, name='task-reaper', daemon=True).start()
+
+
+def reap_expired_tasks(now: Optional[float] = None) -> int:
+    """
+    清理过期任务：结束超过 TASK_RETENTION_SECONDS 的后台任务，
+    以及因客户端断开而暂停且超过该时间无人重连的任务
+
+    Returns:
+        清理的任务数
+    """
+    deadline = (now or time.time()) - TASK_RETENTION_SECONDS
+    reaped = 0
+    for status in FINAL_STATUSES:
+        for task_id in task_index.ids_with_status(status):
+            record = task_index.get(task_id)
+            if record and record.get('finished_at', float('inf')) < deadline:
+                cleanup_task(task_id)
+                reaped += 1
+    for task_id in task_index.ids_with_status('paused'):
+        record = task_index.get(task_id)
+        channel = task_queues.get(task_id)
+        if (record and record.get('detached_at', float('inf')) < deadline
+                and (channel is None or not channel.subscriptions)):
+            executor = task_executors.get(task_id)
+            if executor is not None:
+                executor.cancel()
+            cleanup_task(task_id)
+            reaped += 1
+    attachment_store.collect_garbage(now)
+    return reaped
+
+
+def _reap_expired_tasks():
+    while True:
+        time.sleep(min(60.0, max(TASK_RETENTION_SECONDS / 2, 1.0)))
+        reap_expired_tasks()
+
+
+def heartbeat_interval(value: Optional[str]) -> float:
+    """解析客户端请求的心跳间隔，限制在1-60秒"""
+    if value is None:
+        return HEARTBEAT_INTERVAL
+    return min(max(float(value), 1.0), 60.0)
+
+
+def heartbeat_chunk() -> str:
+    return json.dumps({'type': 'heartbeat', 'timestamp': time.time()}) + '\n'
+
+
+def shutdown_chunk(task_id: Optional[str] = None) -> str:
+    """停机时发给在途流的最后一条消息，客户端可稍后用 since 重新连接"""
+    message = {'type': 'connection_close', 'data': {'reason': 'shutdown'}}
+    if task_id is not None:
+        message['task_id'] = task_id
+    return json.dumps(message) + '\n'
+
+
+def attachment_filename(name: Optional[str]) -> str:
+    """只保留上传文件名的最后一段，防止路径穿越"""
+    filename = os.path.basename(str(name or '').replace('\\', '/')).strip()
+    if filename in ('', '.', '..'):
+        raise UploadError('filename is required')
+    return filename
+
+
+def attachment_limit(task_id: str, executor: 'TaskExecutor') -> int:
+    """新附件还能使用的字节数：单文件上限与任务剩余配额中较小者"""
+    used = sum(executor.all_files.size(name) for name in executor.all_files
+               if name.startswith('attachments/'))
+    remaining = TASK_ATTACHMENT_QUOTA - used - attachment_store.pending_bytes(task_id)
+    return max(min(ATTACHMENT_MAX_BYTES, remaining), 0)
+
+
+def register_attachment(executor: 'TaskExecutor', filename: str, path: str, size: int) -> str:
+    """把附件加入任务文件和任务记录，返回任务中的文件名"""
+    name = f"attachments/{filename}"
+    executor.attach_file(name, path, size)
+    record = task_index.get(executor.task_id)
+    if record is not None and filename not in record['attachments']:
+        record['attachments'].append(filename)
+    logger.info(f"Attached {name} ({size} bytes) to task {executor.task_id}")
+    return name
+
+
+def finish_upload(executor: 'TaskExecutor', session: UploadSession) -> Dict[str, Any]:
+    digest, path, duplicate = attachment_store.commit(session)
+    name = register_attachment(executor, session.filename, path, session.offset)
+    return {'filename': name, 'size': session.offset, 'sha256': digest,
+            'status': 'complete', 'deduplicated': duplicate}
+
+
+def is_final_message(message: Dict[str, Any]) -> bool:
+    """判断消息是否为任务结束（完成、失败或取消）通知；任务已结束时的状态快照同样视为结束通知"""
+    if message.get('type') == 'state_snapshot':
+        return message['data']['task'].get('status') in FINAL_STATUSES
+    return (message.get('type') == 'task_update' and
+            message.get('data', {}).get('status') in FINAL_STATUSES)
+
+
+TASK_OPTIONS = ('profile', 'queue_policy', 'trace', 'cache', 'record', 'file_tree', 'replay_speed')  # 每个任务可单独指定的创建选项
+
 
-## 创建的文件
-{chr(10).join(f"- {filename}" for filename in task_executor.all_files.keys())}
+def task_options(data: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    解析并校验任务创建选项，POST /api/tasks 和批量创建共用
 
----
-由Resear Pro AI助手生成 - 真实多媒体版 🚀
-"""
-        zip_file.writestr("README.md", readme_content)
+    Args:
+        data: 请求体或批量中的单个任务
+        defaults: data 中未指定的选项取该值（批量请求的公共选项），仍未指定时取服务端配置
 
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    Returns:
+        可直接传给 register_task 的关键字参数
 
+    Raises:
+        ValueError: 选项无效
+    """
+    options = {**(defaults or {}), **{name: data[name] for name in TASK_OPTIONS if name in data}}
+    profile = options.get('profile', DEFAULT_EXECUTOR_PROFILE)
+    queue_policy = options.get('queue_policy', TASK_QUEUE_POLICY)
+    cache = options.get('cache')
+    file_tree = options.get('file_tree', FILE_TREE_MODE)
+    if cache is not None and cache not in CACHE_MODES:
+        raise ValueError(f'cache must be one of {list(CACHE_MODES)}')
+    try:
+        replay_speed = max(float(options.get('replay_speed', RESULT_CACHE_REPLAY_SPEED)), 0.0)
+    except (TypeError, ValueError):
+        raise ValueError('replay_speed must be a number')
+    if profile not in EXECUTOR_PROFILES:
+        raise ValueError(f'profile must be one of {list(EXECUTOR_PROFILES)}')
+    if queue_policy not in TaskChannel.POLICIES:
+        raise ValueError(f'queue_policy must be one of {list(TaskChannel.POLICIES)}')
+    if file_tree not in FILE_TREE_MODES:
+        raise ValueError(f'file_tree must be one of {list(FILE_TREE_MODES)}')
+    return {
+        'profile': profile,
+        'queue_policy': queue_policy,
+        'trace': bool(options.get('trace', TRACE_ENABLED)),
+        'cache': cache,
+        'record': bool(options['record']) if options.get('record') is not None else None,
+        'file_tree': file_tree,
+        'replay_speed': replay_speed
+    }
 
-# ==================== API 路由定义 ====================
 
-@app.route('/api/tasks', methods=['POST'])
+@api.route('/api/tasks', methods=['POST'])
 def create_task():
-    """创建新的AI任务"""
+    """
+    创建新的AI任务
+
+    请求体:
+        prompt: 任务描述
+        attachments: 附件名列表
+        run / profile / queue_policy / trace / record / file_tree: 见 register_task
+        cache: 结果缓存模式 (use / bypass)，bypass 时总是重新执行
+        replay_speed: 命中缓存时的回放速度，0为立即发送，1为原始节奏
+    """
     data = request.get_json()
     prompt = data.get('prompt', '')
     attachments = data.get('attachments', [])
+    run = data.get('run', 'attached')
 
+    if server_draining.is_set():
+        return jsonify({'error': 'Server is shutting down'}), 503
     if not prompt.strip():
         return jsonify({'error': 'Prompt is required'}), 400
+    if run not in RUN_MODES:
+        return jsonify({'error': f'run must be one of {list(RUN_MODES)}'}), 400
+    try:
+        options = task_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # 生成唯一任务ID
-    task_id = str(uuid.uuid4())
-    task_queues[task_id] = queue.Queue()
+    task_id = register_task(prompt, attachments, run, **options)
 
-    # 创建任务记录
-    active_tasks[task_id] = {
-        'id': task_id,
-        'prompt': prompt,
-        'attachments': attachments,
-        'status': 'created',
-        'created_at': time.time(),
+    return jsonify({
+        'task_id': task_id,
+        'status': task_index.get(task_id)['status'],
+        'run': run,
+        'profile': options['profile'],
+        'cached': task_index.get(task_id)['cached'],
         'multimedia_support': True,
         'real_urls': True
-    }
+    })
 
-    # 创建任务执行器（但不立即启动）
-    executor = TaskExecutor(task_id, prompt)
-    task_executors[task_id] = executor
 
-    logger.info(f"Created task {task_id}: {prompt[:50]}...")
+@api.route('/api/tasks/<task_id>/attachments', methods=['POST'])
+def create_attachment(task_id):
+    """
+    上传任务附件
+
+    multipart/form-data: 一次性上传请求中的所有文件（直接从请求流边读边写入磁盘）
+    application/json: 创建可续传上传
+        filename: 文件名
+        size: 文件字节数
+        sha256: 可选，上传完成后校验，不一致时返回422
+    续传通过 PATCH /api/tasks/<task_id>/attachments/<upload_id> 发送数据，
+    附件以 attachments/<文件名> 出现在任务文件中
+    """
+    if task_id not in task_executors:
+        return jsonify({'error': 'Task not found'}), 404
+    executor = task_executors[task_id]
+    ensure_reaper_started()
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                raise UploadError('multipart boundary is required')
+            results = []
+            # 不访问 request.files（会先缓冲整个请求体）
+            for name, part in MultipartUpload(request.stream, boundary).files():
+                filename = attachment_filename(name)
+                session = attachment_store.start(task_id, filename, None)
+                try:
+                    session.write_from(part, 0, attachment_limit(task_id, executor))
+                except UploadError:
+                    attachment_store.abort(session)
+                    raise
+                session.size = session.offset
+                results.append(finish_upload(executor, session))
+            return jsonify({'attachments': results}), 201
+
+        data = request.get_json() or {}
+        filename = attachment_filename(data.get('filename'))
+        size = data.get('size')
+        if not isinstance(size, int) or size < 0:
+            raise UploadError('size must be a non-negative integer')
+        limit = attachment_limit(task_id, executor)
+        if size > limit:
+            raise UploadError('Attachment exceeds size limit', 413, limit=limit)
+
+        session = attachment_store.start(task_id, filename, size, data.get('sha256'))
+        if size == 0:
+            return jsonify(finish_upload(executor, session)), 201
+        response = jsonify(session.to_dict())
+        response.headers['Upload-Offset'] = '0'
+        return response, 201
+
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.details}), e.status
+
+@api.route('/api/tasks/<task_id>/attachments/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+def upload_attachment(task_id, upload_id):
+    """
+    可续传上传
+
+    GET: 查询已接收的字节数（断线后从该偏移量继续）
+    PATCH: 请求体为从 Upload-Offset 请求头指定的偏移量开始的原始字节，可分块传输
+    DELETE: 放弃上传
+    """
+    executor = task_executors.get(task_id)
+    session = attachment_store.get(task_id, upload_id)
+    if executor is None or session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    if request.method == 'DELETE':
+        attachment_store.abort(session)
+        return jsonify({'upload_id': upload_id, 'status': 'aborted'})
+
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+        try:
+            session.write_from(request.stream, offset, session.size)
+            if session.complete:
+                return jsonify(finish_upload(executor, session))
+        except UploadError as e:
+            return jsonify({'error': str(e), **e.details}), e.status
+
+    response = jsonify(session.to_dict())
+    response.headers['Upload-Offset'] = str(session.offset)
+    return response
+
+@api.route('/api/tasks/batch', methods=['POST'])
+def create_tasks_batch():
+    """
+    批量创建任务
+
+    请求体:
+        tasks: [{prompt, attachments, 以及 TASK_OPTIONS 中的选项}] 任务列表，单个任务的选项优先于公共选项
+        start: 为true时立即通过调度器启动所有任务
+        run: 运行模式，background 时所有任务在后台运行（隐含start）
+        profile / queue_policy / trace / cache / record / file_tree / replay_speed:
+            所有任务的公共选项，与 POST /api/tasks 相同
+    """
+    data = request.get_json() or {}
+    items = data.get('tasks', [])
+    start = bool(data.get('start', False))
+    run = data.get('run', 'attached')
+
+    if server_draining.is_set():
+        return jsonify({'error': 'Server is shutting down'}), 503
+    if run not in RUN_MODES:
+        return jsonify({'error': f'run must be one of {list(RUN_MODES)}'}), 400
+    defaults = {name: data[name] for name in TASK_OPTIONS if name in data}
+    try:
+        task_options(defaults)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'tasks must be a non-empty list'}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} tasks per batch'}), 400
+
+    options = []
+    errors = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not str(item.get('prompt', '')).strip():
+            errors.append({'index': i, 'error': 'Prompt is required'})
+            continue
+        try:
+            options.append(task_options(item, defaults))
+        except ValueError as e:
+            errors.append({'index': i, 'error': str(e)})
+    if errors:
+        return jsonify({'error': 'Each task needs a prompt and valid options',
+                        'invalid_indexes': [error['index'] for error in errors],
+                        'errors': errors}), 400
+
+    task_ids = []
+    for item, item_options in zip(items, options):
+        task_id = register_task(item['prompt'], item.get('attachments', []), run, **item_options)
+        if start:
+            task_scheduler.submit(task_executors[task_id])
+        task_ids.append(task_id)
+
+    logger.info(f"Created batch of {len(task_ids)} tasks (start={start})")
 
     return jsonify({
-        'task_id': task_id,
-        'status': 'created',
-        'multimedia_support': True,
-        'real_urls': True
+        'task_ids': task_ids,
+        'status': 'started' if start or run == 'background' else 'created',
+        'count': len(task_ids)
     })
 
 
-@app.route('/api/tasks/<task_id>/connect', methods=['POST'])
+@api.route('/api/tasks/stream', methods=['POST'])
+def stream_tasks():
+    """
+    多路复用流：在单个分块响应中交错发送多个任务的消息，每条消息带 task_id
+
+    请求体:
+        task_ids: 任务ID列表
+        start: 为true时（默认）通过调度器启动尚未启动的任务
+        heartbeat: 心跳间隔（秒）
+        on_disconnect: 客户端提前断开时未结束任务的处理策略 (cancel / pause / detach)
+        snapshot: 为true时每个任务先发送 state_snapshot 而不是重放历史，默认 STREAM_STATE_SNAPSHOT
+    """
+    data = request.get_json() or {}
+    task_ids = data.get('task_ids', [])
+    start = bool(data.get('start', True))
+    snapshot = bool(data.get('snapshot', STREAM_STATE_SNAPSHOT))
+    on_disconnect = data.get('on_disconnect', DISCONNECT_POLICY)
+
+    if not isinstance(task_ids, list) or not task_ids:
+        return jsonify({'error': 'task_ids must be a non-empty list'}), 400
+    if on_disconnect not in DISCONNECT_POLICIES:
+        return jsonify({'error': f'on_disconnect must be one of {list(DISCONNECT_POLICIES)}'}), 400
+    try:
+        heartbeat = heartbeat_interval(data.get('heartbeat'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'heartbeat must be a number'}), 400
+    missing = [t for t in task_ids if t not in task_executors]
+    if missing:
+        return jsonify({'error': 'Task not found', 'task_ids': missing}), 404
+
+    waiter = Event()
+    subscriptions = {}
+    finishing = set()  # 已发送结束通知、还有积压消息的任务
+    for task_id in dict.fromkeys(task_ids):
+        subscriptions[task_id] = task_queues[task_id].subscribe(0, waiter, STREAM_PRIORITY_LANES, STREAM_CHUNK_CHARS,
+                                                               snapshot)
+        reattach_stream(task_id)
+
+    def generate_multiplexed_response():
+        """按任务轮转生成分块响应，每个任务每轮最多发送 STREAM_BATCH_PER_TASK 条消息"""
+        if start:
+            for task_id in list(subscriptions):
+                task_scheduler.submit(task_executors[task_id])
+
+        try:
+            while subscriptions:
+                waiter.clear()
+                sent = False
+                for task_id, subscription in list(subscriptions.items()):
+                    if subscription.channel.closed:
+                        del subscriptions[task_id]
+                        if server_draining.is_set():
+                            yield shutdown_chunk(task_id)
+                        else:
+                            yield json.dumps({'type': 'error', 'task_id': task_id,
+                                              'message': 'Task evicted'}) + '\n'
+                        continue
+                    for _ in range(STREAM_BATCH_PER_TASK):
+                        try:
+                            message = subscription.get_nowait()
+                        except queue.Empty:
+                            break
+                        sent = True
+                        trace = task_executors[task_id].trace if task_id in task_executors else None
+                        if trace is None:
+                            yield json.dumps({**message, 'task_id': task_id}) + '\n'
+                        else:
+                            with trace.span('stream.encode', 'stream', type=message.get('type')):
+                                chunk = json.dumps({**message, 'task_id': task_id}) + '\n'
+                            with trace.span('stream.write', 'stream', bytes=len(chunk)):
+                                yield chunk
+                        if is_final_message(message):
+                            finishing.add(task_id)
+                        if task_id in finishing and subscription.caught_up():
+                            finishing.discard(task_id)
+                            del subscriptions[task_id]
+                            subscription.close()
+                            release_stream(task_id, finished=True)
+                            break
+
+                # 所有任务都没有新消息时等待唤醒，空闲超过心跳间隔时发送心跳
+                if not sent and subscriptions and not waiter.wait(timeout=heartbeat):
+                    yield heartbeat_chunk()
+
+        except Exception as e:
+            logger.error(f"Multiplexed stream error: {e}")
+            yield json.dumps({'type': 'error', 'message': str(e)}) + '\n'
+
+    def on_close():
+        """响应关闭（正常结束或客户端断开）时释放尚未结束的任务"""
+        for task_id, subscription in list(subscriptions.items()):
+            subscription.close()
+            release_stream(task_id, finished=False, on_disconnect=on_disconnect)
+        subscriptions.clear()
+
+    response = Response(
+        generate_multiplexed_response(),
+        mimetype='text/plain',
+        headers=STREAM_HEADERS
+    )
+    response.call_on_close(on_close)
+    return response
+
+
+@api.route('/api/tasks/<task_id>/connect', methods=['POST'])
 def connect_task(task_id):
-    """连接并开始执行任务（POST模式）"""
+    """
+    连接并开始执行任务（POST模式）
+
+    查询参数:
+        since: 从该消息序号开始接收（断线重连时使用），默认0即重放全部消息
+        heartbeat: 心跳间隔（秒，1-60），决定空闲时发现客户端断开的最长时间
+        on_disconnect: 客户端提前断开时的处理策略 (cancel / pause / detach)，后台任务总是detach
+        priority: 1 时积压的控制消息先于批量消息发送，默认 STREAM_PRIORITY_LANES
+        chunk: 大于0时内容超过该字符数的 file_update 拆成 file_chunk 分段发送，默认 STREAM_CHUNK_CHARS
+               （顺序和 sequence 的约定见 TaskChannel）
+        snapshot: 1 时先发送一条 state_snapshot（任务当前状态），之后只发送快照序号之后的消息，
+                  加入成本与当前状态大小相关而与历史长度无关；默认 STREAM_STATE_SNAPSHOT
+    """
     logger.info(f"Frontend connecting to task: {task_id}")
     
     if task_id not in task_executors:
         return jsonify({'error': 'Task not found'}), 404
+    on_disconnect = request.args.get('on_disconnect', DISCONNECT_POLICY)
+    if on_disconnect not in DISCONNECT_POLICIES:
+        return jsonify({'error': f'on_disconnect must be one of {list(DISCONNECT_POLICIES)}'}), 400
+    try:
+        since = int(request.args.get('since', 0))
+        heartbeat = heartbeat_interval(request.args.get('heartbeat'))
+        priority = bool(int(request.args.get('priority', int(STREAM_PRIORITY_LANES))))
+        chunk_size = max(int(request.args.get('chunk', STREAM_CHUNK_CHARS)), 0)
+        snapshot = bool(int(request.args.get('snapshot', int(STREAM_STATE_SNAPSHOT))))
+    except ValueError:
+        return jsonify({'error': 'since, heartbeat, priority, chunk and snapshot must be numbers'}), 400
+
+    executor = task_executors[task_id]
+    task_queue = task_queues[task_id].subscribe(since, priority=priority, chunk_size=chunk_size, snapshot=snapshot)
+    reattach_stream(task_id)
+    state = {'finished': False}
+    stream_id = next(_stream_ids)
     
     def generate_chunked_response():
         """生成分块响应"""
-        executor = task_executors[task_id]
-        task_queue = task_queues[task_id]
-        
         # 启动任务执行（如果还没有启动）
-        if not executor.is_running:
-            logger.info(f"Starting task execution thread for {task_id}...")
-            thread = Thread(target=executor.execute_task)
-            thread.daemon = True
-            thread.start()
+        if task_scheduler.submit(executor):
+            logger.info(f"Scheduled task execution for {task_id}...")
         
         message_count = 0
+        final_sent = False
         
         try:
             while True:
                 try:
-                    # 等待消息，超时30秒
-                    message = task_queue.get(timeout=30)
+                    # 等待消息，空闲超过心跳间隔时发送心跳；断开的客户端在写心跳时被发现
+                    message = task_queue.get(timeout=heartbeat)
                     message_count += 1
                     
-                    logger.info(f"Sending to frontend: Message {message_count}, Type: {message.get('type')}, Task: {task_id}")
+                    logger.debug(f"Sending to frontend: Message {message_count}, Type: {message.get('type')}, Task: {task_id}")
                     
                     # 发送消息（使用换行符分隔）
-                    chunk = json.dumps(message) + '\n'
-                    yield chunk
+                    trace = executor.trace
+                    writes = executor.stream_writes
+                    if trace is None:
+                        chunk = json.dumps(message) + '\n'
+                        if writes is not None:
+                            writes.append((stream_id, message.get('sequence', -1), len(chunk), time.monotonic()))
+                        yield chunk
+                    else:
+                        with trace.span('stream.encode', 'stream', type=message.get('type')):
+                            chunk = json.dumps(message) + '\n'
+                        if writes is not None:
+                            writes.append((stream_id, message.get('sequence', -1), len(chunk), time.monotonic()))
+                        # 包含WSGI服务器写出该分块并取回下一次迭代的时间
+                        with trace.span('stream.write', 'stream', bytes=len(chunk)):
+                            yield chunk
                     
-                    # 如果任务完成或失败，结束连接
-                    if (message.get('type') == 'task_update' and 
-                        message.get('data', {}).get('status') in ['completed', 'failed']):
-                        logger.info(f"Task {task_id} completed, sent {message_count} messages total")
+                    # 如果任务结束且积压的消息都已发送（结束通知可能提前到达），结束连接
+                    final_sent = final_sent or is_final_message(message)
+                    if final_sent and task_queue.caught_up():
+                        logger.info(f"Task {task_id} finished, sent {message_count} messages total")
+                        state['finished'] = True
                         break
                         
                 except queue.Empty:
+                    if task_queue.channel.closed:
+                        if server_draining.is_set():
+                            yield shutdown_chunk()
+                        state['finished'] = True
+                        break
                     # 发送心跳
-                    heartbeat = json.dumps({'type': 'heartbeat', 'timestamp': time.time()}) + '\n'
-                    yield heartbeat
+                    yield heartbeat_chunk()
                     continue
                     
         except Exception as e:
             logger.error(f"Connection error for task {task_id}: {e}")
             error_msg = json.dumps({'type': 'error', 'message': str(e)}) + '\n'
             yield error_msg
+
+    def on_close():
+        """响应关闭时释放资源：正常结束时清理前台任务，客户端断开时按策略处理"""
+        task_queue.close()
+        if executor.stream_writes is not None and executor.task_status in FINAL_STATUSES:
+            stream_recordings.save(executor)  # 包含本流最后的写出事件
+        release_stream(task_id, state['finished'], on_disconnect)
+
+    response = Response(
+        generate_chunked_response(),
+        mimetype='text/plain',
+        headers=STREAM_HEADERS
+    )
+    response.call_on_close(on_close)
+    return response
+
+@api.route('/api/tasks/events', methods=['GET', 'POST'])
+def stream_task_events():
+    """
+    订阅全局任务生命周期事件（NDJSON + Chunked Transfer）
+
+    查询参数:
+        events: 事件类型过滤，逗号分隔 (created,started,paused,resumed,completed,failed,cancelled,evicted)
+        task_id: 任务ID过滤，逗号分隔
+        snapshot: 为1时先发送当前所有匹配任务的状态
+    """
+    args = request.args
+    events = {e for e in args.get('events', '').split(',') if e} or None
+    if events and not events <= TaskEventBus.EVENT_TYPES:
+        return jsonify({'error': f"Unknown events: {sorted(events - TaskEventBus.EVENT_TYPES)}"}), 400
+    task_ids = {t for t in args.get('task_id', '').split(',') if t} or None
+    include_snapshot = args.get('snapshot') == '1'
+
+    subscription = task_events.subscribe(events, task_ids)
+    logger.info(f"Task event subscriber connected (total: {task_events.subscriber_count})")
+
+    def generate_event_stream():
+        """生成事件流"""
+        try:
+            if include_snapshot:
+                for record in list(active_tasks.values()):
+                    if task_ids is None or record['id'] in task_ids:
+                        yield json.dumps({
+                            'type': 'task_snapshot',
+                            'task_id': record['id'],
+                            'status': record['status'],
+                            'created_at': record['created_at']
+                        }) + '\n'
+
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                if event is None:
+                    yield json.dumps({'type': 'heartbeat', 'timestamp': time.time(),
+                                      'dropped': subscription.dropped}) + '\n'
+                    continue
+                yield json.dumps(event) + '\n'
         finally:
-            # 清理资源
-            logger.info(f"Cleaning up resources for task {task_id}")
-            if task_id in task_queues:
-                del task_queues[task_id]
-            if task_id in task_executors:
-                del task_executors[task_id]
-            if task_id in active_tasks:
-                del active_tasks[task_id]
-    
+            task_events.unsubscribe(subscription)
+            logger.info(f"Task event subscriber disconnected (total: {task_events.subscriber_count})")
+
     return Response(
-        generate_chunked_response(),
+        generate_event_stream(),
         mimetype='text/plain',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Access-Control-Allow-Origin': '*',
-            'Transfer-Encoding': 'chunked'
-        }
+        headers=STREAM_HEADERS
     )
 
-@app.route('/api/tasks/<task_id>/pause', methods=['POST'])
+@api.route('/api/tasks/<task_id>/pause', methods=['POST'])
 def pause_task(task_id):
     """暂停或恢复任务执行"""
     if task_id not in task_executors:
@@ -945,75 +3629,664 @@ def pause_task(task_id):
         'is_paused': executor.is_paused
     })
 
-@app.route('/api/tasks/<task_id>/export')
+@api.route('/api/tasks/<task_id>/export')
 def export_task(task_id):
-    """导出任务的所有文件和执行记录"""
+    """
+    导出任务的所有文件和执行记录
+
+    查询参数:
+        since: 上次导出的内容版本（响应头 X-Content-Version），只导出此后的变化，见 export_members
+        lane: 压缩执行位置 (thread / process / auto)，默认为 EXPORT_LANE；auto 在多核机器上、
+              文件总量达到 PROCESS_LANE_MIN_BYTES 时使用进程池
+              （单核时工作进程与请求线程争用同一个核心，且zlib压缩本身会释放GIL，进程池没有收益）
+    """
     if task_id not in task_executors:
         return jsonify({'error': 'Task not found'}), 404
+    executor = task_executors[task_id]
+    try:
+        since = int(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'since must be an integer'}), 400
+    if since is not None and since < 0:
+        return jsonify({'error': 'since must not be negative'}), 400
+    version = executor.content_version.value
+    lane = request.args.get('lane', EXPORT_LANE)
+    if lane not in EXPORT_LANES:
+        return jsonify({'error': f'lane must be one of {list(EXPORT_LANES)}'}), 400
+    if lane == 'auto':
+        if since is not None and since <= version:
+            modified, _ = executor.all_files.changes_since(since)
+            total = sum(executor.all_files.size(name) for name in modified if name in executor.all_files)
+        else:
+            total = sum(executor.all_files.size(name) for name in executor.all_files)
+        multi_core = (os.cpu_count() or 1) > 1
+        lane = 'process' if multi_core and total >= PROCESS_LANE_MIN_BYTES else 'thread'
 
+    path = None
     try:
-        executor = task_executors[task_id]
-        zip_data = create_task_export_zip(executor)
+        if lane == 'process':
+            # 工作进程直接写入临时文件，响应关闭后删除
+            fd, path = tempfile.mkstemp(suffix='.zip')
+            os.close(fd)
+            create_task_export_zip_in_process(executor, path, since, version)
+            archive = open(path, 'rb')
+            archive.seek(0, os.SEEK_END)
+        else:
+            # 小导出留在内存中，大导出溢出到临时文件，通过 wsgi.file_wrapper 发送
+            archive = tempfile.SpooledTemporaryFile(max_size=FILE_SPILL_THRESHOLD)
+            create_task_export_zip(executor, archive, since, version)
+        size = archive.tell()
+        archive.seek(0)
 
-        response = Response(
-            zip_data,
+        response = send_file(
+            archive,
             mimetype='application/zip',
-            headers={
-                'Content-Disposition': f'attachment; filename=resear-pro-task-{task_id}.zip',
-                'Content-Length': str(len(zip_data))
-            }
+            as_attachment=True,
+            download_name=f'resear-pro-task-{task_id}.zip' if since is None
+            else f'resear-pro-task-{task_id}-since-{since}.zip'
         )
+        response.headers['Content-Length'] = str(size)
+        response.headers['X-Content-Version'] = str(version)
+        if path is not None:
+            response.call_on_close(lambda: os.remove(path))
 
-        logger.info(f"Exported task {task_id} ({len(zip_data)} bytes)")
+        logger.info(f"Exported task {task_id} ({size} bytes, {lane} lane)")
         return response
 
     except Exception as e:
         logger.error(f"Export failed for task {task_id}: {str(e)}")
+        if path is not None and os.path.exists(path):
+            os.remove(path)
         return jsonify({'error': 'Export failed'}), 500
 
-@app.route('/api/tasks/<task_id>')
+@api.route('/api/tasks/<task_id>/trace')
+def get_task_trace(task_id):
+    """下载任务的执行追踪（Chrome trace-event JSON，可在 chrome://tracing 或 Perfetto 中打开）"""
+    if task_id not in task_executors:
+        return jsonify({'error': 'Task not found'}), 404
+    trace = task_executors[task_id].trace
+    if trace is None:
+        return jsonify({'error': 'Tracing is not enabled for this task'}), 404
+
+    record = task_index.get(task_id) or {}
+    response = jsonify(trace.to_chrome(task_id=task_id, status=record.get('status'),
+                                       profile=record.get('profile')))
+    response.headers['Content-Disposition'] = f'attachment; filename=trace-{task_id}.json'
+    return response
+
+@api.route('/api/recordings')
+def list_recordings():
+    """列出已保存的消息流录制"""
+    return jsonify({'recordings': stream_recordings.list()})
+
+@api.route('/api/recordings/<task_id>')
+def get_recording(task_id):
+    """下载任务的消息流录制（gzip压缩的NDJSON，格式见 StreamRecordingStore）"""
+    path = stream_recordings.path(task_id)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Recording not found'}), 404
+    return send_file(path, mimetype='application/gzip', as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@api.route('/api/replays', methods=['POST'])
+def create_replays():
+    """
+    回放录制的消息流：以上传的录制文件创建若干任务，不运行执行器，按录制的节奏重新发送消息。
+    返回的任务像普通任务一样通过 /connect 接收，见 replay.py
+
+    请求体: 录制文件（gzip或未压缩的NDJSON）
+    查询参数:
+        speed: 回放速度倍数，1为原始节奏，10为10倍速，max或0为不等待（默认1）
+        copies: 创建的任务数 (1-REPLAY_MAX_COPIES，默认1)
+        run: attached（默认，连接时开始）或 background（立即开始）
+        queue_policy: 回放任务的积压处理策略（默认block）；coalesce 和 drop 会按客户端的读取速度
+                      合并或跳过消息，收到的消息数不再与录制一致
+    """
+    if server_draining.is_set():
+        return jsonify({'error': 'Server is shutting down'}), 503
+    args = request.args
+    run = args.get('run', 'attached')
+    if run not in RUN_MODES:
+        return jsonify({'error': f'run must be one of {list(RUN_MODES)}'}), 400
+    queue_policy = args.get('queue_policy', 'block')
+    if queue_policy not in TaskChannel.POLICIES:
+        return jsonify({'error': f'queue_policy must be one of {list(TaskChannel.POLICIES)}'}), 400
+    try:
+        speed = 0.0 if args.get('speed') == 'max' else max(float(args.get('speed', 1)), 0.0)
+        copies = int(args.get('copies', 1))
+    except ValueError:
+        return jsonify({'error': 'speed and copies must be numbers'}), 400
+    if not 1 <= copies <= REPLAY_MAX_COPIES:
+        return jsonify({'error': f'copies must be between 1 and {REPLAY_MAX_COPIES}'}), 400
+    if request.content_length and request.content_length > ATTACHMENT_MAX_BYTES:
+        return jsonify({'error': 'Recording too large'}), 413
+    try:
+        recording = StreamRecordingStore.load(request.get_data())
+    except (ValueError, KeyError, OSError, EOFError) as e:
+        return jsonify({'error': f'Invalid recording: {e}'}), 400
+
+    meta = recording['meta']
+    entry = StreamRecordingStore.replay_entry(recording)
+    profile = meta.get('profile') or DEFAULT_EXECUTOR_PROFILE
+    task_ids = [register_task(meta.get('prompt') or 'replay', [], run, profile, queue_policy=queue_policy,
+                              replay=entry, replay_speed=speed, record=False)
+                for _ in range(copies)]
+    return jsonify({
+        'task_ids': task_ids,
+        'source_task_id': meta.get('task_id'),
+        'messages': len(recording['messages']),
+        'speed': speed,
+        'queue_policy': queue_policy
+    })
+
+@api.route('/api/tasks/<task_id>/files/<path:filename>')
+def get_file_content(task_id, filename):
+    """
+    获取任务文件内容
+
+    查询参数:
+        raw: 为1时直接返回文件字节（磁盘文件通过 wsgi.file_wrapper 零拷贝发送，支持Range），
+             否则返回JSON {success, content, encoding, size}；
+             不是有效UTF-8的文件（如上传的二进制附件）content 为base64，encoding 为 base64
+    """
+    executor = task_executors.get(task_id)
+    if executor is None:
+        return jsonify({'success': False, 'message': 'Task not found'}), 404
+    files = executor.all_files
+    if filename not in files:
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+
+    if request.args.get('raw') == '1':
+        mimetype = mimetypes.guess_type(filename)[0] or 'text/plain; charset=utf-8'
+        path = files.spilled_path(filename)
+        if path is not None:
+            return send_file(path, mimetype=mimetype, conditional=True,
+                             download_name=os.path.basename(filename))
+        return Response(files[filename], mimetype=mimetype)
+
+    encoding = 'utf-8'
+    if files.is_spilled(filename):
+        # 磁盘文件按字节严格解码，二进制内容不能替换字符后当作文本返回
+        data = files.read_bytes(filename)
+        try:
+            content = data.decode('utf-8')
+        except UnicodeDecodeError:
+            content = base64.b64encode(data).decode('ascii')
+            encoding = 'base64'
+    else:
+        content = files[filename]
+    return jsonify({
+        'success': True,
+        'filename': filename,
+        'content': content,
+        'encoding': encoding,
+        'size': files.size(filename)
+    })
+
+def project_task(record: Dict[str, Any], fields: str) -> Dict[str, Any]:
+    """
+    按投影模式输出任务记录
+
+    Args:
+        record: 任务记录
+        fields: 投影模式 (full 完整记录, compact 仅id和状态)
+    """
+    if fields == 'compact':
+        return {'id': record['id'], 'status': record['status']}
+    return record
+
+
+@api.route('/api/tasks/<task_id>')
 def get_task(task_id):
-    """获取任务详细信息"""
-    if task_id not in active_tasks:
+    """
+    获取任务详细信息
+
+    查询参数:
+        fields: full 或 compact
+        tree: file_structure 字段的内容，full 为完整文件树，summary 为根目录摘要（目录通过 /tree 按需获取）；
+              默认与任务的 file_tree 模式一致
+    """
+    record = task_index.get(task_id)
+    if record is None:
+        return jsonify({'error': 'Task not found'}), 404
+
+    fields = request.args.get('fields', 'full')
+    if fields == 'compact':
+        return jsonify(project_task(record, fields))
+
+    executor = task_executors.get(task_id)
+    if executor is None:
+        return jsonify(record)
+
+    tree = request.args.get('tree', 'summary' if executor.file_tree_mode == 'lazy' else 'full')
+    if tree not in ('full', 'summary'):
+        return jsonify({'error': "tree must be one of ['full', 'summary']"}), 400
+
+    return jsonify({
+        **record,
+        'is_paused': executor.is_paused,
+        'files_created': len(executor.all_files),
+        'activities_count': len(executor.execution_log),
+        'file_structure': executor.file_structure if tree == 'full' else executor.all_files.tree.summary(),
+        'messages_sent': executor.messages_sent,
+        'multimedia_support': True,
+        'real_urls': True
+    })
+
+@api.route('/api/tasks/<task_id>/tree')
+def get_task_tree(task_id):
+    """
+    按需获取文件树的一部分，每个目录带子树文件数、总字节数和直接子节点数
+
+    查询参数:
+        path: 目录或文件路径，'/' 分隔，默认根目录
+        depth: 展开的层数 (0-FILE_TREE_MAX_DEPTH，默认1)，0只返回节点本身
+        cursor: 上一页返回的 next_cursor，用于子节点很多的目录
+        limit: 所请求目录返回的子节点数 (1-5000，默认 FILE_TREE_PAGE_SIZE)；更深层的目录最多展开前 limit 个
+    """
+    executor = task_executors.get(task_id)
+    if executor is None:
+        return jsonify({'error': 'Task not found'}), 404
+
+    args = request.args
+    try:
+        depth = min(max(int(args.get('depth', 1)), 0), FILE_TREE_MAX_DEPTH)
+        limit = min(max(int(args.get('limit', FILE_TREE_PAGE_SIZE)), 1), 5000)
+        offset = max(int(TaskIndex.decode_cursor(args['cursor'])), 0) if args.get('cursor') else 0
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    tree = executor.all_files.tree
+    node = tree.subtree(args.get('path', ''), depth, offset, limit)
+    if node is None:
+        return jsonify({'error': 'Path not found'}), 404
+
+    next_offset = offset + limit
+    more = node['type'] == 'directory' and depth > 0 and next_offset < node['child_count']
+    return jsonify({
+        'task_id': task_id,
+        'version': tree.version,
+        'node': node,
+        'next_cursor': TaskIndex.encode_cursor(str(next_offset)) if more else None
+    })
+
+
+@api.route('/api/tasks/<task_id>/terminal')
+def get_task_terminal(task_id):
+    """
+    获取任务终端输出的最近N行（回滚缓冲区），中途加入的客户端用它补齐之前的输出
+
+    查询参数:
+        tail: 返回的行数 (1-TERMINAL_SCROLLBACK_LINES，默认200)
+    """
+    executor = task_executors.get(task_id)
+    if executor is None:
         return jsonify({'error': 'Task not found'}), 404
+    try:
+        tail = min(max(int(request.args.get('tail', 200)), 1), TERMINAL_SCROLLBACK_LINES)
+    except ValueError:
+        return jsonify({'error': 'tail must be an integer'}), 400
+
+    terminal = executor.terminal
+    return jsonify({
+        'task_id': task_id,
+        'lines': terminal.tail(tail),
+        'total_lines': terminal.total_lines,
+        'commands': terminal.commands()
+    })
 
-    task_info = active_tasks[task_id].copy()
 
-    if task_id in task_executors:
-        executor = task_executors[task_id]
-        task_info.update({
-            'is_paused': executor.is_paused,
-            'files_created': len(executor.all_files),
-            'activities_count': len(executor.execution_log),
-            'file_structure': executor.file_structure,
-            'multimedia_support': True,
-            'real_urls': True
-        })
+LIST_QUERY_PARAMS = ('status', 'created_after', 'created_before', 'prompt_prefix', 'cursor', 'limit', 'order', 'fields')
 
-    return jsonify(task_info)
 
-@app.route('/api/tasks')
+@api.route('/api/tasks')
 def list_tasks():
-    """列出所有活跃任务"""
-    return jsonify(list(active_tasks.values()))
+    """
+    分页列出活跃任务
+
+    不带任何查询参数时返回全部任务记录的列表（原有格式）；
+    带有以下任一参数时返回 {tasks, next_cursor, total} 分页结果，
+    total 为满足过滤条件的任务总数（与 cursor 和 limit 无关）
+
+    查询参数:
+        status: 状态过滤，逗号分隔
+        created_after / created_before: 创建时间范围（Unix时间戳）
+        prompt_prefix: 提示词前缀
+        cursor: 上一页返回的 next_cursor
+        limit: 每页数量 (1-500，默认50)
+        order: asc 或 desc（按创建时间）
+        fields: full 或 compact（仅id和状态）
+    """
+    args = request.args
+    if not any(name in args for name in LIST_QUERY_PARAMS):
+        return jsonify(task_index.all())
+    statuses = [s for s in args.get('status', '').split(',') if s] or None
+    prompt_prefix = args.get('prompt_prefix') or None
+    fields = args.get('fields', 'full')
+    try:
+        limit = min(max(int(args.get('limit', 50)), 1), 500)
+        created_after = float(args['created_after']) if 'created_after' in args else None
+        created_before = float(args['created_before']) if 'created_before' in args else None
+        tasks, next_cursor = task_index.query(
+            statuses=statuses,
+            created_after=created_after,
+            created_before=created_before,
+            prompt_prefix=prompt_prefix,
+            cursor=args.get('cursor') or None,
+            limit=limit,
+            descending=args.get('order', 'asc') == 'desc'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'tasks': [project_task(record, fields) for record in tasks],
+        'next_cursor': next_cursor,
+        'total': task_index.count(statuses, created_after, created_before, prompt_prefix)
+    })
+
+@api.route('/api/search')
+def search_tasks():
+    """
+    全文搜索任务文件和执行日志
+
+    查询参数:
+        q: 查询语句，空白分隔的子句同时满足；"引号"内为短语，以*结尾为前缀匹配
+        status: 任务状态过滤，逗号分隔
+        kind: file 或 activity，逗号分隔
+        cursor: 上一页返回的 next_cursor
+        limit: 每页数量 (1-100，默认20)
+    """
+    args = request.args
+    statuses = [s for s in args.get('status', '').split(',') if s] or None
+    kinds = [k for k in args.get('kind', '').split(',') if k] or None
+    if kinds and not set(kinds) <= set(SEARCH_KINDS):
+        return jsonify({'error': f'kind must be one of {list(SEARCH_KINDS)}'}), 400
+    try:
+        limit = min(max(int(args.get('limit', 20)), 1), 100)
+        offset = int(TaskIndex.decode_cursor(args['cursor'])) if args.get('cursor') else 0
+        results = search_index.search(args.get('q', ''), statuses=statuses, kinds=kinds)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    page = results[offset:offset + limit]
+    hits = []
+    for result in page:
+        executor = task_executors.get(result['task_id'])
+        text = None
+        if executor is not None:
+            if result['kind'] == 'file':
+                content = executor.all_files.get(result['name'])
+                text = file_search_text(result['name'], content) if isinstance(content, str) else None
+            else:
+                record = executor.execution_log.get(result['name'])
+                text = activity_search_text(record) if record is not None else None
+        hit = {key: result[key] for key in ('task_id', 'kind', 'name', 'status', 'score')}
+        if text is not None:
+            hit['snippet'] = search_index.snippet(text, result['positions'][0], result['length'])
+        hits.append(hit)
+
+    next_offset = offset + limit
+    return jsonify({
+        'results': hits,
+        'total': len(results),
+        'next_cursor': TaskIndex.encode_cursor(str(next_offset)) if next_offset < len(results) else None
+    })
+
+@api.route('/api/media/<digest>')
+def get_media(digest):
+    """提供缓存的媒体文件（支持Range请求和条件请求）"""
+    meta = media_cache.get(digest)
+    if meta is None or not os.path.isfile(media_cache.path(digest)):
+        return jsonify({'error': 'Media not found'}), 404
+
+    response = send_file(
+        media_cache.path(digest),
+        mimetype=meta['content_type'],
+        conditional=True,
+        etag=digest,
+        max_age=365 * 24 * 3600
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@api.route('/api/metrics')
+def get_metrics():
+    """
+    运行指标：各任务消息通道的积压高水位、合并/丢弃计数和阻塞时间，以及调度器和媒体缓存
+
+    查询参数:
+        top: 按高水位排序返回的任务数（默认20）
+    """
+    try:
+        top = max(int(request.args.get('top', 20)), 0)
+    except ValueError:
+        return jsonify({'error': 'top must be an integer'}), 400
+
+    channels = {task_id: channel.stats() for task_id, channel in list(task_queues.items())}
+    busiest = sorted(channels.items(), key=lambda item: item[1]['high_water'], reverse=True)[:top]
+
+    return jsonify({
+        'timestamp': time.time(),
+        'queues': {
+            'count': len(channels),
+            'high_water_max': max((c['high_water'] for c in channels.values()), default=0),
+            'pending_total': sum(c['pending'] for c in channels.values()),
+            'coalesced_total': sum(c['coalesced'] for c in channels.values()),
+            'dropped_total': sum(c['dropped'] for c in channels.values()),
+            'blocked_seconds_total': round(sum(c['blocked_seconds'] for c in channels.values()), 3),
+            'tasks': dict(busiest)
+        },
+        'scheduler': task_scheduler.stats(),
+        'media_cache': media_cache.stats(),
+        'attachments': attachment_store.stats(),
+        'result_cache': result_cache.stats(),
+        'process_lane': process_lane.stats(),
+        'search_index': search_index.stats(),
+        'checkpoints': checkpoint_store.stats(),
+        'stream_recordings': stream_recordings.stats(),
+        'event_subscribers': task_events.subscriber_count
+    })
+
+@api.route('/api/profiler', methods=['GET', 'POST'])
+def profiler():
+    """
+    进程级采样分析器
+
+    GET 查询参数:
+        format: json（默认，返回采样最多的调用栈）或 collapsed（折叠栈文本，供火焰图工具使用）
+        top: json格式返回的调用栈数（默认20）
+    POST 请求体:
+        enabled: 开启或关闭采样
+        interval: 采样间隔（秒，0.001-1），采样进行中时同样生效；不指定时保持当前间隔
+        reset: 为true时清空已有采样
+    """
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        try:
+            interval = min(max(float(data['interval']), 0.001), 1.0) if 'interval' in data else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'interval must be a number'}), 400
+        if data.get('enabled', True):
+            sampling_profiler.start(interval, reset=bool(data.get('reset', False)))
+        else:
+            sampling_profiler.stop()
+        return jsonify(sampling_profiler.stats(top=0))
+
+    if request.args.get('format') == 'collapsed':
+        return Response(sampling_profiler.collapsed(), mimetype='text/plain')
+    try:
+        top = max(int(request.args.get('top', 20)), 0)
+    except ValueError:
+        return jsonify({'error': 'top must be an integer'}), 400
+    return jsonify(sampling_profiler.stats(top))
 
-@app.route('/api/health')
+@api.route('/api/health')
 def health_check():
-    """系统健康检查"""
+    """系统健康检查（停机排空期间返回503，负载均衡据此摘除实例）"""
+    draining = server_draining.is_set()
     return jsonify({
-        'status': 'healthy',
-        'active_tasks': len(active_tasks),
+        'status': 'draining' if draining else 'healthy',
+        'active_tasks': len(task_index),
+        'tasks_by_status': task_index.count_by_status(),
+        'event_subscribers': task_events.subscriber_count,
+        'scheduler': task_scheduler.stats(),
+        'media_cache': media_cache.stats(),
         'running_executors': len(task_executors),
         'timestamp': time.time(),
         'version': '2.1.0',
         'communication_mode': 'POST + Chunked Transfer',
+        'executor_profiles': list(EXECUTOR_PROFILES),
         'features': ['real-multimedia', 'live-urls', 'post-streaming', 'reliable-messaging']
-    })
+    }), 503 if draining else 200
+
+# ==================== 优雅停机 ====================
+
+def open_stream_count() -> int:
+    """当前连接在各任务消息通道上的流数量"""
+    return sum(len(channel.subscriptions) for channel in list(task_queues.values()))
+
+
+def shutdown(timeout: float = SHUTDOWN_DRAIN_SECONDS) -> Dict[str, int]:
+    """
+    优雅停机
+
+    1. 拒绝新任务（创建接口返回503）
+    2. 等待在途流随任务结束自然关闭，最多 timeout 秒
+    3. 冻结仍在运行的任务，确保每个未结束的任务都有检查点（磁盘文件保留），重启后由
+       resume_interrupted_tasks() 恢复。执行中的任务保留最后一个步骤边界的检查点：恢复时从该步骤
+       重新执行，消息序号与检查点一致；还没有到达第一个步骤边界的任务在这里写入检查点
+    4. 关闭所有消息通道，剩余的流收到 connection_close 后结束
+
+    Returns:
+        停机统计
+    """
+    server_draining.set()
+    logger.info(f"Draining {open_stream_count()} open streams (timeout {timeout}s)")
+    deadline = time.monotonic() + timeout
+    while open_stream_count() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    remaining = open_stream_count()
+
+    saved = 0
+    for task_id, executor in list(task_executors.items()):
+        if executor.is_running:
+            executor.is_paused = True  # 直接冻结，不再向通道发送消息
+        if executor.task_status in FINAL_STATUSES or not executor.checkpoints:
+            continue
+        if os.path.exists(checkpoint_store.path(task_id)):
+            saved += 1
+            continue
+        try:
+            if checkpoint_store.save(executor):
+                saved += 1
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to checkpoint task {task_id} on shutdown: {e}")
+
+    for channel in list(task_queues.values()):
+        channel.close()
+    sampling_profiler.stop()
+    media_cache.shutdown()
+    process_lane.shutdown()
+
+    logger.info(f"Shutdown complete: {saved} task states saved, {remaining} streams closed early")
+    return {'saved': saved, 'streams_closed': remaining}
+
 
 # ==================== 应用启动 ====================
 
+def create_app() -> Flask:
+    """
+    应用工厂：创建Flask应用并注册API路由
+
+    路由编译等初始化在这里而不是导入时进行，启动器可以在fork前导入模块、
+    在各worker中再创建应用
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)  # 允许跨域请求
+    flask_app.register_blueprint(api)
+    return flask_app
+
+
+def __getattr__(name: str):
+    """兼容 `from app import app`：第一次访问时才创建模块级应用"""
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def resume_interrupted_tasks() -> int:
+    """
+    恢复上次进程退出时仍在执行的任务：按检查点重建任务记录、执行器和消息通道，
+    交给调度器从最后完成的步骤之后继续执行。原来的客户端连接已经断开，
+    恢复的任务按后台任务运行，客户端可通过 /connect?since=<已收到的序号> 重新接收。
+    每个检查点先经 CheckpointStore.claim 独占，多个进程同时启动时只有一个恢复它
+
+    Returns:
+        恢复的任务数
+    """
+    resumed = 0
+    for task_id in checkpoint_store.pending():
+        if task_id in task_index:
+            continue
+        # 先取得恢复锁再读取：另一个进程可能正在恢复该任务，或在列出之后已经完成并删除了检查点
+        if not checkpoint_store.claim(task_id):
+            logger.info(f"Task {task_id} is being resumed by another process")
+            continue
+        checkpoint = checkpoint_store.load(task_id)
+        if checkpoint is None or checkpoint['record'].get('profile') not in EXECUTOR_PROFILES:
+            checkpoint_store.release(task_id)
+            continue
+        record = checkpoint['record']
+        state = checkpoint['executor']
+        executor = EXECUTOR_PROFILES[record['profile']](task_id, record['prompt'])
+        executor.restore_state(state)
+        record.update(run='background', resumed_from_step=executor.completed_steps)
+        record.pop('detached_at', None)
+        channel = create_task_channel(base=executor.messages_sent)
+        for msg_type, data in executor.state_messages():
+            channel.view.apply({'type': msg_type, 'data': data})
+        task_queues[task_id] = channel
+        task_index.add(record)
+        task_executors[task_id] = executor
+        search_index.submit('reindex_task', task_id)
+        record_task_event(task_id, 'resumed', status=record['status'])
+        logger.info(f"Resuming task {task_id} after step {executor.completed_steps} "
+                    f"(sequence {executor.messages_sent})")
+        task_scheduler.submit(executor)
+        resumed += 1
+    if resumed:
+        checkpoint_store.resumed += resumed
+        ensure_reaper_started()
+    return resumed
+
+
+_background_services_started = Event()
+
+
+def start_background_services():
+    """
+    服务进程启动时调用：恢复中断的任务，预取示例媒体，按配置开启采样分析器。
+    只应在实际处理请求的进程中调用（开发服务器自动重载时为子进程），同一进程内重复调用无效
+    """
+    if _background_services_started.is_set():
+        return
+    _background_services_started.set()
+    resume_interrupted_tasks()
+    media_cache.prefetch([info['url'] for info in SAMPLE_MEDIA.values() if 'url' in info])
+    if os.environ.get('PROFILER_ENABLED', '0') == '1':
+        sampling_profiler.start()
+
+
 if __name__ == '__main__':
+    # 开发服务器（调试器+自动重载）；生产环境使用 serve.py
     logger.info("Starting Resear Pro AI Assistant Backend...")
     logger.info("Features: Real multimedia URLs, 10-step execution, 3s intervals")
+    logger.info(f"Executor profiles: {', '.join(EXECUTOR_PROFILES)} (default: {DEFAULT_EXECUTOR_PROFILE})")
     logger.info("Communication Mode: POST + Chunked Transfer (Reliable messaging)")
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
+    # 自动重载时本脚本在监视进程和服务子进程中各执行一次，只有服务子进程（WERKZEUG_RUN_MAIN=true）恢复任务
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    create_app().run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
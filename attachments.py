@@ -0,0 +1,263 @@
+"""
+附件上传
+
+UploadSession 是可续传的上传会话，MultipartUpload 从请求流逐块解析 multipart/form-data，
+AttachmentStore 管理上传会话并按服务端计算的SHA-256去重保存完成的附件。
+上传ID的生成和大小配置由 app 创建存储时传入。
+"""
+
+import hashlib
+import os
+import time
+from threading import Lock
+from typing import Dict, Any, Optional, Tuple, Callable
+
+from werkzeug.sansio.multipart import MultipartDecoder, Epilogue, File, NEED_DATA
+
+UPLOAD_READ_SIZE = 64 * 1024  # 从请求体读取的块大小
+
+
+class UploadError(Exception):
+    """上传请求无效，status 为对应的HTTP状态码"""
+
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class UploadSession:
+    """
+    一个可续传的附件上传
+    数据按偏移量追加写入临时文件，同时增量计算SHA-256，任何时候内存中只有一个读取块
+    """
+
+    def __init__(self, upload_id: str, task_id: str, filename: str, size: Optional[int],
+                 path: str, expected_sha256: Optional[str] = None, chunk_size: int = 4 * 1024 * 1024):
+        self.upload_id = upload_id
+        self.task_id = task_id
+        self.filename = filename
+        self.size = size  # 声明的总大小；multipart上传时为None
+        self.path = path
+        self.expected_sha256 = expected_sha256
+        self.chunk_size = chunk_size  # 建议客户端每次续传的字节数
+        self.offset = 0
+        self.updated_at = time.time()
+        self._hasher = hashlib.sha256()
+        self._lock = Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self.size is not None and self.offset >= self.size
+
+    def write_from(self, stream, offset: int, limit: int) -> int:
+        """
+        从可读流追加数据
+
+        Args:
+            stream: 提供 read(n) 的请求体或上传文件
+            offset: 客户端认为的当前偏移量，必须与服务端一致
+            limit: 允许写入的最大总字节数
+
+        Returns:
+            写入后的偏移量
+        """
+        if not self._lock.acquire(blocking=False):
+            raise UploadError('Another request is writing to this upload', 409, offset=self.offset)
+        try:
+            if offset != self.offset:
+                raise UploadError('Upload offset mismatch', 409, offset=self.offset)
+            with open(self.path, 'ab') as f:
+                while True:
+                    chunk = stream.read(UPLOAD_READ_SIZE)
+                    if not chunk:
+                        break
+                    if self.offset + len(chunk) > limit:
+                        raise UploadError('Attachment exceeds size limit', 413, offset=self.offset, limit=limit)
+                    f.write(chunk)
+                    self._hasher.update(chunk)
+                    self.offset += len(chunk)
+            self.updated_at = time.time()
+            return self.offset
+        finally:
+            self._lock.release()
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'status': 'complete' if self.complete else 'pending',
+            'chunk_size': self.chunk_size
+        }
+
+
+class MultipartUpload:
+    """
+    从请求体流式解析 multipart/form-data 中的文件
+
+    request.files 会先把整个请求体缓冲到临时文件再交给视图；这里直接读取请求流，
+    任何时候内存中只有一个读取块。files() 逐个产出 (文件名, 可读对象)，取下一个文件前必须读完当前文件
+    """
+
+    class Part:
+        """一个文件部分的数据，read() 返回下一块，读完后返回 b''"""
+
+        def __init__(self, upload: 'MultipartUpload'):
+            self.upload = upload
+            self.done = False
+
+        def read(self, size: int = -1) -> bytes:
+            while not self.done:
+                event = self.upload._next_event()
+                self.done = not event.more_data
+                if event.data:
+                    return event.data
+            return b''
+
+    def __init__(self, stream, boundary: str):
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._eof = False
+
+    def _next_event(self):
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError as e:
+                raise UploadError('Malformed multipart body') from e
+            if event is not NEED_DATA:
+                return event
+            if self._eof:
+                raise UploadError('Incomplete multipart body')
+            chunk = self._stream.read(UPLOAD_READ_SIZE)
+            self._eof = not chunk
+            self._decoder.receive_data(chunk or None)
+
+    def files(self):
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, File):
+                yield event.filename, self.Part(self)
+            # 普通字段及其数据（Data）忽略
+
+
+class AttachmentStore:
+    """
+    附件上传会话和按内容去重的附件存储
+
+    完成的附件按SHA-256保存在 <root>/blobs/ 下，任务目录通过硬链接引用，
+    相同内容无论被多少任务附加都只占用一份磁盘空间；没有任务引用的内容由 collect_garbage 删除。
+    去重只使用服务端对收到的数据计算的摘要：客户端声明的摘要不能用来引用已有内容，
+    否则知道摘要的客户端无需上传就能把其他任务的文件链接到自己的任务中
+    """
+
+    def __init__(self, root: str, new_id: Callable[[], str], chunk_size: int = 4 * 1024 * 1024,
+                 session_ttl: float = 3600):
+        """
+        Args:
+            root: 附件存储目录
+            new_id: 生成上传ID的函数
+            chunk_size: 建议客户端每次续传的字节数
+            session_ttl: 未完成的上传保留时间（秒）
+        """
+        self.root = root
+        self.new_id = new_id
+        self.chunk_size = chunk_size
+        self.session_ttl = session_ttl
+        self.parts_dir = os.path.join(root, 'parts')
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = Lock()
+        self.deduplicated = 0
+        self.bytes_received = 0
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest)
+
+    def start(self, task_id: str, filename: str, size: Optional[int],
+              expected_sha256: Optional[str] = None) -> UploadSession:
+        os.makedirs(self.parts_dir, exist_ok=True)
+        upload_id = self.new_id()
+        session = UploadSession(upload_id, task_id, filename, size,
+                                os.path.join(self.parts_dir, upload_id), expected_sha256, self.chunk_size)
+        open(session.path, 'wb').close()
+        with self._lock:
+            self._sessions[upload_id] = session
+        return session
+
+    def get(self, task_id: str, upload_id: str) -> Optional[UploadSession]:
+        session = self._sessions.get(upload_id)
+        return session if session is not None and session.task_id == task_id else None
+
+    def pending_bytes(self, task_id: str) -> int:
+        """任务未完成的上传声明的总字节数（计入配额）"""
+        return sum(s.size or s.offset for s in list(self._sessions.values()) if s.task_id == task_id)
+
+    def commit(self, session: UploadSession) -> Tuple[str, str, bool]:
+        """
+        完成上传：校验摘要并移入内容存储
+
+        Returns:
+            (sha256, 内容路径, 是否与已有内容重复)
+        """
+        with self._lock:
+            self._sessions.pop(session.upload_id, None)
+        digest = session.hexdigest()
+        if session.expected_sha256 and session.expected_sha256.lower() != digest:
+            session.discard()
+            raise UploadError('SHA-256 mismatch', 422, sha256=digest)
+        self.bytes_received += session.offset
+
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            session.discard()
+            self.deduplicated += 1
+            return digest, path, True
+        os.replace(session.path, path)
+        return digest, path, False
+
+    def abort(self, session: UploadSession):
+        with self._lock:
+            self._sessions.pop(session.upload_id, None)
+        session.discard()
+
+    def collect_garbage(self, now: Optional[float] = None) -> int:
+        """删除过期的未完成上传，以及不再被任何任务目录引用（硬链接数为1）的内容"""
+        deadline = (now or time.time()) - self.session_ttl
+        removed = 0
+        for session in list(self._sessions.values()):
+            if session.updated_at < deadline:
+                self.abort(session)
+                removed += 1
+        if os.path.isdir(self.blobs_dir):
+            for name in os.listdir(self.blobs_dir):
+                path = os.path.join(self.blobs_dir, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_nlink <= 1 and stat.st_mtime < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending_uploads': len(self._sessions),
+            'bytes_received': self.bytes_received,
+            'deduplicated': self.deduplicated
+        }
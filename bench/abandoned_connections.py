@@ -0,0 +1,91 @@
+"""
+断开连接模拟：大量客户端读取第一块后放弃 /connect 流
+
+创建 --connections 个前台任务（默认1000），每个连接读到第一块数据后关闭，
+按 --policy（cancel / pause / detach）处理断开。统计放弃全部连接的耗时、执行线程全部退出的耗时，
+以及之后仍然存在的执行器、消息通道、订阅、任务目录和线程数。
+cancel 策略下任何残留都视为泄漏，以非零状态退出，可在CI中运行。
+pause 策略下暂停的任务一直占用执行线程，超过 MAX_CONCURRENT_TASKS 的任务排队时读不到第一块，
+因此连接数限制为 MAX_CONCURRENT_TASKS。
+
+用法:
+    python bench/abandoned_connections.py [--connections 1000] [--policy cancel]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', type=int, default=1000, help='放弃的连接数')
+    parser.add_argument('--policy', default='cancel', choices=('cancel', 'pause', 'detach'), help='断开处理策略')
+    parser.add_argument('--timeout', type=float, default=60, help='等待执行线程退出的最长时间（秒）')
+    args = parser.parse_args()
+
+    store = tempfile.mkdtemp(prefix='bench-abandon-')
+    os.environ.setdefault('TASK_STORE_DIR', store)
+    os.environ.setdefault('CHECKPOINT_ENABLED', '0')
+    import logging
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    client = app.create_app().test_client()
+    threads_before = threading.active_count()
+    if args.policy == 'pause' and args.connections > app.MAX_CONCURRENT_TASKS:
+        print(f"pause policy: limiting connections to MAX_CONCURRENT_TASKS={app.MAX_CONCURRENT_TASKS}")
+        args.connections = app.MAX_CONCURRENT_TASKS
+
+    started = time.perf_counter()
+    for _ in range(args.connections):
+        task_id = client.post('/api/tasks', json={'prompt': 'abandoned', 'profile': 'simple'}).get_json()['task_id']
+        app.task_executors[task_id].step_interval = 0.05
+        response = client.post(f'/api/tasks/{task_id}/connect?on_disconnect={args.policy}', buffered=False)
+        next(iter(response.response))  # 读到第一块后放弃
+        response.close()
+    abandoned = time.perf_counter() - started
+
+    if args.policy != 'cancel':
+        # 暂停或转为后台的任务仍然保留：报告状态后取消，避免执行线程阻止进程退出
+        statuses = {}
+        for record in app.task_index.all():
+            key = f"{record['run']}/{record['status']}"
+            statuses[key] = statuses.get(key, 0) + 1
+        print(f"retained tasks by run/status: {statuses}")
+        for task_id in list(app.task_executors):
+            app.task_executors[task_id].cancel()
+            app.cleanup_task(task_id)
+
+    deadline = time.monotonic() + args.timeout
+    while app.task_scheduler.stats()['running'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    drained = time.perf_counter() - started
+    time.sleep(0.2)  # 执行线程退出后释放任务目录
+
+    subscriptions = sum(len(channel.subscriptions) for channel in list(app.task_queues.values()))
+    task_dirs = [name for name in os.listdir(app.TASK_STORE_DIR) if not name.startswith('_')] \
+        if os.path.isdir(app.TASK_STORE_DIR) else []
+    print(f"connections={args.connections} policy={args.policy}")
+    print(f"abandoned in {abandoned:.2f}s, executors idle after {drained:.2f}s"
+          f"{'' if args.policy == 'cancel' else ' (retained tasks cancelled by the script)'}")
+    print(f"left: executors={len(app.task_executors)} queues={len(app.task_queues)} "
+          f"subscriptions={subscriptions} task_dirs={len(task_dirs)} scheduler={app.task_scheduler.stats()} "
+          f"threads={threading.active_count()} (before {threads_before})")
+
+    if args.policy == 'cancel':
+        leaks = [name for name, count in (('executors', len(app.task_executors)), ('queues', len(app.task_queues)),
+                                          ('subscriptions', subscriptions), ('task_dirs', len(task_dirs)),
+                                          ('running', app.task_scheduler.stats()['running'])) if count]
+        if leaks:
+            print('FAILED: leaked ' + ', '.join(leaks))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
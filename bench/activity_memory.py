@@ -0,0 +1,59 @@
+"""
+执行日志内存基准：每条活动占用的字节数
+
+分别以原来的字典列表和 ActivityLog + ActivityRecord 保存 --count 条活动（默认100万），
+用 tracemalloc 统计每条活动的平均占用；活动文本取自10个重复的步骤描述，与执行器的实际输出相近。
+
+用法:
+    python bench/activity_memory.py [--count 1000000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(build, count: int) -> float:
+    """build(count) 创建的对象在保留期间的平均每条字节数"""
+    tracemalloc.start()
+    kept = build(count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=1_000_000, help='活动条数')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TASK_STORE_DIR', tempfile.mkdtemp(prefix='bench-activity-'))
+    import app
+
+    texts = [f"Step {i}: 分析任务需求" for i in range(10)]
+
+    def as_dicts(count):
+        return [{'id': i, 'text': texts[i % 10], 'type': 'command', 'status': 'completed',
+                 'timestamp': time.time(), 'command': 'ls'} for i in range(count)]
+
+    def as_records(count):
+        log = app.ActivityLog()
+        for i in range(count):
+            log.append(app.ActivityRecord(i, texts[i % 10], 'command', 'completed', time.time(), command='ls'))
+        return log
+
+    dict_bytes = measure(as_dicts, args.count)
+    record_bytes = measure(as_records, args.count)
+    print(f"count={args.count}")
+    print(f"dict        {dict_bytes:7.1f} B/activity  {dict_bytes * args.count / 1024 ** 2:8.1f} MB")
+    print(f"ActivityLog {record_bytes:7.1f} B/activity  {record_bytes * args.count / 1024 ** 2:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
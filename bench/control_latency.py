@@ -0,0 +1,99 @@
+"""
+控制消息延迟基准：积压大文件时暂停等控制消息多久到达客户端
+
+发布方分 --bursts 批，每批连续发布 --files 个 --file-kb KB 的 file_update，
+同时穿插 --controls 条 task_update（模拟暂停）；读取方按 --rate-mb MB/s 限速消费（模拟慢网络）。
+分别以 FIFO（priority=False）、优先通道、优先通道+分段（chunk_size=--chunk-kb KB）订阅，
+统计 task_update 从发布到读取的延迟，并检查文件内容能按分段完整还原。
+
+用法:
+    python bench/control_latency.py [--bursts 5] [--files 10] [--file-kb 400] [--rate-mb 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(app, args, priority: bool, chunk_size: int):
+    """一种订阅方式下的 (控制消息延迟列表, 文件是否完整还原)"""
+    channel = app.TaskChannel(0, 'block', 0)
+    subscription = channel.subscribe(0, priority=priority, chunk_size=chunk_size)
+    expected = {}
+    latencies = []
+    received = {}
+    parts = {}
+    total = args.bursts * (args.files + args.controls)
+
+    def reader():
+        count = 0
+        while count < total:
+            message = subscription.get(timeout=10)
+            data = message['data']
+            if message['type'] == 'task_update':
+                latencies.append(time.perf_counter() - data['sent'])
+                size = 100
+            elif message['type'] == 'file_chunk':
+                parts.setdefault(data['filename'], []).append(data['content'])
+                size = len(data['content'])
+                if data['index'] < data['count'] - 1:
+                    # 中间分段不算一条完整消息
+                    time.sleep(size / (args.rate_mb * 1024 * 1024))
+                    continue
+                received[data['filename']] = ''.join(parts.pop(data['filename']))
+            else:
+                received[data['filename']] = data['content']
+                size = len(data['content'])
+            count += 1
+            time.sleep(size / (args.rate_mb * 1024 * 1024))
+
+    thread = Thread(target=reader)
+    thread.start()
+    control_every = max(1, args.files // args.controls)
+    for burst in range(args.bursts):
+        sent_controls = 0
+        for i in range(args.files):
+            filename = f'burst{burst}/file{i}.txt'
+            content = (f'{filename} ' * (args.file_kb * 1024 // (len(filename) + 1) + 1))[:args.file_kb * 1024]
+            expected[filename] = content
+            channel.publish({'type': 'file_update', 'data': {'filename': filename, 'content': content}})
+            if i % control_every == control_every - 1 and sent_controls < args.controls:
+                channel.publish({'type': 'task_update', 'data': {'status': 'paused', 'sent': time.perf_counter()}})
+                sent_controls += 1
+        while sent_controls < args.controls:
+            channel.publish({'type': 'task_update', 'data': {'status': 'paused', 'sent': time.perf_counter()}})
+            sent_controls += 1
+        time.sleep(0.2)
+    thread.join()
+    channel.close()
+    return latencies, received == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bursts', type=int, default=5, help='批次数')
+    parser.add_argument('--files', type=int, default=10, help='每批的文件消息数')
+    parser.add_argument('--file-kb', type=int, default=400, help='每个文件的大小（KB）')
+    parser.add_argument('--controls', type=int, default=4, help='每批穿插的控制消息数')
+    parser.add_argument('--rate-mb', type=float, default=20, help='读取方的限速（MB/s）')
+    parser.add_argument('--chunk-kb', type=int, default=64, help='分段大小（KB）')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TASK_STORE_DIR', tempfile.mkdtemp(prefix='bench-control-'))
+    import app
+
+    for label, priority, chunk_size in (('fifo', False, 0), ('priority', True, 0),
+                                        (f'priority+{args.chunk_kb}K chunks', True, args.chunk_kb * 1024)):
+        latencies, intact = run(app, args, priority, chunk_size)
+        print(f"{label:22} p50={statistics.median(latencies) * 1000:7.1f} ms  max={max(latencies) * 1000:7.1f} ms  "
+              f"files {'intact' if intact else 'CORRUPTED'}")
+
+
+if __name__ == '__main__':
+    main()
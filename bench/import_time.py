@@ -0,0 +1,95 @@
+"""
+冷启动基准：import app 的耗时和副作用
+
+1. 在新进程中运行 --runs 次 `python -X importtime -c "import app"`，取 app 模块自身耗时
+   和累计耗时（含 flask 等依赖）的中位数
+2. 在新进程中检查导入没有副作用：不创建 Flask 应用、不启动线程或子进程、
+   不创建任务存储、媒体缓存和结果缓存目录
+
+副作用检查失败，或给定 --max-self-ms 且自身耗时中位数超过该值时以非零状态退出，CI中运行。
+
+用法:
+    python bench/import_time.py [--runs 15] [--max-self-ms 30]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行：导入前后对比线程、子进程和目录
+SIDE_EFFECT_CHECK = '''
+import json, os, sys, threading, multiprocessing
+threads = threading.active_count()
+import app
+dirs = {name: os.environ[name] for name in ('TASK_STORE_DIR', 'MEDIA_CACHE_DIR', 'RESULT_CACHE_DIR')}
+print(json.dumps({
+    'app_built': 'app' in vars(app),
+    'threads_started': threading.active_count() - threads,
+    'children': len(multiprocessing.active_children()),
+    'dirs_created': [name for name, path in dirs.items() if os.path.exists(path)],
+}))
+'''
+
+
+def isolated_env() -> dict:
+    """子进程环境：存储目录指向尚不存在的临时路径，导入时若创建即可发现"""
+    base = tempfile.mkdtemp(prefix='bench-import-')
+    return {
+        **os.environ,
+        'PYTHONPATH': ROOT,
+        'TASK_STORE_DIR': os.path.join(base, 'task_store'),
+        'MEDIA_CACHE_DIR': os.path.join(base, 'media_cache'),
+        'RESULT_CACHE_DIR': os.path.join(base, 'result_cache'),
+    }
+
+
+def import_times(runs: int):
+    """返回 [(app自身微秒, app累计微秒)]"""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                                env=isolated_env(), capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) == 3 and parts[2] == 'app':
+                samples.append((int(parts[0].rsplit(':', 1)[1]), int(parts[1])))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15, help='测量次数')
+    parser.add_argument('--max-self-ms', type=float, default=None, help='app 模块自身耗时中位数的上限（毫秒）')
+    args = parser.parse_args()
+
+    # 先导入一次生成 .pyc，之后的测量不包含编译时间
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=isolated_env(), check=True)
+    samples = import_times(args.runs)
+    self_ms = statistics.median(s for s, _ in samples) / 1000
+    cumulative_ms = statistics.median(c for _, c in samples) / 1000
+    print(f"import app (median of {len(samples)}): self {self_ms:.2f} ms, cumulative {cumulative_ms:.2f} ms")
+
+    result = subprocess.run([sys.executable, '-c', SIDE_EFFECT_CHECK], cwd=ROOT, env=isolated_env(),
+                            capture_output=True, text=True, check=True)
+    effects = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"side effects: {effects}")
+
+    failures = []
+    if effects['app_built'] or effects['threads_started'] or effects['children'] or effects['dirs_created']:
+        failures.append('import has side effects')
+    if args.max_self_ms is not None and self_ms > args.max_self_ms:
+        failures.append(f"self time {self_ms:.2f} ms exceeds {args.max_self_ms} ms")
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
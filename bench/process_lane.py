@@ -0,0 +1,116 @@
+"""
+进程池通道基准：重度导出期间轻量任务的消息流延迟
+
+在同一进程中持续运行若干导出（--exports 个线程反复请求 /api/tasks/<id>/export），
+同时反复运行 simple 任务并经 /connect 读取消息流，统计 activity 消息从发出（data.timestamp）
+到客户端读到的延迟。依次测量无导出、lane=thread 和 lane=process 三种情况，
+用于判断目标机器上是否应启用 EXPORT_LANE=process/auto。
+
+用法:
+    python bench/process_lane.py [--exports 2] [--file-mb 8] [--duration 10]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'stream', 'export', 'worker', 'lane', '任务', '文件']
+
+
+def make_text(size: int) -> str:
+    """约 size 字节的随机单词文本（可压缩但不平凡）"""
+    rng = random.Random(size)
+    parts = []
+    total = 0
+    while total < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        total += len(word) + 1
+    return ' '.join(parts)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(app, client, heavy_task_id: str, lane, exports: int, duration: float):
+    """运行一种情况，返回 (延迟秒列表, 完成的导出数)"""
+    stop = Event()
+    completed = []
+
+    def export_loop():
+        export_client = app.create_app().test_client()
+        while not stop.is_set():
+            response = export_client.get(f'/api/tasks/{heavy_task_id}/export?lane={lane}')
+            response.close()
+            completed.append(response.status_code)
+
+    threads = [Thread(target=export_loop, daemon=True) for _ in range(exports if lane else 0)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)  # 让导出进入稳定状态（进程池启动也在此期间完成）
+    exports_before = len(completed)
+
+    latencies = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        task_id = client.post('/api/tasks', json={'prompt': 'latency probe', 'profile': 'simple'}).get_json()['task_id']
+        app.task_executors[task_id].step_interval = 0.01
+        response = client.post(f'/api/tasks/{task_id}/connect', buffered=False)
+        for line in response.response:
+            received = time.time()
+            for item in line.splitlines():
+                message = json.loads(item)
+                if message.get('type') == 'activity':
+                    latencies.append(received - message['data']['timestamp'])
+        response.close()
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, len(completed) - exports_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--exports', type=int, default=2, help='并发导出线程数')
+    parser.add_argument('--file-mb', type=float, default=8, help='被导出任务的文件总量（MB）')
+    parser.add_argument('--duration', type=float, default=10, help='每种情况的测量时长（秒）')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TASK_STORE_DIR', tempfile.mkdtemp(prefix='bench-lane-'))
+    os.environ.setdefault('CHECKPOINT_ENABLED', '0')
+    import logging
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    client = app.create_app().test_client()
+
+    heavy_task_id = client.post('/api/tasks', json={'prompt': 'heavy export', 'profile': 'simple'}).get_json()['task_id']
+    files = app.task_executors[heavy_task_id].all_files
+    file_size = 512 * 1024
+    for i in range(max(1, int(args.file_mb * 1024 * 1024 / file_size))):
+        files[f'data/part-{i}.txt'] = make_text(file_size)
+
+    print(f"cpus={os.cpu_count()} exports={args.exports} file_mb={args.file_mb} "
+          f"process_workers={app.process_lane.max_workers}")
+    try:
+        for lane in (None, 'thread', 'process'):
+            latencies, exported = measure(app, client, heavy_task_id, lane, args.exports, args.duration)
+            print(f"{lane or 'idle':8} samples={len(latencies):5} "
+                  f"p50={percentile(latencies, 0.5) * 1000:8.2f}ms p99={percentile(latencies, 0.99) * 1000:8.2f}ms "
+                  f"max={max(latencies) * 1000:8.2f}ms exports/s={exported / args.duration:6.2f}")
+    finally:
+        app.process_lane.shutdown()
+
+
+if __name__ == '__main__':
+    main()
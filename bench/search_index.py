@@ -0,0 +1,131 @@
+"""
+搜索索引基准：建索引吞吐、查询延迟，以及建索引期间的消息流延迟
+
+生成 --docs 个合成文档（英文单词与中文混合，每个约 --doc-chars 个字符），
+1. 统计 submit 的入队耗时（执行线程热路径上的开销）
+2. 统计 flush 建索引的吞吐（文档/秒、字符/秒）
+3. 统计词项、前缀和短语查询的平均耗时
+4. 在建索引的同时，从另一个线程每毫秒向 TaskChannel 发布一条消息并读取，
+   比较空闲和建索引期间发布到读取的延迟（p50/p99）
+
+用法:
+    python bench/search_index.py [--docs 2000] [--doc-chars 4400]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['stream', 'export', 'worker', 'channel', 'snapshot', 'checkpoint', 'latency', 'index',
+         'phrase', 'prefix', 'research', 'report', 'result', 'activity', 'terminal', 'upload']
+CHINESE = '任务文件搜索索引分析报告执行结果数据模型终端输出'
+
+
+def make_document(rng: random.Random, chars: int) -> str:
+    parts = []
+    total = 0
+    while total < chars:
+        part = rng.choice(WORDS) if rng.random() < 0.7 else ''.join(rng.choices(CHINESE, k=rng.randint(2, 6)))
+        parts.append(part)
+        total += len(part) + 1
+    return ' '.join(parts)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def channel_latency(app, busy, duration: float):
+    """busy() 运行期间（为None时空闲 duration 秒）发布到读取的延迟列表"""
+    channel = app.TaskChannel(0, 'coalesce', 1000)
+    subscription = channel.subscribe(0)
+    stop = Event()
+    latencies = []
+
+    def reader():
+        while not stop.is_set():
+            try:
+                message = subscription.get(timeout=0.1)
+            except Exception:
+                continue
+            latencies.append(time.perf_counter() - message['data']['sent'])
+
+    def publisher():
+        while not stop.is_set():
+            channel.publish({'type': 'activity_update', 'data': {'id': 0, 'status': 'x', 'sent': time.perf_counter()}})
+            time.sleep(0.001)
+
+    threads = [Thread(target=reader, daemon=True), Thread(target=publisher, daemon=True)]
+    for thread in threads:
+        thread.start()
+    if busy is None:
+        time.sleep(duration)
+    else:
+        busy()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    channel.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=2000, help='文档数')
+    parser.add_argument('--doc-chars', type=int, default=4400, help='每个文档的字符数')
+    parser.add_argument('--query-runs', type=int, default=20, help='每种查询的执行次数')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TASK_STORE_DIR', tempfile.mkdtemp(prefix='bench-search-'))
+    import logging
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    rng = random.Random(42)
+    documents = [make_document(rng, args.doc_chars) for _ in range(args.docs)]
+    chars = sum(len(text) for text in documents)
+    task_ids = [app.task_id_generator.new_id() for _ in range(max(1, args.docs // 20))]
+    for task_id in task_ids:  # 查询结果只包含存在的任务
+        app.task_index.add({'id': task_id, 'prompt': 'search bench', 'status': 'completed', 'created_at': time.time()})
+
+    def submit_all(index):
+        for i, text in enumerate(documents):
+            index.submit('put', task_ids[i % len(task_ids)], 'file', f'docs/file-{i}.md', text)
+
+    index = app.SearchIndex(app.task_index, app.task_executors, batch_interval=3600)  # 只由本脚本调用 flush
+    started = time.perf_counter()
+    submit_all(index)
+    submit_us = (time.perf_counter() - started) / args.docs * 1e6
+    started = time.perf_counter()
+    index.flush()
+    seconds = time.perf_counter() - started
+    print(f"docs={args.docs} chars={chars}")
+    print(f"submit {submit_us:.2f} us/op; indexing {args.docs / seconds:.0f} docs/s, "
+          f"{chars / seconds / 1e6:.2f}M chars/s ({seconds:.2f}s)")
+
+    for label, query in (('term', 'checkpoint'), ('prefix', 'snap*'), ('phrase', '"stream export"'),
+                         ('chinese', '"任务"')):
+        started = time.perf_counter()
+        for _ in range(args.query_runs):
+            hits = index.search(query)
+        elapsed = (time.perf_counter() - started) / args.query_runs
+        print(f"query {label:8} {elapsed * 1000:8.2f} ms  hits={len(hits)}")
+
+    idle = channel_latency(app, None, 2.0)
+    busy_index = app.SearchIndex(app.task_index, app.task_executors, batch_interval=3600)
+    submit_all(busy_index)
+    during = channel_latency(app, busy_index.flush, 0)
+    for label, values in (('idle', idle), ('indexing', during)):
+        print(f"publish->receive {label:8} p50={percentile(values, 0.5) * 1000:.3f} ms "
+              f"p99={percentile(values, 0.99) * 1000:.3f} ms samples={len(values)}")
+
+
+if __name__ == '__main__':
+    main()
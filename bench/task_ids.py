@@ -0,0 +1,88 @@
+"""
+任务ID和活动ID基准与并发检查
+
+1. 微基准：TaskIdGenerator.new_id 与 uuid.uuid4 / uuid.uuid1 的单次耗时
+2. 并发唯一性：--threads 个线程各生成 --per-thread 个任务ID，检查全部唯一、
+   每个线程内严格递增（字典序即创建顺序）
+3. 活动ID：--threads 个线程并发调用同一执行器的 emit_activity，检查活动ID互不重复
+
+检查失败时以非零状态退出，可在CI中运行。
+
+用法:
+    python bench/task_ids.py [--threads 16] [--per-thread 20000] [--iterations 200000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from threading import Barrier, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_threads(count: int, target):
+    """同时启动 count 个线程执行 target(线程序号)，返回各线程的结果"""
+    results = [None] * count
+    barrier = Barrier(count)
+
+    def worker(index):
+        barrier.wait()
+        results[index] = target(index)
+
+    threads = [Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16, help='并发线程数')
+    parser.add_argument('--per-thread', type=int, default=20000, help='每个线程生成的ID数')
+    parser.add_argument('--iterations', type=int, default=200000, help='微基准的调用次数')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TASK_STORE_DIR', tempfile.mkdtemp(prefix='bench-ids-'))
+    import logging
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    generator = app.TaskIdGenerator()
+    for name, fn in (('new_id', generator.new_id), ('uuid4', uuid.uuid4), ('uuid1', uuid.uuid1)):
+        seconds = timeit.timeit(fn, number=args.iterations)
+        print(f"{name:8} {seconds / args.iterations * 1e6:6.2f} us/id")
+
+    failures = []
+    batches = run_threads(args.threads, lambda _: [generator.new_id() for _ in range(args.per_thread)])
+    total = sum(len(batch) for batch in batches)
+    unique = len(set(id_ for batch in batches for id_ in batch))
+    ordered = all(batch == sorted(batch) and len(set(batch)) == len(batch) for batch in batches)
+    print(f"task ids: {total} generated by {args.threads} threads, {unique} unique, "
+          f"per-thread order {'ok' if ordered else 'BROKEN'}")
+    if unique != total:
+        failures.append('duplicate task ids')
+    if not ordered:
+        failures.append('task ids not increasing within a thread')
+
+    executor = app.SimpleTaskExecutor(generator.new_id(), 'activity id check')
+    per_thread = max(1, args.per_thread // 4)
+    activity_batches = run_threads(
+        args.threads, lambda i: [executor.emit_activity('thinking', f'thread {i}') for _ in range(per_thread)])
+    activity_ids = [activity_id for batch in activity_batches for activity_id in batch]
+    print(f"activity ids: {len(activity_ids)} emitted concurrently, {len(set(activity_ids))} unique, "
+          f"log has {len(executor.execution_log)} records")
+    if len(set(activity_ids)) != len(activity_ids) or len(executor.execution_log) != len(activity_ids):
+        failures.append('duplicate activity ids')
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+任务检查点
+
+CheckpointStore 在步骤边界把执行器状态写入任务目录，进程重启后由 app 从中恢复未完成的任务。
+模块只依赖标准库，任务索引由 app 创建存储时传入。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from threading import Lock
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path: str, data: Dict[str, Any]):
+    """先写临时文件再替换，进程在写入中途退出时不会留下不完整的文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class CheckpointStore:
+    """
+    步骤级检查点
+    执行器每进入一个步骤前把任务记录和执行进度写入 <root>/<task_id>/checkpoint.json，
+    此时之前的步骤（含其文件和终端输出）都已完成；任务结束时删除。
+    进程崩溃或重启后，仍有检查点的任务从最后完成的步骤之后继续执行。
+
+    内存中的文件内容按哈希写入 <root>/<task_id>/checkpoint/ 目录，检查点只记录哈希；
+    内容对象与上次写入时相同（字符串不可变，同一对象即内容未变）的文件不再重复写入，
+    每步的开销只与本步修改的文件有关。磁盘文件按路径引用而不复制，步骤重新执行时会再次写入同名文件
+    """
+
+    FILENAME = 'checkpoint.json'
+    BLOB_DIR = 'checkpoint'
+    LOCK_FILENAME = 'resume.lock'
+
+    def __init__(self, root: str, tasks, enabled: bool = True):
+        """
+        Args:
+            root: 任务存储目录，检查点写在各任务的子目录中
+            tasks: 任务索引（按 get(task_id) 取任务记录），检查点同时保存任务记录
+            enabled: 为False时不写入也不恢复检查点
+        """
+        self.root = root
+        self.tasks = tasks
+        self.enabled = enabled
+        self.written = 0
+        self.write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.resumed = 0
+        self.blob_bytes = 0  # 累计写入的文件内容字节数
+        self._blobs: Dict[str, Dict[str, Tuple[str, str]]] = {}  # task_id -> {文件名: (内容, 哈希)}
+        self._claims: Dict[str, int] = {}  # task_id -> 持有恢复锁的文件描述符
+        self._lock = Lock()
+
+    def path(self, task_id: str) -> str:
+        return os.path.join(self.root, task_id, self.FILENAME)
+
+    def _blob_path(self, task_id: str, digest: str) -> str:
+        return os.path.join(self.root, task_id, self.BLOB_DIR, digest)
+
+    def _write_blobs(self, task_id: str, inline: Dict[str, str]) -> Dict[str, Tuple[str, str]]:
+        """写入内容有变化的文件，返回 {文件名: (内容, 哈希)}"""
+        known = self._blobs.get(task_id, {})
+        current = {}
+        for filename, content in inline.items():
+            cached = known.get(filename)
+            if cached is not None and cached[0] is content:
+                current[filename] = cached
+                continue
+            data = content.encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()
+            path = self._blob_path(task_id, digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(data)
+                os.replace(f"{path}.tmp", path)
+                self.blob_bytes += len(data)
+            current[filename] = (content, digest)
+        return current
+
+    def save(self, executor: 'TaskExecutor') -> bool:
+        """
+        写入执行器当前状态
+
+        Returns:
+            是否已写入（未开启或任务记录已被清理时返回False）
+        """
+        if not self.enabled:
+            return False
+        record = self.tasks.get(executor.task_id)
+        if record is None:
+            return False
+        task_id = executor.task_id
+        started = time.perf_counter()
+        state = executor.to_state()
+        with self._lock:
+            current = self._write_blobs(task_id, state['files']['inline'])
+            state['files'] = {'inline_blobs': {name: digest for name, (_, digest) in current.items()},
+                              'spilled': state['files']['spilled']}
+            write_json_atomic(self.path(task_id), {'record': record, 'executor': state, 'saved_at': time.time()})
+            # 新检查点已替换旧检查点，删除不再引用的内容
+            referenced = {digest for _, digest in current.values()}
+            for _, digest in self._blobs.get(task_id, {}).values():
+                if digest not in referenced:
+                    try:
+                        os.remove(self._blob_path(task_id, digest))
+                    except FileNotFoundError:
+                        pass
+            self._blobs[task_id] = current
+        elapsed = time.perf_counter() - started
+        self.written += 1
+        self.write_seconds += elapsed
+        self.max_write_seconds = max(self.max_write_seconds, elapsed)
+        return True
+
+    def remove(self, task_id: str):
+        with self._lock:
+            self._blobs.pop(task_id, None)
+            try:
+                os.remove(self.path(task_id))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(os.path.join(self.root, task_id, self.BLOB_DIR), ignore_errors=True)
+        self.release(task_id)
+
+    def claim(self, task_id: str) -> bool:
+        """
+        独占一个待恢复的任务：对 <root>/<task_id>/resume.lock 加非阻塞的进程级文件锁，
+        持有到任务结束（remove）或 release；进程退出（包括崩溃）时由系统释放。
+        开发服务器的重载进程、误开的多个进程同时启动时，每个检查点只会被其中一个恢复
+
+        Returns:
+            是否取得（其他进程已持有时返回False）
+        """
+        path = os.path.join(self.root, task_id, self.LOCK_FILENAME)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return False
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        with self._lock:
+            self._claims[task_id] = fd
+        return True
+
+    def release(self, task_id: str):
+        """释放 claim 取得的恢复锁（关闭文件即解锁）"""
+        with self._lock:
+            fd = self._claims.pop(task_id, None)
+        if fd is None:
+            return
+        try:
+            os.remove(os.path.join(self.root, task_id, self.LOCK_FILENAME))
+        except OSError:
+            pass
+        os.close(fd)
+
+    def _load_blobs(self, task_id: str, files: Dict[str, Any]) -> Dict[str, Any]:
+        """把检查点中的内容哈希还原为 TaskFileStore.to_state() 的格式"""
+        inline = {}
+        for filename, digest in files.get('inline_blobs', {}).items():
+            try:
+                with open(self._blob_path(task_id, digest), 'r', encoding='utf-8') as f:
+                    inline[filename] = f.read()
+            except OSError:
+                logger.warning(f"Checkpointed content of {filename} in task {task_id} is missing")
+        return {'inline': inline, 'spilled': files.get('spilled', {})}
+
+    def pending(self) -> List[str]:
+        """有遗留检查点的任务ID（即创建时间顺序）"""
+        if not self.enabled or not os.path.isdir(self.root):
+            return []
+        return [task_id for task_id in sorted(os.listdir(self.root)) if os.path.isfile(self.path(task_id))]
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务的检查点，不存在（已被其他进程恢复并完成）或无法解析时返回None"""
+        path = self.path(task_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            state = checkpoint['executor']
+            state['files'] = self._load_blobs(task_id, state['files'])
+            return checkpoint
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'written': self.written,
+            'avg_write_ms': round(self.write_seconds / self.written * 1000, 3) if self.written else None,
+            'max_write_ms': round(self.max_write_seconds * 1000, 3),
+            'content_bytes_written': self.blob_bytes,
+            'resumed': self.resumed
+        }
@@ -1279,7 +1279,7 @@ export const ComputerView = forwardRef<ComputerViewRef, ComputerViewProps>(({
               <span>Terminal</span>
               {terminalOutput.length > 0 && (
                 <span className="text-xs bg-blue-100/80 text-blue-700 px-1 py-0.5 rounded-full">
-                  {Math.floor(terminalOutput.length / 2)}
+                  {terminalOutput.filter(line => line.startsWith('$ ')).length}
                 </span>
               )}
             </Button>
@@ -0,0 +1,50 @@
+"""
+CPU密集型任务
+
+这里的函数既可以在请求线程中直接调用，也可以由 app.ProcessLane 提交到进程池执行。
+模块只依赖标准库，工作进程反序列化任务时只需导入本模块。
+
+大块输入通过共享内存传递：调用方把数据写入一个 SharedMemory 块，
+成员以 (偏移量, 长度) 引用其中的切片，工作进程直接从共享内存读取，不经过pickle复制。
+"""
+
+from typing import Any, List, Optional, Tuple
+
+# 导出成员: (压缩包内路径, 类型, 值)
+#   'path' - 值为磁盘文件路径，按块流式压缩
+#   'data' - 值为 str 或 bytes
+#   'shm'  - 值为 (偏移量, 长度)，引用共享内存块中的数据
+ZipMember = Tuple[str, str, Any]
+
+
+def write_zip(output, members: List[ZipMember], shm_name: Optional[str] = None) -> int:
+    """
+    按成员列表生成ZIP（DEFLATE压缩）
+
+    Args:
+        output: 可写文件对象或文件路径
+        members: 导出成员列表
+        shm_name: 'shm' 类型成员所在的共享内存块名
+
+    Returns:
+        写入的成员数
+    """
+    import zipfile
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name) if shm_name else None
+    try:
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for arcname, kind, value in members:
+                if kind == 'path':
+                    zip_file.write(value, arcname)
+                elif kind == 'shm':
+                    offset, length = value
+                    with shm.buf[offset:offset + length] as view:
+                        zip_file.writestr(arcname, view)
+                else:
+                    zip_file.writestr(arcname, value)
+        return len(members)
+    finally:
+        if shm is not None:
+            shm.close()
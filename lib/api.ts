@@ -1,9 +1,12 @@
 // lib/api.ts
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 
 // 可以通过环境变量或简单修改这里来切换后端
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:5000/api';
 
+// 执行器配置：full 为完整多媒体流程，simple 为简化的固定消息序列（见 switch-backend.js）
+const EXECUTOR_PROFILE = process.env.NEXT_PUBLIC_EXECUTOR_PROFILE || 'full';
+
 export interface Activity {
   id: number;
   text: string;
@@ -24,7 +27,7 @@ export interface FileStructureNode {
 }
 
 export interface StreamMessage {
-  type: 'activity' | 'activity_update' | 'file_update' | 'task_update' | 'terminal' | 'heartbeat' | 'connection_close' | 'error' | 'file_structure_update';
+  type: 'activity' | 'activity_update' | 'file_update' | 'file_chunk' | 'task_update' | 'terminal' | 'terminal_chunk' | 'heartbeat' | 'connection_close' | 'error' | 'file_structure_update' | 'resync' | 'state_snapshot';
   data?: any;
   reason?: string;
   message?: string;
@@ -38,17 +41,57 @@ export interface TaskResponse {
 export interface FileUpdate {
   filename: string;
   content: string;
+  media_url?: string;  // URL形式的媒体文件在后端媒体缓存中的地址
 }
 
-export class ApiService {
-  async createTask(prompt: string, attachments: File[] = []): Promise<TaskResponse> {
-    const formData = new FormData();
-    formData.append('prompt', prompt);
+// 大文件按连接的 chunk 参数拆成的分段：content 为第 index 段（共 count 段），其余字段与 file_update 相同
+export interface FileChunk extends FileUpdate {
+  index: number;
+  count: number;
+}
 
-    attachments.forEach((file, index) => {
-      formData.append(`attachment_${index}`, file);
-    });
+// 命令执行期间分批发送的终端输出，同一命令的所有分段 command_id 相同
+export interface TerminalChunk {
+  command_id: number;
+  command: string;
+  stream: 'stdout' | 'stderr';
+  output: string;
+}
+
+// 把一段输出追加到终端行列表；continueLine 为 true 时第一段接在最后一行之后（上一段没有以换行结束）
+const appendTerminalText = (lines: string[], text: string, continueLine: boolean): string[] => {
+  if (!text) return lines;
+  const pieces = text.split('\n');
+  const next = [...lines];
+  if (continueLine && next.length > 0) {
+    next[next.length - 1] += pieces[0];
+  } else {
+    next.push(pieces[0]);
+  }
+  next.push(...pieces.slice(1, -1));
+  if (pieces.length > 1 && pieces[pieces.length - 1]) {
+    next.push(pieces[pieces.length - 1]);
+  }
+  return next;
+};
+
+// 后端返回的媒体路径（/api/media/<hash>）转换为完整URL
+export const resolveMediaUrl = (mediaPath: string): string =>
+  API_BASE_URL.replace(/\/api\/?$/, '') + mediaPath;
+
+export interface UploadStatus {
+  upload_id?: string;
+  filename: string;
+  size: number;
+  offset?: number;
+  status: 'pending' | 'complete';
+  chunk_size?: number;
+  sha256?: string;
+  deduplicated?: boolean;
+}
 
+export class ApiService {
+  async createTask(prompt: string, attachments: File[] = []): Promise<TaskResponse> {
     const response = await fetch(`${API_BASE_URL}/tasks`, {
       method: 'POST',
       headers: {
@@ -56,7 +99,8 @@ export class ApiService {
       },
       body: JSON.stringify({
         prompt,
-        attachments: attachments.map(f => f.name)
+        attachments: attachments.map(f => f.name),
+        profile: EXECUTOR_PROFILE
       })
     });
 
@@ -64,11 +108,65 @@ export class ApiService {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
 
-    return response.json();
+    const task: TaskResponse = await response.json();
+    // 任务连接前上传附件，执行器可以在任务文件的 attachments/ 下读取
+    for (const file of attachments) {
+      await this.uploadAttachment(task.task_id, file);
+    }
+    return task;
+  }
+
+  // 分块续传附件：每块从服务端确认的偏移量开始发送，失败时查询偏移量后重试
+  async uploadAttachment(taskId: string, file: File, maxRetries: number = 3): Promise<UploadStatus> {
+    const createResponse = await fetch(`${API_BASE_URL}/tasks/${taskId}/attachments`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!createResponse.ok) {
+      throw new Error(`Failed to start upload of ${file.name}: ${createResponse.status}`);
+    }
+
+    let upload: UploadStatus = await createResponse.json();
+    const uploadUrl = `${API_BASE_URL}/tasks/${taskId}/attachments/${upload.upload_id}`;
+    let retries = 0;
+
+    while (upload.status !== 'complete') {
+      const offset = upload.offset ?? 0;
+      const chunk = file.slice(offset, offset + (upload.chunk_size ?? 4 * 1024 * 1024));
+      try {
+        const chunkResponse = await fetch(uploadUrl, {
+          method: 'PATCH',
+          headers: {
+            'Content-Type': 'application/octet-stream',
+            'Upload-Offset': String(offset),
+          },
+          body: chunk
+        });
+        if (!chunkResponse.ok && chunkResponse.status !== 409) {
+          throw new Error(`Upload of ${file.name} failed: ${chunkResponse.status}`);
+        }
+        // 409 表示偏移量不一致，重新查询服务端已接收的字节数
+        upload = chunkResponse.status === 409
+          ? await (await fetch(uploadUrl)).json()
+          : { ...upload, ...(await chunkResponse.json()) };
+        retries = 0;
+      } catch (err) {
+        if (++retries > maxRetries) {
+          throw err;
+        }
+        upload = await (await fetch(uploadUrl)).json();
+      }
+    }
+
+    return upload;
   }
 
-  async connectTask(taskId: string): Promise<Response> {
-    const response = await fetch(`${API_BASE_URL}/tasks/${taskId}/connect`, {
+  // snapshot: 先接收任务当前状态的快照，不重放完整历史
+  async connectTask(taskId: string, since: number = 0, snapshot: boolean = true): Promise<Response> {
+    const response = await fetch(`${API_BASE_URL}/tasks/${taskId}/connect?since=${since}&snapshot=${snapshot ? 1 : 0}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -135,7 +233,7 @@ export class ApiService {
   }
 
   // 🆕 新增：获取文件内容
-  async getFileContent(taskId: string, filename: string): Promise<{ success: boolean; content?: string; message?: string }> {
+  async getFileContent(taskId: string, filename: string): Promise<{ success: boolean; content?: string; encoding?: 'utf-8' | 'base64'; message?: string }> {
     const response = await fetch(`${API_BASE_URL}/tasks/${taskId}/files/${encodeURIComponent(filename)}`, {
       method: 'GET',
     });
@@ -184,6 +282,17 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
   const [isConnected, setIsConnected] = useState(false);
   const [terminalOutput, setTerminalOutput] = useState<string[]>([]);
   const [fileStructure, setFileStructure] = useState<FileStructureNode | null>(null);
+  // 终端分块输出的进度：正在输出的命令ID，以及最后一行尚未换行时所属的命令ID
+  const terminalCommandRef = useRef<number | null>(null);
+  const openLineRef = useRef<number | null>(null);
+  // 正在接收的 file_chunk 分段，按文件名保存
+  const fileChunksRef = useRef<Map<string, string[]>>(new Map());
+
+  const showFile = (fileUpdate: FileUpdate) => {
+    setCurrentFile(fileUpdate.filename);
+    // 媒体文件优先使用后端缓存副本，避免每个浏览器各自请求源站
+    setFileContent(fileUpdate.media_url ? resolveMediaUrl(fileUpdate.media_url) : fileUpdate.content);
+  };
 
   const handleMessage = useCallback((message: StreamMessage) => {
     console.log('收到消息:', message.type, message);
@@ -205,9 +314,25 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
         const fileUpdate = message.data as FileUpdate;
         // 🔧 简化：直接使用后端发送的文件名，不做任何路径处理
         console.log('File update - 文件名:', fileUpdate.filename, '内容长度:', fileUpdate.content?.length || 0);
-        setCurrentFile(fileUpdate.filename);
-        setFileContent(fileUpdate.content);
+        showFile(fileUpdate);
+        break;
+
+      case 'file_chunk': {
+        // 按文件名收集分段，收到最后一段后作为一次 file_update 显示
+        const fileChunk = message.data as FileChunk;
+        const chunks = fileChunksRef.current;
+        if (fileChunk.index === 0 || !chunks.has(fileChunk.filename)) {
+          chunks.set(fileChunk.filename, []);
+        }
+        const parts = chunks.get(fileChunk.filename)!;
+        parts[fileChunk.index] = fileChunk.content;
+        if (fileChunk.index === fileChunk.count - 1) {
+          chunks.delete(fileChunk.filename);
+          const { index, count, ...fileUpdate } = fileChunk;
+          showFile({ ...fileUpdate, content: parts.join('') });
+        }
         break;
+      }
 
       case 'file_structure_update':
         // 🔧 直接使用后端的文件结构
@@ -222,18 +347,68 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
         }
         break;
 
-      case 'terminal':
-        setTerminalOutput(prev => [
-          ...prev,
-          `$ ${message.data.command}`,
-          message.data.output
-        ]);
+      case 'terminal_chunk': {
+        // 同一命令的输出按 command_id 接续，换了命令时先输出命令行
+        const chunk = message.data as TerminalChunk;
+        const newCommand = terminalCommandRef.current !== chunk.command_id;
+        if (newCommand) {
+          terminalCommandRef.current = chunk.command_id;
+          openLineRef.current = null;
+        }
+        const continueLine = openLineRef.current === chunk.command_id;
+        if (chunk.output) {
+          openLineRef.current = chunk.output.endsWith('\n') ? null : chunk.command_id;
+        }
+        setTerminalOutput(prev => appendTerminalText(
+          newCommand ? [...prev, `$ ${chunk.command}`] : prev, chunk.output, continueLine));
         break;
+      }
+
+      case 'terminal': {
+        // 命令结束；streamed 时输出已经由 terminal_chunk 发送过
+        const data = message.data;
+        const streamedCommand = terminalCommandRef.current;
+        openLineRef.current = null;
+        if (!data.streamed) {
+          terminalCommandRef.current = null;
+          setTerminalOutput(prev => appendTerminalText([...prev, `$ ${data.command}`], data.output, false));
+        } else if (streamedCommand !== data.command_id) {
+          // 没有任何输出的命令
+          setTerminalOutput(prev => [...prev, `$ ${data.command}`]);
+        }
+        break;
+      }
 
       case 'heartbeat':
         setError(null);
         break;
 
+      case 'state_snapshot': {
+        // 任务当前状态，之后只接收快照之后的消息
+        const state = message.data;
+        setActivities(state.activities as Activity[]);
+        setCurrentFile(state.file?.filename ?? '');
+        setFileContent(state.file ? (state.file.media_url ? resolveMediaUrl(state.file.media_url) : state.file.content) : '');
+        setTaskStatus(state.task.status ?? 'idle');
+        setError(state.task.error ?? null);
+        setTerminalOutput(state.terminal);
+        setFileStructure(state.file_structure as FileStructureNode | null);
+        terminalCommandRef.current = null;
+        openLineRef.current = null;
+        fileChunksRef.current.clear();
+        break;
+      }
+
+      case 'resync':
+        // 积压过多时后端跳过了部分消息，从任务详情重新获取文件结构
+        console.warn('消息流重新同步:', message.data?.reason ?? (message as any).reason);
+        if (taskId) {
+          apiService.getTask(taskId)
+            .then(task => task.file_structure && setFileStructure(task.file_structure as FileStructureNode))
+            .catch(err => console.error('重新同步失败:', err));
+        }
+        break;
+
       case 'error':
         setError(message.message || '未知错误');
         setIsConnected(false);
@@ -242,7 +417,7 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
       default:
         console.log('未知消息类型:', message.type);
     }
-  }, []);
+  }, [taskId]);
 
   useEffect(() => {
     if (!taskId) return;
@@ -296,10 +471,10 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
 
                 if (message.type === 'task_update' && 
                     message.data?.status && 
-                    ['completed', 'failed'].includes(message.data.status)) {
+                    ['completed', 'failed', 'cancelled'].includes(message.data.status)) {
+                  // 结束通知可能越过积压的文件消息提前到达，服务器发送完剩余消息后关闭连接
                   console.log('任务完成，状态:', message.data.status);
                   setIsConnected(false);
-                  return;
                 }
               } catch (parseError) {
                 console.error('解析消息失败:', parseError, '原始内容:', line);
@@ -316,7 +491,7 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
           return;
         }
 
-        if (taskStatus !== 'completed' && taskStatus !== 'failed') {
+        if (taskStatus !== 'completed' && taskStatus !== 'failed' && taskStatus !== 'cancelled') {
           setError('连接失败: ' + fetchError.message);
         }
         setIsConnected(false);
@@ -337,7 +512,7 @@ export function useTaskStream(taskId: string | null): UseTaskStreamResult {
   }, [taskId, handleMessage, taskStatus]);
 
   useEffect(() => {
-    if (taskStatus === 'completed' || taskStatus === 'failed') {
+    if (taskStatus === 'completed' || taskStatus === 'failed' || taskStatus === 'cancelled') {
       setError(null);
       
       const timer = setTimeout(() => {
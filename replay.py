@@ -0,0 +1,188 @@
+"""
+Resear Pro 消息流回放驱动
+
+把录制的消息流（GET /api/recordings/<task_id> 下载的 .ndjson.gz）上传到服务器，
+按原始节奏或加速回放为N个并发任务，同时以N个客户端连接 /connect 接收，统计流式链路的表现。
+回放不运行执行器，结果只取决于消息通道、序列化和网络写出，适合对比序列化或批量发送等改动。
+
+用法:
+    python replay.py trace.ndjson.gz --speed 10 --copies 20
+    python replay.py trace.ndjson.gz --speed max --copies 50 --label batching --output b.json
+    python replay.py compare a.json b.json
+
+参数:
+    --server    服务器地址，默认 http://localhost:5000
+    --speed     1 为原始节奏，10 为10倍速，max 为不等待
+    --copies    并发回放的任务数（每个任务一个客户端连接）
+    --queue-policy  回放任务的积压处理策略，默认 block：每个客户端收到与录制相同的消息序列
+    --label     写入结果的标签
+    --output    把结果写入JSON文件，供 compare 对比
+
+统计项:
+    first_message_ms  连接到收到第一条消息的时间
+    lag_ms            每条消息相对录制节奏的延迟（到达时间 - 录制时间/速度，以第一条消息对齐），speed=max 时不统计
+    throughput        所有流合计的消息数/秒和字节数/秒
+    incomplete        收到的消息数与录制不一致的流数；不为0时以状态码1退出
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+import urllib.request
+from threading import Thread
+
+COMPARE_KEYS = ('messages', 'bytes', 'wall_seconds', 'messages_per_second', 'mb_per_second',
+                'first_message_ms.p50', 'first_message_ms.p99', 'lag_ms.p50', 'lag_ms.p99', 'lag_ms.max', 'incomplete', 'errors')
+
+
+def load_schedule(data: bytes):
+    """读取录制中每条消息的发出时间（秒），按消息顺序排列"""
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    lines = data.decode('utf-8').splitlines()
+    meta = json.loads(lines[0])
+    schedule = [json.loads(line)['t'] / 1000 for line in lines[1:] if '"type"' in line]
+    return meta, schedule
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(p * (len(values) - 1) + 0.5), len(values) - 1)], 3)
+
+
+def consume(server: str, task_id: str, result: dict):
+    """连接一个回放任务并记录每条消息的到达时间，直到服务器结束流（结束通知之后可能还有积压的消息）"""
+    started = time.perf_counter()
+    request = urllib.request.Request(f"{server}/api/tasks/{task_id}/connect", data=b'', method='POST')
+    arrivals = []
+    size = 0
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            for line in response:
+                arrived = time.perf_counter() - started
+                size += len(line)
+                message = json.loads(line)
+                if message.get('type') in ('heartbeat', 'resync', 'state_snapshot') or 'sequence' not in message:
+                    continue
+                arrivals.append((message['sequence'], arrived))
+    except Exception as e:
+        result['error'] = str(e)
+    result['arrivals'] = arrivals
+    result['bytes'] = size
+
+
+def run(args) -> dict:
+    with open(args.trace, 'rb') as f:
+        data = f.read()
+    meta, schedule = load_schedule(data)
+    speed = 0.0 if args.speed == 'max' else float(args.speed)
+
+    request = urllib.request.Request(
+        f"{args.server}/api/replays?speed={speed}&copies={args.copies}&queue_policy={args.queue_policy}",
+        data=data, method='POST',
+        headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        task_ids = json.load(response)['task_ids']
+
+    results = [{} for _ in task_ids]
+    threads = [Thread(target=consume, args=(args.server, task_id, result), daemon=True)
+               for task_id, result in zip(task_ids, results)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    first_message = []
+    lags = []
+    messages = 0
+    total_bytes = 0
+    incomplete = 0
+    for result in results:
+        arrivals = result.get('arrivals', [])
+        messages += len(arrivals)
+        # 重连时提前收到的控制消息可能重复，按序号去重
+        if len({seq for seq, _ in arrivals}) != len(schedule):
+            incomplete += 1
+        total_bytes += result.get('bytes', 0)
+        if not arrivals:
+            continue
+        first_message.append(arrivals[0][1] * 1000)
+        if speed > 0:
+            # 以第一条消息对齐，比较之后每条消息的到达时间与录制节奏
+            first_seq, first_at = arrivals[0]
+            for seq, at in arrivals:
+                if seq < len(schedule):
+                    expected = (schedule[seq] - schedule[first_seq]) / speed
+                    lags.append((at - first_at - expected) * 1000)
+
+    return {
+        'label': args.label,
+        'source_task_id': meta.get('task_id'),
+        'recorded_messages': len(schedule),
+        'speed': args.speed,
+        'queue_policy': args.queue_policy,
+        'copies': len(task_ids),
+        'messages': messages,
+        'bytes': total_bytes,
+        'wall_seconds': round(wall, 3),
+        'messages_per_second': round(messages / wall, 1) if wall else None,
+        'mb_per_second': round(total_bytes / wall / 1e6, 3) if wall else None,
+        'first_message_ms': {'p50': percentile(first_message, 0.5), 'p99': percentile(first_message, 0.99)},
+        'lag_ms': {'p50': percentile(lags, 0.5), 'p99': percentile(lags, 0.99),
+                   'max': round(max(lags), 3) if lags else None},
+        'incomplete': incomplete,
+        'errors': sum(1 for result in results if 'error' in result)
+    }
+
+
+def lookup(summary: dict, key: str):
+    value = summary
+    for part in key.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(paths):
+    summaries = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            summaries.append(json.load(f))
+    labels = [summary.get('label') or path for summary, path in zip(summaries, paths)]
+    print(f"{'metric':24s}" + ''.join(f"{label:>16s}" for label in labels))
+    for key in COMPARE_KEYS:
+        print(f"{key:24s}" + ''.join(f"{str(lookup(summary, key)):>16s}" for summary in summaries))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        compare(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description='Replay a recorded task stream against a server')
+    parser.add_argument('trace')
+    parser.add_argument('--server', default='http://localhost:5000')
+    parser.add_argument('--speed', default='1')
+    parser.add_argument('--copies', type=int, default=1)
+    parser.add_argument('--queue-policy', default='block', choices=('block', 'coalesce', 'drop'))
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    summary = run(args)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    if summary['incomplete']:
+        print(f"{summary['incomplete']} of {summary['copies']} streams did not receive all "
+              f"{summary['recorded_messages']} recorded messages", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
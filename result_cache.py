@@ -0,0 +1,217 @@
+"""
+结果缓存
+
+ResultCache 以规范化的请求为键保存已完成任务的消息序列和最终文件，相同请求在新任务中回放；
+磁盘文件以硬链接（link_or_copy）引用而不读入内存。
+模块只依赖标准库，缓存目录、大小上限和版本由 app 创建缓存时传入。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(path: str, dest: str):
+    """以硬链接把文件放到 dest（内容共享、不读取），不支持硬链接的文件系统上复制；先写临时名再替换"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = f"{dest}.tmp"
+    try:
+        os.link(path, tmp_path)
+    except FileExistsError:  # 上次中断遗留的临时文件
+        os.remove(tmp_path)
+        link_or_copy(path, dest)
+        return
+    except OSError:
+        shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+class ResultCache:
+    """
+    已完成任务的结果缓存
+
+    以规范化的 (prompt, attachments, profile, version) 哈希为键，保存原任务发送的消息序列、
+    最终文件、文件结构和执行日志；相同请求再次提交时在新任务ID下回放，不再执行任务流程。
+    总大小超过上限时按LRU淘汰
+
+    内存中的小文件以字符串保存；磁盘上的文件和录制中按路径引用的大文件内容（见 TaskExecutor._record）
+    以硬链接放入 <root>/<条目目录>/，条目中只记录路径，不读入内存。命中时再链接到新任务的目录，
+    之后淘汰条目不影响正在回放的任务。缓存只在进程内有效，首次写入时清空上次运行遗留的目录
+    """
+
+    MESSAGE_OVERHEAD = 256  # 每条消息的估算字节数（不含文件内容）
+
+    def __init__(self, max_bytes: int, root: str, version: str = '1'):
+        """
+        Args:
+            max_bytes: 缓存总大小上限
+            root: 缓存的磁盘文件目录
+            version: 执行器输出变化时递增，使旧缓存失效
+        """
+        self.max_bytes = max_bytes
+        self.root = root
+        self.version = version
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = Lock()
+        self._prepared = False
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, prompt: str, attachments: list, profile: str) -> str:
+        """规范化请求：提示词折叠空白，附件按序列化结果排序"""
+        normalized = {
+            'prompt': ' '.join(prompt.split()),
+            'attachments': sorted(json.dumps(a, sort_keys=True, ensure_ascii=False) for a in attachments),
+            'profile': profile,
+            'version': self.version
+        }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _link_files(entry: Dict[str, Any], directory: str) -> Dict[str, Any]:
+        """
+        把条目引用的磁盘文件硬链接到 directory，返回路径改写后的条目副本
+
+        Raises:
+            OSError: 源文件已不存在或无法写入
+        """
+        files = None
+        if entry['files'] is not None:
+            files = {}
+            for filename, content in entry['files'].items():
+                if isinstance(content, dict):
+                    dest = os.path.join(directory, f"f{len(files)}")
+                    link_or_copy(content['path'], dest)
+                    content = {'path': dest, 'size': content['size']}
+                files[filename] = content
+        messages = []
+        for msg_type, data, at in entry['messages']:
+            if 'content_path' in data:
+                dest = os.path.join(directory, f"m{len(messages)}")
+                link_or_copy(data['content_path'], dest)
+                data = {**data, 'content_path': dest}
+            messages.append((msg_type, data, at))
+        return {**entry, 'files': files, 'messages': messages, 'dir': directory}
+
+    def _discard(self, entry: Dict[str, Any]):
+        shutil.rmtree(entry['dir'], ignore_errors=True)
+
+    def get(self, key: str, directory: str) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存条目
+
+        Args:
+            directory: 命中时条目的磁盘文件链接到该目录（新任务的目录，随任务清理删除）
+
+        Returns:
+            路径指向 directory 的条目副本，未命中返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                try:
+                    entry = self._link_files(entry, directory)
+                except OSError as e:
+                    logger.warning(f"Dropping cached result {key[:12]}: {e}")
+                    shutil.rmtree(directory, ignore_errors=True)
+                    evicted = self._entries.pop(key)
+                    self.total_bytes -= evicted['bytes']
+                    self._discard(evicted)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def store(self, key: str, executor: 'TaskExecutor', final: Optional[Tuple[str, Dict[str, Any]]] = None) -> bool:
+        """
+        保存已完成任务的结果
+
+        Args:
+            final: 尚未发送的最后一条消息 (类型, 数据)，追加到缓存的消息序列末尾
+
+        Returns:
+            是否已缓存（包含上传附件的任务不缓存，二进制内容无法按文本回放）
+        """
+        files = executor.all_files
+        if any(name.startswith('attachments/') for name in files):
+            return False
+        size = sum(files.size(name) for name in files)
+        recording = list(executor.recording or [])
+        if final is not None:
+            recording.append((*final, time.monotonic()))
+        entry_bytes = size + len(recording) * self.MESSAGE_OVERHEAD
+        if entry_bytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if not self._prepared:
+                shutil.rmtree(self.root, ignore_errors=True)
+                self._prepared = True
+        os.makedirs(self.root, exist_ok=True)
+        directory = tempfile.mkdtemp(prefix=f"{key[:16]}-", dir=self.root)
+        source = {
+            'messages': recording,
+            'files': {name: ({'path': files.spilled_path(name), 'size': files.size(name)}
+                             if files.is_spilled(name) else files[name]) for name in files}
+        }
+        try:
+            linked = self._link_files(source, directory)
+        except OSError as e:
+            logger.warning(f"Not caching result of task {executor.task_id}: {e}")
+            shutil.rmtree(directory, ignore_errors=True)
+            return False
+        entry = {
+            'key': key,
+            'source_task_id': executor.task_id,
+            'created_at': time.time(),
+            'messages': linked['messages'],
+            'files': linked['files'],
+            'execution_log': executor.execution_log.to_list(),
+            'media_refs': dict(executor.media_refs),
+            'bytes': entry_bytes,
+            'dir': directory
+        }
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous['bytes']
+                self._discard(previous)
+            self._entries[key] = entry
+            self.total_bytes += entry['bytes']
+            self.stores += 1
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted['bytes']
+                self._discard(evicted)
+                self.evictions += 1
+        logger.info(f"Cached result of task {executor.task_id} ({entry['bytes']} bytes)")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'total_bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'stores': self.stores,
+            'evictions': self.evictions
+        }
@@ -1,6 +1,9 @@
 # requirements.txt
 Flask==2.3.3
 Flask-CORS==4.0.0
+# 生产环境WSGI服务器（可选，serve.py 自动选用；都未安装时使用werkzeug）
+# gunicorn>=21.2   (Linux/macOS)
+# waitress>=2.1    (Windows)
 
 # package.json 需要添加的环境变量配置
 # 在你的 package.json 的 scripts 部分添加：
@@ -17,7 +20,7 @@ echo "启动 Manus Pro 全栈应用..."
 # 启动 Flask 后端
 echo "启动后端服务..."
 cd backend
-python app.py &
+python serve.py &
 BACKEND_PID=$!
 
 # 等待后端启动
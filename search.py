@@ -0,0 +1,398 @@
+"""
+全文搜索
+
+SearchIndex 是任务文件和执行日志的增量倒排索引：执行线程只提交操作，后台线程批量写入索引。
+模块只依赖标准库，任务索引、执行器和配置由 app 创建索引时传入。
+"""
+
+import bisect
+import itertools
+import logging
+import re
+import time
+from collections import deque
+from threading import Thread, Lock, RLock, Event
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndex:
+    """
+    任务文件和执行日志的增量倒排索引
+
+    文档以 (task_id, 类型, 名称) 标识：文件的名称为文件名，活动的名称为活动ID。
+    英文和数字按单词切分，中日韩文字按单字切分，倒排表记录词项在文档中的位置，
+    因此短语查询对中文同样适用。
+
+    执行线程只把操作追加到待处理队列（热路径上不做分词，文件只提交文件名），
+    由后台线程按批次合并后从执行器读取内容写入索引；查询结果相对任务进度最多延迟 batch_interval 秒。
+    索引不保存文档原文，摘要在查询时从执行器读取
+    """
+
+    TOKEN_PATTERN = re.compile(r'[0-9a-z_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+    QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+    PREFIX_EXPANSION = 200  # 前缀查询最多展开的词项数
+    SNIPPET_CHARS = 60  # 摘要中命中位置前后保留的字符数
+
+    def __init__(self, tasks, executors: Dict[str, Any], batch_interval: float = 0.5,
+                 max_doc_chars: int = 1024 * 1024, enabled: bool = True):
+        """
+        Args:
+            tasks: 任务索引（按 get(task_id) 取任务记录），查询时按任务状态过滤
+            executors: task_id -> 执行器，重命名和重建索引时从中读取文件和执行日志
+            batch_interval: 后台批量建索引的间隔（秒）
+            max_doc_chars: 每个文档只索引前N个字符
+            enabled: 为False时不接受索引操作
+        """
+        self.tasks = tasks
+        self.executors = executors
+        self.batch_interval = batch_interval
+        self.max_doc_chars = max_doc_chars
+        self.enabled = enabled
+        self._postings: Dict[str, Dict[int, List[int]]] = {}  # 词项 -> {文档ID: [位置]}
+        self._terms: List[str] = []  # 有序词项列表，用于前缀查询
+        self._docs: Dict[int, Tuple[str, str, Any]] = {}  # 文档ID -> (task_id, 类型, 名称)
+        self._doc_terms: Dict[int, List[str]] = {}  # 文档ID -> 包含的词项，删除文档时使用
+        self._doc_ids: Dict[Tuple[str, str, Any], int] = {}  # (task_id, 类型, 名称) -> 文档ID
+        self._task_docs: Dict[str, set] = {}  # task_id -> {文档ID}
+        self._next_doc_id = itertools.count(1)
+        self._lock = RLock()
+        self._pending: deque = deque()
+        self._wakeup = Event()
+        self._started = False
+        self._start_lock = Lock()
+        self.indexed_docs = 0
+        self.indexed_chars = 0
+        self.index_seconds = 0.0
+        self.batches = 0
+        self.superseded = 0
+
+    @classmethod
+    def token_spans(cls, text: str):
+        """逐个产出 (词项, 起始位置, 结束位置)"""
+        for match in cls.TOKEN_PATTERN.finditer(text.lower()):
+            yield match.group(), match.start(), match.end()
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    # ---------- 写入（执行线程调用，只入队） ----------
+
+    def submit(self, op: str, task_id: str, *args):
+        """
+        提交索引操作
+
+        Args:
+            op: put (类型, 名称, 文本) / index_file (文件名) / delete (类型, 名称) / rename (类型, 旧名称, 新名称)
+                / drop_task () / reindex_task ()；index_file、rename 和 reindex_task 在后台线程从执行器读取内容，
+                文件只读取开头 max_doc_chars 个字符
+        """
+        if not self.enabled:
+            return
+        self._pending.append((op, task_id, args))
+        if not self._started:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            Thread(target=self._run, name='search-indexer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.batch_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Search indexing failed: {e}")
+
+    def flush(self) -> int:
+        """
+        把待处理队列中的操作写入索引
+
+        同一批次内被后续 put 覆盖的 put 直接跳过
+
+        Returns:
+            处理的操作数
+        """
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        live = []
+        later_puts = set()
+        for op, task_id, args in reversed(batch):
+            if op in ('put', 'index_file'):
+                key = (task_id, args[0], args[1]) if op == 'put' else (task_id, 'file', args[0])
+                if key in later_puts:
+                    self.superseded += 1
+                    continue
+                later_puts.add(key)
+            live.append((op, task_id, args))
+
+        for op, task_id, args in reversed(live):
+            # 每个操作单独加锁，大文档建索引期间查询不会被长时间阻塞
+            with self._lock:
+                if op == 'put':
+                    self._put(task_id, *args)
+                elif op == 'delete':
+                    self._remove((task_id, *args))
+                elif op == 'drop_task':
+                    self._drop_task(task_id)
+            if op == 'index_file':
+                self._index_file(task_id, *args)
+            elif op == 'rename':
+                self._rename(task_id, *args)
+            elif op == 'reindex_task':
+                self._reindex_task(task_id)
+
+        self.batches += 1
+        self.index_seconds += time.perf_counter() - started
+        return len(batch)
+
+    # ---------- 索引维护（持有锁时调用） ----------
+
+    def _put(self, task_id: str, kind: str, name: Any, text: str):
+        key = (task_id, kind, name)
+        self._remove(key)
+        text = text[:self.max_doc_chars]
+        positions: Dict[str, List[int]] = {}
+        # finditer 逐个产出匹配，期间可以切换线程；findall 对大文档会长时间持有GIL
+        for pos, match in enumerate(self.TOKEN_PATTERN.finditer(text.lower())):
+            positions.setdefault(match.group(), []).append(pos)
+        if not positions:
+            return
+
+        doc_id = next(self._next_doc_id)
+        self._docs[doc_id] = key
+        self._doc_ids[key] = doc_id
+        self._doc_terms[doc_id] = list(positions)
+        self._task_docs.setdefault(task_id, set()).add(doc_id)
+        for term, term_positions in positions.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[doc_id] = term_positions
+        self.indexed_docs += 1
+        self.indexed_chars += len(text)
+
+    def _remove(self, key: Tuple[str, str, Any]):
+        doc_id = self._doc_ids.pop(key, None)
+        if doc_id is None:
+            return
+        del self._docs[doc_id]
+        task_docs = self._task_docs.get(key[0])
+        if task_docs is not None:
+            task_docs.discard(doc_id)
+            if not task_docs:
+                del self._task_docs[key[0]]
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                pos = bisect.bisect_left(self._terms, term)
+                del self._terms[pos]
+
+    def _index_file(self, task_id: str, filename: str):
+        """从执行器读取文件开头（不超过 max_doc_chars 个字符）建立文档；文件已不存在时删除文档"""
+        executor = self.executors.get(task_id)
+        try:
+            content = executor.all_files.read_text(filename, self.max_doc_chars) if executor is not None else None
+        except (KeyError, OSError):
+            content = None  # 建索引前文件已被删除或重命名
+        with self._lock:
+            if content is None:
+                self._remove((task_id, 'file', filename))
+            else:
+                self._put(task_id, 'file', filename, file_search_text(filename, content))
+
+    def _rename(self, task_id: str, kind: str, old_name: Any, new_name: Any):
+        """文件名也被索引，重命名时按新文件名从执行器读取内容重建文档"""
+        with self._lock:
+            self._remove((task_id, kind, old_name))
+        self._index_file(task_id, new_name)
+
+    def _drop_task(self, task_id: str):
+        for doc_id in list(self._task_docs.get(task_id, ())):
+            self._remove(self._docs[doc_id])
+
+    def _reindex_task(self, task_id: str):
+        """按执行器当前的文件和执行日志重建任务的全部文档（结果缓存回放后使用）"""
+        executor = self.executors.get(task_id)
+        with self._lock:
+            self._drop_task(task_id)
+        if executor is None:
+            return
+        for filename in list(executor.all_files):
+            self._index_file(task_id, filename)
+        for record in list(executor.execution_log):
+            with self._lock:
+                self._put(task_id, 'activity', record.id, activity_search_text(record))
+
+    # ---------- 查询 ----------
+
+    def _term_postings(self, token: str, prefix: bool) -> Dict[int, List[int]]:
+        """单个查询词项的倒排表：{文档ID: [位置]}；前缀查询合并所有匹配词项"""
+        if not prefix:
+            return self._postings.get(token, {})
+        merged: Dict[int, List[int]] = {}
+        start = bisect.bisect_left(self._terms, token)
+        for term in itertools.islice(self._terms, start, start + self.PREFIX_EXPANSION):
+            if not term.startswith(token):
+                break
+            for doc_id, positions in self._postings[term].items():
+                merged.setdefault(doc_id, []).extend(positions)
+        return merged
+
+    def _match_phrase(self, tokens: List[str], prefix: bool) -> Dict[int, List[int]]:
+        """
+        匹配连续的词项序列
+
+        Returns:
+            {文档ID: [短语起始位置]}
+        """
+        postings = [self._term_postings(token, prefix and i == len(tokens) - 1)
+                    for i, token in enumerate(tokens)]
+        if not all(postings):
+            return {}
+        # 从文档数最少的词项开始求交集
+        candidates = set(min(postings, key=len))
+        for term_postings in postings:
+            candidates &= term_postings.keys()
+        if len(tokens) == 1:
+            return {doc_id: sorted(postings[0][doc_id]) for doc_id in candidates}
+        matches = {}
+        for doc_id in candidates:
+            # 各词项位置减去其在短语中的偏移后求交集，即短语的起始位置
+            starts = set(postings[0][doc_id])
+            for offset in range(1, len(tokens)):
+                starts.intersection_update(pos - offset for pos in postings[offset][doc_id])
+                if not starts:
+                    break
+            if starts:
+                matches[doc_id] = sorted(starts)
+        return matches
+
+    @classmethod
+    def parse_query(cls, query: str) -> List[Tuple[List[str], bool]]:
+        """
+        解析查询：空白分隔的子句之间为AND关系；引号内为短语；以*结尾的子句对最后一个词做前缀匹配。
+        未加引号的子句切分出多个词项时（如中文）也按短语匹配
+
+        Returns:
+            [(词项列表, 是否前缀)]
+        """
+        clauses = []
+        for match in cls.QUERY_PATTERN.finditer(query):
+            text = match.group(1) if match.group(1) is not None else match.group(2)
+            prefix = text.endswith('*')
+            tokens = cls.tokenize(text.rstrip('*'))
+            if tokens:
+                clauses.append((tokens, prefix))
+        return clauses
+
+    def search(self, query: str, statuses: Optional[List[str]] = None,
+               kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        执行查询，按命中次数降序、任务创建时间倒序排列
+
+        Returns:
+            [{'task_id', 'kind', 'name', 'score', 'positions'}]；positions 为第一个子句的命中位置
+
+        Raises:
+            ValueError: 查询为空
+        """
+        clauses = self.parse_query(query)
+        if not clauses:
+            raise ValueError('q must contain at least one searchable term')
+
+        with self._lock:
+            scores: Optional[Dict[int, int]] = None
+            first_positions: Dict[int, List[int]] = {}
+            for tokens, prefix in clauses:
+                matches = self._match_phrase(tokens, prefix)
+                if scores is None:
+                    scores = {doc_id: len(starts) for doc_id, starts in matches.items()}
+                    first_positions = matches
+                else:
+                    scores = {doc_id: score + len(matches[doc_id])
+                              for doc_id, score in scores.items() if doc_id in matches}
+                if not scores:
+                    return []
+            docs = [(doc_id, self._docs[doc_id], score) for doc_id, score in scores.items()]
+
+        status_set = set(statuses) if statuses else None
+        kind_set = set(kinds) if kinds else None
+        results = []
+        for doc_id, (task_id, kind, name), score in docs:
+            if kind_set is not None and kind not in kind_set:
+                continue
+            record = self.tasks.get(task_id)
+            if record is None or (status_set is not None and record['status'] not in status_set):
+                continue
+            results.append({'task_id': task_id, 'kind': kind, 'name': name, 'score': score,
+                            'status': record['status'], 'positions': first_positions[doc_id],
+                            'length': len(clauses[0][0])})
+        results.sort(key=lambda r: (r['score'], r['task_id']), reverse=True)
+        return results
+
+    def snippet(self, text: str, position: int, length: int) -> Dict[str, Any]:
+        """
+        按词项位置截取命中片段
+
+        Args:
+            text: 文档原文
+            position: 命中的第一个词项位置
+            length: 命中的词项数
+
+        Returns:
+            {'text': 片段, 'highlights': [[起始, 结束]]}（相对片段的字符偏移）
+        """
+        text = text[:self.max_doc_chars]
+        start = end = None
+        for i, (_, token_start, token_end) in enumerate(self.token_spans(text)):
+            if i == position:
+                start = token_start
+            if i == position + length - 1:
+                end = token_end
+                break
+        if start is None or end is None:
+            return {'text': text[:self.SNIPPET_CHARS * 2], 'highlights': []}
+        left = max(0, start - self.SNIPPET_CHARS)
+        right = min(len(text), end + self.SNIPPET_CHARS)
+        fragment = ('…' if left else '') + text[left:right] + ('…' if right < len(text) else '')
+        offset = (1 if left else 0) - left
+        return {'text': fragment, 'highlights': [[start + offset, end + offset]]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'docs': len(self._docs),
+            'terms': len(self._postings),
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'indexed_docs': self.indexed_docs,
+            'indexed_chars': self.indexed_chars,
+            'superseded': self.superseded,
+            'index_seconds': round(self.index_seconds, 3)
+        }
+
+
+def file_search_text(filename: str, content: str) -> str:
+    """文件的可搜索文本：文件名和内容"""
+    return f"{filename}\n{content}"
+
+
+def activity_search_text(record) -> str:
+    """活动的可搜索文本：描述、涉及的文件名、命令和输出"""
+    return '\n'.join(part for part in (record.text, record.filename, record.command, record.output) if part)
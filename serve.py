@@ -0,0 +1,157 @@
+"""
+Resear Pro 后端生产环境启动器
+
+`python app.py` 启动的是带调试器和自动重载的开发服务器，只适合本地调试。
+本脚本使用生产级WSGI服务器运行同一个应用，按以下顺序选择（可用 WEB_SERVER 指定）：
+    gunicorn  - 单个 gthread worker 进程 + 线程池（Linux/macOS）
+    waitress  - 纯Python多线程服务器（Windows也可用）
+    werkzeug  - 关闭调试器和重载的多线程服务器，无需额外依赖
+
+用法:
+    python serve.py
+    WEB_SERVER=waitress WEB_THREADS=128 python serve.py
+
+环境变量:
+    HOST / PORT               监听地址，默认 0.0.0.0:5000
+    WEB_SERVER                auto / gunicorn / waitress / werkzeug
+    WEB_THREADS               请求线程数，默认64；每个流式连接在整个任务期间占用一个线程
+    KEEPALIVE_SECONDS         空闲keep-alive连接的保持时间，默认75，应大于负载均衡的空闲超时
+    SHUTDOWN_DRAIN_SECONDS    收到SIGTERM后等待在途流结束的时间，见 app.shutdown()
+
+注意：任务状态（任务索引、执行器、消息通道）保存在进程内存中，一个后端只能运行一个进程，
+在一个进程内通过 WEB_THREADS 扩展并发连接数。需要更多进程时启动多个后端实例，
+由负载均衡层按 task_id 粘性路由（同一任务的所有请求必须落到创建它的实例上）。
+"""
+
+import os
+import signal
+import logging
+from threading import Thread
+
+import app as backend
+
+logger = logging.getLogger('serve')
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '5000'))
+WEB_SERVER = os.environ.get('WEB_SERVER', 'auto')
+WEB_THREADS = int(os.environ.get('WEB_THREADS', '64'))
+KEEPALIVE_SECONDS = float(os.environ.get('KEEPALIVE_SECONDS', '75'))
+
+SERVERS = ('gunicorn', 'waitress', 'werkzeug')
+
+
+def install_shutdown_handler(stop_server):
+    """
+    SIGTERM/SIGINT 时在后台线程中排空流、保存任务状态，然后停止服务器
+
+    Args:
+        stop_server: 排空完成后调用，停止接受连接并退出服务循环
+    """
+    def handle_signal(signum, frame):
+        if backend.server_draining.is_set():
+            return
+        logger.info(f"Received signal {signum}, shutting down gracefully...")
+
+        def drain_and_stop():
+            backend.shutdown()
+            stop_server()
+        Thread(target=drain_and_stop, name='graceful-shutdown', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    def post_worker_init(worker):
+        backend.start_background_services()
+        # gunicorn的worker收到SIGTERM后只等待在途请求，先排空流再交给它处理退出
+        install_shutdown_handler(lambda: worker.handle_exit(signal.SIGTERM, None))
+
+    class BackendApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{HOST}:{PORT}',
+                'workers': 1,  # 任务状态在进程内存中，见模块说明
+                'worker_class': 'gthread',
+                'threads': WEB_THREADS,
+                'keepalive': KEEPALIVE_SECONDS,
+                # gthread worker的心跳与请求时长无关，长时间的流式响应不会触发超时
+                'timeout': 120,
+                'graceful_timeout': backend.SHUTDOWN_DRAIN_SECONDS + 10,
+                'post_worker_init': post_worker_init,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return backend.create_app()
+
+    BackendApplication().run()
+
+
+def run_waitress():
+    from waitress import create_server
+
+    server = create_server(
+        backend.create_app(),
+        host=HOST,
+        port=PORT,
+        threads=WEB_THREADS,
+        # 连接无数据收发超过该时间才关闭；流式连接有心跳，不会被误关
+        channel_timeout=max(KEEPALIVE_SECONDS, backend.HEARTBEAT_INTERVAL * 3),
+        connection_limit=max(WEB_THREADS * 4, 100),
+        asyncore_use_poll=True,
+    )
+    backend.start_background_services()
+    install_shutdown_handler(server.close)
+    server.run()
+
+
+def run_werkzeug():
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        # HTTP/1.1 才能在同一连接上复用请求并使用分块传输
+        protocol_version = 'HTTP/1.1'
+        # 空闲连接读超时；流式响应期间只写不读，不受影响
+        timeout = KEEPALIVE_SECONDS
+
+    server = make_server(HOST, PORT, backend.create_app(), threaded=True,
+                         request_handler=KeepAliveRequestHandler)
+    server.daemon_threads = True
+    backend.start_background_services()
+    install_shutdown_handler(server.shutdown)
+    server.serve_forever()
+
+
+def resolve_server(name: str) -> str:
+    """auto 时选择第一个可导入的服务器"""
+    if name != 'auto':
+        if name not in SERVERS:
+            raise SystemExit(f"WEB_SERVER must be one of {['auto', *SERVERS]}")
+        return name
+    for candidate in SERVERS[:-1]:
+        try:
+            __import__(candidate)
+            return candidate
+        except ImportError:
+            continue
+    return 'werkzeug'
+
+
+def main():
+    server = resolve_server(WEB_SERVER)
+    if int(os.environ.get('WEB_WORKERS', '1')) > 1:
+        logger.warning("WEB_WORKERS is no longer supported: task state lives in process memory, "
+                       "running 1 process (scale with WEB_THREADS or run separate instances)")
+    logger.info(f"Starting Resear Pro backend with {server} on {HOST}:{PORT} "
+                f"(threads={WEB_THREADS}, "
+                f"keepalive={KEEPALIVE_SECONDS}s)")
+    {'gunicorn': run_gunicorn, 'waitress': run_waitress, 'werkzeug': run_werkzeug}[server]()
+
+
+if __name__ == '__main__':
+    main()
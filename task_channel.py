@@ -0,0 +1,443 @@
+"""
+任务消息通道
+
+TaskChannel 按序记录任务发出的消息，客户端通过 ChannelSubscription 从任意序号开始读取，
+积压时按策略背压、合并或丢弃，并让控制消息越过批量消息先发送；
+TaskStateView 是随消息增量更新的任务当前状态，供中途加入的客户端以快照方式订阅。
+模块只依赖标准库，配置由 app 创建通道时传入。
+"""
+
+import bisect
+import queue
+import time
+from collections import deque, OrderedDict
+from threading import Condition, Event
+from typing import Dict, Any, Optional, List
+
+class TaskStateView:
+    """
+    任务当前状态的物化视图
+
+    由通道在发布每条消息时增量更新（在通道锁内，与消息序号一致），保存客户端界面需要的当前状态：
+    最近的任务状态、活动列表及其状态、当前文件、文件结构和终端输出的末尾。
+    中途加入的客户端先收到一条 state_snapshot，再从快照对应的序号接收后续消息，
+    不需要重放包括已被取代的文件内容在内的全部历史
+    """
+
+    def __init__(self, terminal_lines: int = 100, max_line_chars: int = 4096):
+        self.max_line_chars = max_line_chars  # 单行的最大字符数，超出截断
+        self._task: Dict[str, Any] = {}  # 最近一条 task_update 的数据
+        self._activities: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+        self._file: Optional[Dict[str, Any]] = None  # 当前文件最近一条 file_update 的数据
+        self._structure: Optional[Dict[str, Any]] = None  # 最近一条 file_structure_update 的数据
+        self._terminal: deque = deque(maxlen=terminal_lines)  # 终端输出的最近若干行
+        self._terminal_command: Optional[int] = None  # 正在分块输出的命令ID
+        self._open_line: Optional[int] = None  # 最后一行尚未换行时所属的命令ID
+
+    def apply(self, message: Dict[str, Any]):
+        """按一条消息更新视图；消息数据不会被修改（与历史中的消息共享）"""
+        msg_type = message.get('type')
+        data = message.get('data')
+        if msg_type == 'task_update':
+            self._task = data
+        elif msg_type == 'activity':
+            self._activities[data['id']] = data
+        elif msg_type == 'activity_update':
+            previous = self._activities.get(data['id'])
+            if previous is not None:
+                self._activities[data['id']] = {**previous, **data}
+        elif msg_type == 'file_update':
+            self._file = data
+        elif msg_type == 'file_delete':
+            if self._file is not None and self._file['filename'] == data['filename']:
+                self._file = None
+        elif msg_type == 'file_rename':
+            if self._file is not None and self._file['filename'] == data['old_name']:
+                self._file = {**self._file, 'filename': data['new_name']}
+        elif msg_type == 'file_structure_update':
+            self._structure = data
+        elif msg_type == 'terminal_chunk':
+            if self._terminal_command != data['command_id']:
+                self._terminal_command = data['command_id']
+                self._open_line = None
+                self._terminal.append(f"$ {data['command']}")
+            self._write_terminal(data['command_id'], data['output'])
+        elif msg_type == 'terminal':
+            self._open_line = None
+            if not data.get('streamed'):
+                self._terminal_command = None
+                self._terminal.append(f"$ {data['command']}")
+                self._write_terminal(None, data['output'])
+            elif self._terminal_command != data.get('command_id'):
+                # 没有任何输出的命令
+                self._terminal.append(f"$ {data['command']}")
+
+    def _write_terminal(self, command_id: Optional[int], text: str):
+        if not text:
+            return
+        pieces = text.split('\n')
+        if command_id is not None and self._open_line == command_id and self._terminal:
+            self._terminal[-1] = (self._terminal[-1] + pieces[0])[:self.max_line_chars]
+        else:
+            self._terminal.append(pieces[0][:self.max_line_chars])
+        self._terminal.extend(piece[:self.max_line_chars] for piece in pieces[1:-1])
+        if len(pieces) > 1 and pieces[-1]:
+            self._terminal.append(pieces[-1][:self.max_line_chars])
+        self._open_line = command_id if pieces[-1] else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'task': self._task,
+            'activities': list(self._activities.values()),
+            'current_file': self._file['filename'] if self._file is not None else None,
+            'file': self._file,
+            'file_structure': self._structure,
+            'terminal': list(self._terminal)
+        }
+
+
+class TaskChannel:
+    """
+    任务消息通道
+    按序记录任务发出的消息（历史位置即消息序号），客户端以订阅的方式从任意序号开始读取，
+    可随时连接和断开；没有订阅者时任务照常执行。
+
+    有界：最慢的订阅者尚未读取的消息（不计合并的空位）达到 capacity 条时按策略处理
+        block    - 发布方阻塞等待（暂停执行器的步骤流水线）
+        coalesce - 被取代的消息（同一文件较早的 file_update、较早的 file_structure_update）
+                   在新消息写入历史后合并为空位，空位不计入积压；取代积压中消息的新消息直接发布，
+                   其余消息在积压过多时阻塞
+        drop     - 落后的订阅者跳到最新位置，下一条收到 resync 标记
+    历史超过 history_limit 条时丢弃所有订阅者都已读过的最早消息，
+    从已丢弃位置开始读取的订阅者同样收到 resync 标记；
+    从尚未发布的序号订阅时（任务从检查点恢复，客户端收到过检查点之后、进程退出前的消息，
+    这些消息已被回退）从通道的第一条消息开始，同样先收到 resync 标记
+
+    优先级：订阅者积压时，控制消息（PRIORITY_TYPES）越过尚未发送的文件、终端等批量消息先发送，
+    大的 file_update 可按订阅者设置拆成 file_chunk 分段，分段之间可以插入控制消息。
+    控制消息之间、批量消息之间（包括同一文件的更新、删除和重命名）仍按发布顺序发送。
+    sequence 始终是消息在任务中的位置，但到达顺序不再保证递增（分段带原消息的 sequence）；
+    断线重连时 since 应取连续收到的最大序号加1，提前收到过的控制消息会再次收到，客户端按 sequence 去重
+
+    每条消息同时应用到通道的状态视图（TaskStateView）。以快照方式订阅时第一条消息是 state_snapshot，
+    其 sequence 为快照之后第一条消息的序号；之后出现 trimmed、dropped 等需要重新同步的情况时
+    同样发送新的快照而不是 resync 标记
+    """
+
+    POLICIES = ('block', 'coalesce', 'drop')
+    PRIORITY_TYPES = frozenset(('task_update', 'activity', 'activity_update'))  # 控制消息类型
+
+    def __init__(self, capacity: int = 0, policy: str = 'coalesce', history_limit: int = 0, base: int = 0,
+                 view: Optional[TaskStateView] = None):
+        self.capacity = capacity  # 订阅者允许落后的最大消息数，0表示不限制
+        self.policy = policy
+        self.history_limit = history_limit  # 保留的最大历史消息数，0表示不限制
+        self.history: List[Optional[Dict[str, Any]]] = []  # 已发布的消息，被合并的位置为None
+        self.base = base  # history[0] 的消息序号；从检查点恢复的任务从已发送的消息数开始
+        self.start = base  # 通道的第一条消息序号
+        self.subscriptions: set = set()
+        self.closed = False  # 任务被清理后关闭，不再接受消息
+        self._cond = Condition()
+        self._publisher_waiting = False
+        self._latest_file: Dict[str, int] = {}  # 文件名 -> 最近一条 file_update 的序号
+        self._latest_structure: Optional[int] = None  # 最近一条 file_structure_update 的序号
+        self._priority: List[int] = []  # 历史中控制消息的序号（升序）
+        self._superseded: List[int] = []  # 历史中被合并为空位的序号（升序）
+        self.view = view if view is not None else TaskStateView()  # 任务当前状态
+        # 指标
+        self.high_water = 0  # 观测到的最大积压消息数
+        self.coalesced = 0  # 被合并的消息数
+        self.dropped = 0  # 因 drop 策略跳过的消息数
+        self.blocked_seconds = 0.0  # 发布方因背压阻塞的累计时间
+        self.preempted = 0  # 越过积压的批量消息提前发送的控制消息数
+        self.snapshots = 0  # 发送的状态快照数
+
+    @property
+    def end(self) -> int:
+        """下一条消息的序号"""
+        return self.base + len(self.history)
+
+    def _pending(self, cursor: int) -> int:
+        """游标之后尚未读取的消息数，不计被合并的空位"""
+        cursor = max(cursor, self.base)
+        return self.end - cursor - (len(self._superseded) - bisect.bisect_left(self._superseded, cursor))
+
+    def _lag(self) -> int:
+        if not self.subscriptions:
+            return 0
+        return self._pending(min(sub.cursor for sub in self.subscriptions))
+
+    def _live(self, seq: Optional[int]) -> bool:
+        return seq is not None and seq >= self.base and self.history[seq - self.base] is not None
+
+    def _replaces_pending(self, message: Dict[str, Any]) -> bool:
+        """
+        消息是否会取代最慢的订阅者尚未读取的消息；
+        这时发布后积压的消息数不变，不需要等待
+        """
+        msg_type = message.get('type')
+        if msg_type == 'file_update':
+            seq = self._latest_file.get(message['data']['filename'])
+        elif msg_type == 'file_structure_update':
+            seq = self._latest_structure
+        else:
+            return False
+        return (self._live(seq) and bool(self.subscriptions)
+                and seq >= min(sub.cursor for sub in self.subscriptions))
+
+    def _supersede(self, seq: Optional[int]):
+        """把已被取代的消息位置置空"""
+        if self._live(seq):
+            self.history[seq - self.base] = None
+            bisect.insort(self._superseded, seq)
+            self.coalesced += 1
+
+    def _coalesce(self, message: Dict[str, Any], seq: int):
+        """message（序号为seq，已写入历史）取代同一文件较早的 file_update 或较早的 file_structure_update"""
+        msg_type = message.get('type')
+        if msg_type == 'file_update':
+            filename = message['data']['filename']
+            self._supersede(self._latest_file.get(filename))
+            self._latest_file[filename] = seq
+        elif msg_type == 'file_structure_update':
+            self._supersede(self._latest_structure)
+            self._latest_structure = seq
+        elif msg_type == 'file_delete':
+            self._latest_file.pop(message['data']['filename'], None)
+        elif msg_type == 'file_rename':
+            self._latest_file.pop(message['data']['old_name'], None)
+            self._latest_file.pop(message['data']['new_name'], None)
+
+    def _trim(self):
+        """丢弃所有订阅者都已读过的最早历史，超出上限25%时才整理以摊销开销"""
+        if not self.history_limit or len(self.history) <= self.history_limit + self.history_limit // 4:
+            return
+        cut = len(self.history) - self.history_limit
+        if self.subscriptions:
+            cut = min(cut, min(sub.cursor for sub in self.subscriptions) - self.base)
+        if cut > 0:
+            del self.history[:cut]
+            self.base += cut
+            del self._priority[:bisect.bisect_left(self._priority, self.base)]
+            del self._superseded[:bisect.bisect_left(self._superseded, self.base)]
+
+    def publish(self, message: Dict[str, Any]) -> bool:
+        """
+        发布消息
+
+        Returns:
+            是否发布成功（通道已关闭时返回False）
+        """
+        with self._cond:
+            coalesce = self.policy != 'block'
+            if self.capacity and self._lag() >= self.capacity:
+                if self.policy == 'drop':
+                    for sub in self.subscriptions:
+                        pending = self._pending(sub.cursor)
+                        if pending >= self.capacity:
+                            self.dropped += pending
+                            sub.cursor = self.end
+                            sub.resync_reason = 'dropped'
+                else:
+                    started = time.monotonic()
+                    while (not self.closed and self._lag() >= self.capacity
+                           and not (coalesce and self._replaces_pending(message))):
+                        self._publisher_waiting = True
+                        self._cond.wait(1)
+                    self.blocked_seconds += time.monotonic() - started
+            self._publisher_waiting = False
+            if self.closed:
+                return False
+            self.history.append(message)
+            if coalesce:
+                self._coalesce(message, self.end - 1)
+            self.view.apply(message)
+            if message.get('type') in self.PRIORITY_TYPES:
+                self._priority.append(self.end - 1)
+            self.high_water = max(self.high_water, self._lag())
+            self._trim()
+            waiters = [sub.waiter for sub in self.subscriptions if sub.waiter is not None]
+            self._cond.notify_all()
+        for waiter in waiters:
+            waiter.set()
+        return True
+
+    def subscribe(self, since: int = 0, waiter: Optional[Event] = None,
+                  priority: bool = True, chunk_size: int = 0, snapshot: bool = False) -> 'ChannelSubscription':
+        """
+        从指定序号开始订阅
+
+        Args:
+            since: 起始消息序号
+            waiter: 有新消息时需要唤醒的Event（多路复用流使用）
+            priority: 积压时控制消息是否先于批量消息发送
+            chunk_size: 大于0时，内容超过该字符数的 file_update 拆成 file_chunk 分段发送
+            snapshot: 为True时先发送 state_snapshot 再接收之后的消息；
+                      since 在保留的历史范围内（且大于0）时仍从 since 继续，视为断线重连
+        """
+        with self._cond:
+            if snapshot and (since <= 0 or since > self.end or since < self.base):
+                subscription = ChannelSubscription(self, self.end, waiter, priority, chunk_size)
+                subscription.resync_reason = 'joined'
+            elif since > self.end:
+                subscription = ChannelSubscription(self, max(self.start, self.base), waiter, priority, chunk_size)
+                subscription.resync_reason = 'rewound'
+            else:
+                subscription = ChannelSubscription(self, max(since, 0), waiter, priority, chunk_size)
+            # 断线重连的订阅者之后因积压或历史整理重新同步时同样收到状态快照
+            subscription.snapshot = snapshot
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: 'ChannelSubscription'):
+        with self._cond:
+            self.subscriptions.discard(subscription)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            waiters = [sub.waiter for sub in self.subscriptions if sub.waiter is not None]
+        for waiter in waiters:
+            waiter.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'capacity': self.capacity,
+                'pending': self._lag(),
+                'high_water': self.high_water,
+                'history': len(self.history),
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'preempted': self.preempted,
+                'snapshots': self.snapshots,
+                'subscribers': len(self.subscriptions)
+            }
+
+
+class ChannelSubscription:
+    """任务消息通道上的一个读取游标"""
+
+    def __init__(self, channel: TaskChannel, cursor: int, waiter: Optional[Event] = None,
+                 priority: bool = True, chunk_size: int = 0):
+        self.channel = channel
+        self.cursor = cursor  # 下一条要按顺序读取的消息序号
+        self.waiter = waiter
+        self.priority = priority  # 积压时控制消息先于批量消息发送
+        self.chunk_size = chunk_size  # 大于0时按该字符数拆分大的 file_update
+        self.resync_reason: Optional[str] = None  # 有值时下一条返回 resync 标记（或状态快照）
+        self.snapshot = False  # 重新同步时发送状态快照
+        self._ahead: deque = deque()  # 已提前发送、游标尚未越过的控制消息序号（按发送顺序即升序）
+        self._chunks: deque = deque()  # 正在分段发送的消息的剩余分段
+
+    def _resync(self, reason: str) -> Dict[str, Any]:
+        """重新同步：以快照方式订阅时发送当前状态快照并跳到最新位置，否则发送 resync 标记"""
+        self.resync_reason = None
+        self._ahead.clear()
+        self._chunks.clear()
+        channel = self.channel
+        if self.snapshot:
+            self.cursor = channel.end
+            channel.snapshots += 1
+            return {'type': 'state_snapshot', 'reason': reason, 'data': channel.view.snapshot(),
+                    'sequence': self.cursor}
+        return {'type': 'resync', 'reason': reason, 'sequence': self.cursor}
+
+    def _split(self, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """把 file_update 拆成 file_chunk 分段：content 为第 index 段（共 count 段），其余字段与原消息相同"""
+        data = message['data']
+        content = data['content']
+        size = self.chunk_size
+        count = (len(content) + size - 1) // size
+        return [{**message, 'type': 'file_chunk',
+                 'data': {**data, 'content': content[i * size:(i + 1) * size], 'index': i, 'count': count}}
+                for i in range(count)]
+
+    def _next(self) -> Optional[Dict[str, Any]]:
+        """
+        取下一条要发送的消息，没有时返回None：
+        积压中尚未发送的控制消息优先，其次是正在分段发送的消息的下一段，最后是游标处的消息
+        """
+        channel = self.channel
+        self._drop_passed()
+        if self.priority and (self._chunks or self.cursor < channel.end):
+            # 控制消息按序号顺序提前发送，下一条是最后一条已提前发送的之后（或游标处起）的第一条
+            positions = channel._priority
+            i = bisect.bisect_right(positions, self._ahead[-1] if self._ahead else self.cursor - 1)
+            if i < len(positions) and (positions[i] > self.cursor or self._chunks):
+                self._ahead.append(positions[i])
+                channel.preempted += 1
+                return channel.history[positions[i] - channel.base]
+        if self._chunks:
+            return self._chunks.popleft()
+        while self.cursor < channel.end:
+            seq = self.cursor
+            message = channel.history[seq - channel.base]
+            self.cursor += 1
+            if self._ahead and self._ahead[0] == seq:
+                self._ahead.popleft()
+                continue
+            if message is None:
+                continue
+            if (self.chunk_size and message.get('type') == 'file_update'
+                    and len(message['data']['content']) > self.chunk_size):
+                chunks = self._split(message)
+                self._chunks.extend(chunks[1:])
+                return chunks[0]
+            return message
+        return None
+
+    def _drop_passed(self):
+        """丢弃游标已越过的提前发送记录（订阅者被跳到最新位置时）"""
+        while self._ahead and self._ahead[0] < self.cursor:
+            self._ahead.popleft()
+
+    def caught_up(self) -> bool:
+        """是否已发送完当前所有消息（结束通知可能越过积压的消息提前发出，流在此之后才能结束）"""
+        channel = self.channel
+        with channel._cond:
+            if self._chunks:
+                return False
+            # 控制消息不会被合并，游标之后尚未读取的有效消息恰好都已提前发送时即已追上
+            self._drop_passed()
+            return channel._pending(self.cursor) == len(self._ahead)
+
+    def get(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """读取下一条消息（跳过被合并的位置，积压时控制消息优先），超时抛出queue.Empty"""
+        channel = self.channel
+        with channel._cond:
+            if self.cursor < channel.base:
+                self.cursor = channel.base
+                self.resync_reason = 'trimmed'
+            if self.resync_reason is not None:
+                return self._resync(self.resync_reason)
+
+            deadline = None
+            while True:
+                message = self._next()
+                if message is not None:
+                    if channel._publisher_waiting:
+                        channel._cond.notify_all()
+                    return message
+                if channel.closed or timeout == 0:
+                    raise queue.Empty
+                if deadline is None and timeout is not None:
+                    deadline = time.monotonic() + timeout
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                if channel._publisher_waiting:
+                    channel._cond.notify_all()
+                channel._cond.wait(remaining)
+                if self.resync_reason is not None:
+                    return self._resync(self.resync_reason)
+
+    def get_nowait(self) -> Dict[str, Any]:
+        return self.get(timeout=0)
+
+    def close(self):
+        self.channel.unsubscribe(self)
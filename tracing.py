@@ -0,0 +1,195 @@
+"""
+追踪与性能分析
+
+TaskTrace 是单个任务的span环形缓冲区，可导出为 Chrome trace-event 格式；traced 装饰器为执行器方法记录span；
+SamplingProfiler 是按需开启的进程级采样分析器，输出折叠栈。
+模块只依赖标准库，缓冲区大小和采样间隔由 app 创建时传入。
+"""
+
+import functools
+import logging
+import os
+import sys
+import time
+from collections import deque
+from threading import Thread, Lock, Event, get_ident, current_thread
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_TRACE_EPOCH = time.perf_counter()  # 所有任务共用的时间原点，便于在同一视图中对比
+
+
+class TraceSpan:
+    """计时上下文，退出时把一个完整事件写入所属的追踪缓冲区"""
+
+    __slots__ = ('trace', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, trace: 'TaskTrace', name: str, cat: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.record(self.name, self.cat, self.start, end, self.args)
+        return False
+
+
+class TaskTrace:
+    """
+    单个任务的追踪缓冲区
+
+    span 保存在定长环形缓冲区中，超出 size 条后丢弃最早的记录；
+    导出为 Chrome trace-event 格式，可直接在 chrome://tracing 或 Perfetto 中打开
+    """
+
+    def __init__(self, size: int = 4096):
+        self.events: deque = deque(maxlen=size)  # (name, cat, start, end, tid, args)
+        self.threads: Dict[int, str] = {}  # 线程ID -> 线程名
+        self.recorded = 0
+
+    def span(self, name: str, cat: str = 'task', **args) -> TraceSpan:
+        return TraceSpan(self, name, cat, args)
+
+    def record(self, name: str, cat: str, start: float, end: float, args: Optional[Dict[str, Any]] = None):
+        tid = get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = current_thread().name
+        self.events.append((name, cat, start, end, tid, args))
+        self.recorded += 1
+
+    @property
+    def dropped(self) -> int:
+        return self.recorded - len(self.events)
+
+    def to_chrome(self, **metadata) -> Dict[str, Any]:
+        """转换为 Chrome trace-event JSON（时间单位微秒）"""
+        pid = os.getpid()
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in list(self.threads.items())
+        ]
+        for name, cat, start, end, tid, args in list(self.events):
+            event = {
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': round((start - _TRACE_EPOCH) * 1e6, 3),
+                'dur': round((end - start) * 1e6, 3),
+                'pid': pid,
+                'tid': tid
+            }
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'otherData': {**metadata, 'recorded': self.recorded, 'dropped': self.dropped}
+        }
+
+
+def traced(name: Optional[str] = None, cat: str = 'executor'):
+    """
+    为执行器方法（或以执行器为第一个参数的函数）记录span
+
+    未开启追踪的任务（trace 为 None）直接调用原函数，只多一次属性判断
+    """
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(executor, *args, **kwargs):
+            trace = executor.trace
+            if trace is None:
+                return func(executor, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(executor, *args, **kwargs)
+            finally:
+                trace.record(span_name, cat, start, time.perf_counter())
+        return wrapper
+    return decorate
+
+
+class SamplingProfiler:
+    """
+    进程级采样分析器
+
+    开启后由后台线程按固定间隔读取 sys._current_frames()，把各线程的调用栈聚合为
+    折叠栈计数（flamegraph.pl / speedscope 可直接读取）；关闭时没有任何线程或钩子
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.samples: Dict[str, int] = {}  # 折叠栈 -> 采样次数
+        self.sample_count = 0
+        self.interval = interval  # 默认采样间隔（秒）
+        self.started_at: Optional[float] = None
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None, reset: bool = False):
+        """开始采样；已在运行时只更新采样间隔（采样线程每轮读取，立即生效）"""
+        with self._lock:
+            if reset:
+                self.samples = {}
+                self.sample_count = 0
+            self.interval = interval or self.interval
+            if self.running:
+                return
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        logger.info(f"Sampling profiler started (interval {self.interval}s)")
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        if thread is not None:
+            thread.join()
+            logger.info(f"Sampling profiler stopped ({self.sample_count} samples)")
+
+    def _run(self):
+        own = get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """返回折叠栈格式文本，每行 "frame;frame;frame count" """
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(list(self.samples.items())))
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        busiest = sorted(list(self.samples.items()), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'started_at': self.started_at,
+            'samples': self.sample_count,
+            'stacks': len(self.samples),
+            'top': [{'stack': stack.split(';'), 'count': count} for stack, count in busiest]
+        }